@@ -0,0 +1,350 @@
+"""
+Wall time, query count and memory allocated by the facade operations and the checkout views, for small and
+large baskets, against a stubbed Stripe transport.  Results can be saved as JSON and compared with an
+earlier run.
+
+    python -m benchmarks.checkout --output results.json
+    python -m benchmarks.checkout --latency 150 --compare results.json
+"""
+import argparse
+import json
+import platform
+import sys
+from datetime import datetime, timezone
+from decimal import Decimal as D
+
+from benchmarks.loadtest import SESSION_ID
+from benchmarks.utils import make_basket, profile, reload_basket, setup, start_checkout
+
+SIZES = (5, 100)
+
+# The Stripe requests each operation may make.  A change that adds a round trip fails the run.
+STRIPE_REQUESTS = {
+    "Facade.begin (new session)": 1,
+    "Facade.begin (reused session)": 0,
+    "Facade.capture": 1,
+    "StripeSCAPaymentDetailsView GET": 1,
+    "StripeSCASuccessResponseView GET": 0,
+    "StripeSCASuccessResponseView POST": 1,
+}
+
+
+def get_versions():
+    from importlib.metadata import PackageNotFoundError, version
+
+    versions = {"python": platform.python_version()}
+    for name in ("django-oscar-stripe-sca", "django", "django-oscar", "stripe"):
+        try:
+            versions[name] = version(name)
+        except PackageNotFoundError:
+            versions[name] = None
+    return versions
+
+
+class CheckoutBenchmarks(object):
+    """
+    Each ``bench_*`` method returns a list of ``(operation, func, setup)`` to profile for a basket size.
+    """
+    def __init__(self, transport):
+        from oscar.test.factories import CountryFactory, UserFactory
+
+        self.transport = transport
+        self.fake_stripe = transport.stripe
+        self.country = CountryFactory(iso_3166_1_a2="GB", printable_name="United Kingdom")
+        self.user = UserFactory()
+        self.voucher = None
+
+    def get_voucher(self):
+        from oscar.test.factories import VoucherFactory, create_offer
+
+        if self.voucher is None:
+            self.voucher = VoucherFactory()
+            self.voucher.offers.add(create_offer(name="Benchmark voucher offer", offer_type="Voucher"))
+        return self.voucher
+
+    def get_total(self, basket):
+        from oscar.core.prices import Price
+
+        return Price(basket.currency, basket.total_excl_tax, incl_tax=basket.total_incl_tax)
+
+    def bench_convert_to_cents(self, size):
+        from oscar_stripe_sca.facade import Facade
+
+        facade = Facade()
+        prices = [line.unit_price_incl_tax for line in make_basket(size).all_lines()]
+
+        def run():
+            for price in prices:
+                facade.convert_to_cents(price, "GBP")
+
+        return [("Facade.convert_to_cents", run, None)]
+
+    def bench_begin(self, size):
+        from django.test import override_settings
+        from oscar.apps.shipping.methods import Free
+        from oscar_stripe_sca.facade import Facade
+
+        basket = make_basket(size)
+        total = self.get_total(basket)
+
+        def new_session():
+            with override_settings(STRIPE_SESSION_REUSE_TTL=0):
+                Facade().begin(self.user.email, reload_basket(basket), total, Free())
+
+        def reused_session():
+            Facade().begin(self.user.email, reload_basket(basket), total, Free())
+
+        # Prime the session cache for the reuse case
+        reused_session()
+        return [("Facade.begin (new session)", new_session, None), ("Facade.begin (reused session)", reused_session, None)]
+
+    def bench_capture(self, size):
+        from oscar.apps.payment.models import Source, SourceType
+        from oscar.test.factories import create_order
+        from oscar_stripe_sca import PAYMENT_METHOD_STRIPE
+        from oscar_stripe_sca.facade import Facade
+
+        source_type, __ = SourceType.objects.get_or_create(name=PAYMENT_METHOD_STRIPE)
+        order = create_order(basket=make_basket(size), user=self.user)
+
+        def prepare():
+            Source.objects.filter(order=order).delete()
+            intent = self.fake_stripe.create_payment_intent(
+                int(order.total_incl_tax * 100), "gbp", status="requires_capture")
+            Source.objects.create(
+                order=order, source_type=source_type, currency=order.currency,
+                amount_allocated=order.total_incl_tax, amount_debited=D('0.00'), reference=intent["id"])
+            return ()
+
+        def run():
+            Facade().capture(order.number)
+
+        return [("Facade.capture", run, prepare)]
+
+    def bench_load_frozen_basket(self, size):
+        from django.test import RequestFactory, override_settings
+        from oscar_stripe_sca.views import StripeSCASuccessResponseView
+
+        basket = make_basket(size, owner=self.user)
+        # A voucher, so that there are offers to apply
+        basket.vouchers.add(self.get_voucher())
+        basket.freeze()
+        request = RequestFactory().get("/")
+        request.user = self.user
+        view = StripeSCASuccessResponseView()
+        view.request = request
+
+        def uncached():
+            with override_settings(STRIPE_OFFER_CACHE_TTL=0):
+                view.load_frozen_basket(basket.id).total_incl_tax
+
+        def cached():
+            # Lines are loaded and priced on every preview
+            view.load_frozen_basket(basket.id).total_incl_tax
+
+        # Prime the offer cache
+        cached()
+        return [
+            ("StripeSCASuccessResponseView.load_frozen_basket", uncached, None),
+            ("StripeSCASuccessResponseView.load_frozen_basket (cached)", cached, None),
+        ]
+
+    def start_checkout(self, size):
+        make_basket(size, owner=self.user)
+        return start_checkout(self.user, self.country)
+
+    def bench_views(self, size):
+        from django.urls import reverse
+
+        def expect(response, status):
+            if response.status_code != status:
+                raise AssertionError("Expected {0} from {1}, got {2}".format(
+                    status, response.request["PATH_INFO"], response.status_code))
+
+        def payment_details(client):
+            response = client.get(reverse("checkout:stripe-payment-details"))
+            expect(response, 200)
+            return response
+
+        def paid_at_stripe(client):
+            response = payment_details(client)
+            # The customer pays and Stripe sends them back to the success URL
+            session = self.fake_stripe.complete_session(SESSION_ID.search(response.content.decode()).group("id"))
+            return client, reverse("checkout:stripe-preview", args=[session["client_reference_id"]])
+
+        def preview(client, url):
+            expect(client.get(url), 200)
+
+        def place_order(client, url):
+            expect(client.post(url), 302)
+
+        def previewed(client):
+            client, url = paid_at_stripe(client)
+            preview(client, url)
+            return client, url
+
+        return [
+            ("StripeSCAPaymentDetailsView GET", payment_details, lambda: (self.start_checkout(size),)),
+            ("StripeSCASuccessResponseView GET", preview, lambda: paid_at_stripe(self.start_checkout(size))),
+            ("StripeSCASuccessResponseView POST", place_order, lambda: previewed(self.start_checkout(size))),
+        ]
+
+    def check_duplicate_submissions(self, size, submissions):
+        """
+        Post the place order form for one basket from ``submissions`` threads at once, as a double click or a
+        retrying mobile browser would, and return a message for each way it went wrong: only one order may be
+        placed and captured, and every submission has to be sent on to its thank you page.
+        """
+        from django.test import override_settings
+
+        # SQLite doesn't wait for a table another thread is writing to, so saving the sessions of the
+        # concurrent requests could fail with a 400
+        with override_settings(SESSION_ENGINE="django.contrib.sessions.backends.cache"):
+            return self._check_duplicate_submissions(size, submissions)
+
+    def _check_duplicate_submissions(self, size, submissions):
+        import threading
+
+        from django.test import Client
+        from django.urls import reverse
+        from oscar.apps.order.models import Order
+
+        client = self.start_checkout(size)
+        response = client.get(reverse("checkout:stripe-payment-details"))
+        session = self.fake_stripe.complete_session(SESSION_ID.search(response.content.decode()).group("id"))
+        basket_id = session["client_reference_id"]
+        url = reverse("checkout:stripe-preview", args=[basket_id])
+        client.get(url)
+
+        requests = self.transport.requests
+        barrier = threading.Barrier(submissions)
+        responses = []
+
+        def submit():
+            from django.db import connections
+
+            duplicate = Client()
+            duplicate.cookies = client.cookies
+            barrier.wait()
+            try:
+                responses.append(duplicate.post(url))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=submit) for __ in range(submissions)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        failures = []
+        orders = Order.objects.filter(basket_id=basket_id).count()
+        if orders != 1:
+            failures.append("{0} duplicate submissions placed {1} orders".format(submissions, orders))
+        if self.transport.requests - requests > STRIPE_REQUESTS["StripeSCASuccessResponseView POST"]:
+            failures.append("{0} duplicate submissions made {1} Stripe requests".format(
+                submissions, self.transport.requests - requests))
+        thank_you = reverse("checkout:thank-you")
+        redirects = [r["Location"] for r in responses if r.status_code == 302]
+        if len(responses) != submissions or any(location != thank_you for location in redirects) or (
+                len(redirects) != submissions):
+            failures.append("Not every duplicate submission was sent to the thank you page: {0}".format(
+                sorted(set((r.status_code, r.get("Location")) for r in responses))))
+        return failures
+
+    def run(self, sizes, repeat):
+        results = []
+        for name in ("convert_to_cents", "begin", "capture", "load_frozen_basket", "views"):
+            for size in sizes:
+                for operation, func, prepare in getattr(self, "bench_{0}".format(name))(size):
+                    result = profile(
+                        func, repeat=repeat, setup=prepare,
+                        counters={"stripe_requests": lambda: self.transport.requests})
+                    result.update(operation=operation, lines=size)
+                    results.append(result)
+                    print_result(result)
+        return results
+
+
+def print_result(result, previous=None):
+    line = "{0:<50} {1:>6} {2:>10.2f} {3:>8} {4:>7} {5:>10.1f}".format(
+        result["operation"], result["lines"], result["wall_ms"], result["queries"], result["stripe_requests"],
+        result["peak_kib"])
+    if previous is not None:
+        line += " {0:>+8.1f}% {1:>+6} {2:>+6}".format(
+            (result["wall_ms"] / previous["wall_ms"] - 1) * 100 if previous["wall_ms"] else 0,
+            result["queries"] - previous["queries"],
+            result["stripe_requests"] - previous.get("stripe_requests", result["stripe_requests"]))
+    print(line)
+
+
+def check_stripe_requests(results):
+    """
+    Return a message for each operation that made more Stripe requests than STRIPE_REQUESTS allows.
+    """
+    return [
+        "{0} ({1} lines) made {2} Stripe requests, expected at most {3}".format(
+            result["operation"], result["lines"], result["stripe_requests"], STRIPE_REQUESTS[result["operation"]])
+        for result in results
+        if result["operation"] in STRIPE_REQUESTS and result["stripe_requests"] > STRIPE_REQUESTS[result["operation"]]
+    ]
+
+
+def compare(results, path):
+    with open(path) as f:
+        previous = dict(((r["operation"], r["lines"]), r) for r in json.load(f)["results"])
+    print("\nCompared with {0}:".format(path))
+    print("{0:<50} {1:>6} {2:>10} {3:>8} {4:>7} {5:>10} {6:>9} {7:>6} {8:>6}".format(
+        "operation", "lines", "ms", "queries", "stripe", "peak KiB", "ms", "queries", "stripe"))
+    for result in results:
+        print_result(result, previous.get((result["operation"], result["lines"])))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="Basket sizes, in lines")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0, help="Latency of each Stripe request, in ms")
+    parser.add_argument(
+        "--duplicates", type=int, default=10,
+        help="Check that this many concurrent place order submissions for a basket place one order (0 to skip)")
+    parser.add_argument("--output", help="Save the results to this JSON file")
+    parser.add_argument("--compare", help="Compare the results with an earlier JSON file")
+    options = parser.parse_args(argv)
+
+    setup()
+    from benchmarks.stub import install
+
+    transport = install(latency=options.latency / 1000)
+    print("{0:<50} {1:>6} {2:>10} {3:>8} {4:>7} {5:>10}".format(
+        "operation", "lines", "ms", "queries", "stripe", "peak KiB"))
+    benchmarks = CheckoutBenchmarks(transport)
+    results = benchmarks.run(options.sizes, options.repeat)
+
+    if options.compare:
+        compare(results, options.compare)
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump({
+                "date": datetime.now(timezone.utc).isoformat(),
+                "versions": get_versions(),
+                "latency_ms": options.latency,
+                "repeat": options.repeat,
+                "results": results,
+            }, f, indent=2)
+        print("\nSaved to {0}".format(options.output))
+
+    failures = check_stripe_requests(results)
+    if options.duplicates:
+        duplicate_failures = benchmarks.check_duplicate_submissions(min(options.sizes), options.duplicates)
+        if not duplicate_failures:
+            print("\n{0} concurrent place order submissions for one basket placed one order".format(options.duplicates))
+        failures += duplicate_failures
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
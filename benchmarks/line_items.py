@@ -0,0 +1,46 @@
+"""
+Query count and wall time of building the Stripe line items for baskets of 10, 100 and 1000 lines.  The
+adaptive shape is also checked to add up to the total.
+
+    python -m benchmarks.line_items
+"""
+from decimal import Decimal as D
+
+from benchmarks.utils import make_basket, measure, reload_basket, setup
+
+SIZES = (10, 100, 1000)
+
+
+def main():
+    setup()
+    from oscar.apps.shipping.methods import FixedPrice
+    from oscar.core.prices import Price
+    from oscar_stripe_sca import COMPRESS_ADAPTIVE
+    from oscar_stripe_sca.line_items import LineItemBuilder
+    from oscar_stripe_sca.money import to_minor_units
+
+    shipping_method = FixedPrice(D('5.00'), D('5.00'))
+    print("{0:>6}  {1:<8} {2:>10} {3:>8}".format("lines", "shape", "ms", "queries"))
+    for size in SIZES:
+        basket = make_basket(size)
+        total = Price(
+            basket.currency, basket.total_excl_tax + D('5.00'), incl_tax=basket.total_incl_tax + D('5.00'))
+        for shape, use_prices_api, compress in (
+                ("legacy", False, False), ("prices", True, False), ("adaptive", True, COMPRESS_ADAPTIVE)):
+            builder = LineItemBuilder(use_prices_api=use_prices_api, compress=compress)
+            line_items = []
+
+            def run():
+                line_items[:] = builder.get_line_items(reload_basket(basket), total, shipping_method)
+
+            elapsed, queries = measure(run)
+            if compress:
+                charged = sum(line_item["price_data"]["unit_amount"] * line_item["quantity"] for line_item in line_items)
+                if charged != to_minor_units(total.incl_tax, total.currency) or len(line_items) > builder.max_items:
+                    raise AssertionError("{0} adaptive line items charge {1} for a total of {2}".format(
+                        len(line_items), charged, total.incl_tax))
+            print("{0:>6}  {1:<8} {2:>10.2f} {3:>8}".format(size, shape, elapsed, queries))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Drive the sandbox project through complete checkouts against the Stripe stand-in (benchmarks.stripe_server)
+and report checkouts per second.  Each checkout loads the payment details page, pays at the stand-in, and
+previews and places the order, as the customer's browser would.
+
+The customers, their baskets and their logged-in sessions are created beforehand, directly in the sandbox's
+database, so the sandbox must be using a database and session engine this script can reach.  See "Load
+testing" in the README.
+
+    python -m benchmarks.loadtest --checkouts 200 --concurrency 20
+"""
+import argparse
+import os
+import re
+import statistics
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal as D
+from urllib.parse import urlsplit
+
+import requests
+
+SANDBOX_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sandbox")
+
+# The session's id, in the redirect to its page (STRIPE_CHECKOUT_MODE "redirect"), or where the payment details
+# template hands it or its client secret to Stripe.js
+SESSION_ID = re.compile(r"(?P<id>cs_\w+?)(?=_secret_|['\"/?#]|$)")
+
+STEPS = ("payment details", "pay at stripe", "preview", "place order")
+
+
+class CheckoutFailed(Exception):
+    pass
+
+
+def setup(settings_module):
+    sys.path.insert(0, SANDBOX_DIR)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+    import django
+    django.setup()
+
+
+def create_customers(count, num_lines):
+    """
+    Create ``count`` customers, each logged in with a basket of ``num_lines`` products and a checkout
+    session ready for payment, and return their session keys.
+    """
+    from django.conf import settings
+    from oscar.apps.partner.strategy import Default
+    from oscar.test.factories import BasketFactory, CountryFactory, UserFactory, create_product
+    from oscar.apps.address.models import Country
+
+    from benchmarks.utils import start_checkout
+
+    country = Country.objects.filter(iso_3166_1_a2="GB").first() or CountryFactory(
+        iso_3166_1_a2="GB", printable_name="United Kingdom")
+    products = [
+        create_product(title="Load test product %d" % i, price=D('9.99') + i, num_in_stock=1000000)
+        for i in range(num_lines)
+    ]
+    session_keys = []
+    for _ in range(count):
+        # Unique across runs against the same database
+        name = "loadtest-{0}".format(uuid.uuid4().hex)
+        user = UserFactory(username=name[:30], email="{0}@example.com".format(name))
+        basket = BasketFactory(owner=user)
+        basket.strategy = Default()
+        for product in products:
+            basket.add_product(product)
+        client = start_checkout(user, country)
+        session_keys.append(client.cookies[settings.SESSION_COOKIE_NAME].value)
+    return session_keys
+
+
+class LoadTest(object):
+    def __init__(self, base_url, stripe_url, payment_details_path, session_cookie_name):
+        self.base_url = base_url.rstrip("/")
+        self.stripe_url = stripe_url.rstrip("/")
+        self.payment_details_path = payment_details_path
+        self.session_cookie_name = session_cookie_name
+        self.lock = threading.Lock()
+        self.timings = dict((step, []) for step in STEPS)
+        self.failures = {}
+        self.completed = 0
+
+    @contextmanager
+    def step(self, name):
+        start = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.timings[name].append(elapsed)
+
+    def expect(self, response, status, step):
+        if response.status_code != status:
+            raise CheckoutFailed("{0}: expected {1}, got {2}".format(step, status, response.status_code))
+
+    def checkout(self, session_key):
+        http = requests.Session()
+        http.cookies.set(self.session_cookie_name, session_key)
+        try:
+            with self.step("payment details"):
+                response = http.get(self.base_url + self.payment_details_path, allow_redirects=False)
+                if response.status_code != 303:
+                    self.expect(response, 200, "payment details")
+            match = SESSION_ID.search(response.headers.get("Location") or response.text)
+            if match is None:
+                raise CheckoutFailed("payment details: no Checkout Session on the page")
+
+            with self.step("pay at stripe"):
+                response = http.post("{0}/_test/checkout/sessions/{1}/complete".format(self.stripe_url, match.group("id")))
+                self.expect(response, 200, "pay at stripe")
+            # The stand-in's success URL uses the site's public address; send the request to the one under test
+            session = response.json()
+            success_url = "{0}/{1}".format(
+                self.base_url, urlsplit(session.get("success_url") or session["return_url"]).path.lstrip("/"))
+
+            with self.step("preview"):
+                self.expect(http.get(success_url, allow_redirects=False), 200, "preview")
+            with self.step("place order"):
+                self.expect(http.post(success_url, allow_redirects=False), 302, "place order")
+        except (CheckoutFailed, requests.RequestException) as e:
+            reason = str(e) if isinstance(e, CheckoutFailed) else e.__class__.__name__
+            with self.lock:
+                self.failures[reason] = self.failures.get(reason, 0) + 1
+            return
+        with self.lock:
+            self.completed += 1
+
+    def run(self, session_keys, concurrency):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(self.checkout, session_keys))
+        return time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def report(test, elapsed):
+    print("\n{0} checkouts completed, {1} failed in {2:.1f}s: {3:.2f} checkouts per second".format(
+        test.completed, sum(test.failures.values()), elapsed, test.completed / elapsed if elapsed else 0))
+    print("\n{0:<16} {1:>8} {2:>10} {3:>10} {4:>10}".format("step", "count", "p50 ms", "p95 ms", "max ms"))
+    for step in STEPS:
+        values = test.timings[step]
+        if values:
+            print("{0:<16} {1:>8} {2:>10.1f} {3:>10.1f} {4:>10.1f}".format(
+                step, len(values), statistics.median(values) * 1000, percentile(values, 0.95) * 1000,
+                max(values) * 1000))
+    if test.failures:
+        print("\nFailures:")
+        for reason, count in sorted(test.failures.items(), key=lambda item: -item[1]):
+            print("{0:>8}  {1}".format(count, reason))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the sandbox checkout against the Stripe stand-in")
+    parser.add_argument("--base-url", default="http://localhost:8000", help="The sandbox site")
+    parser.add_argument("--stripe-url", default="http://localhost:12111", help="The Stripe stand-in")
+    parser.add_argument("--payment-details-path", default="/checkout/payment-details/")
+    parser.add_argument("--settings", default="settings", help="The sandbox's settings module")
+    parser.add_argument("--checkouts", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--lines", type=int, default=3, help="Lines in each basket")
+    options = parser.parse_args(argv)
+
+    setup(options.settings)
+    from django.conf import settings
+
+    print("Creating {0} customers...".format(options.checkouts))
+    session_keys = create_customers(options.checkouts, options.lines)
+    test = LoadTest(options.base_url, options.stripe_url, options.payment_details_path, settings.SESSION_COOKIE_NAME)
+    print("Running {0} checkouts, {1} at a time...".format(options.checkouts, options.concurrency))
+    report(test, test.run(session_keys, options.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+Per-amount cost of converting prices to Stripe's minor units, against the implementation the facade used
+before the money module.  Doesn't need a database.
+
+    python -m benchmarks.money
+"""
+import timeit
+from decimal import Decimal as D, ROUND_HALF_UP
+
+from oscar_stripe_sca.money import ZERO_DECIMAL_CURRENCIES, to_minor_units, to_minor_units_batch
+
+NUMBER = 20000
+AMOUNTS = [D('9.99') + D(i) / 7 for i in range(1000)]
+
+
+def legacy_convert_to_cents(price, currency):
+    if currency.upper() in ZERO_DECIMAL_CURRENCIES:
+        return int(D(str(price)).quantize(D('1'), ROUND_HALF_UP))
+    else:
+        return int(D(str(price)).quantize(D('0.01'), ROUND_HALF_UP) * 100)
+
+
+def per_amount_ns(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e9
+
+
+def main():
+    print("{0:<10} {1:>14} {2:>14} {3:>14}".format("currency", "legacy ns", "single ns", "batch ns"))
+    for currency in ("gbp", "JPY", "KWD"):
+        amount = AMOUNTS[1]
+        legacy = per_amount_ns(lambda: legacy_convert_to_cents(amount, currency), NUMBER)
+        single = per_amount_ns(lambda: to_minor_units(amount, currency), NUMBER)
+        batch = per_amount_ns(lambda: to_minor_units_batch(AMOUNTS, currency), NUMBER // len(AMOUNTS)) / len(AMOUNTS)
+        print("{0:<10} {1:>14.0f} {2:>14.0f} {3:>14.0f}".format(currency, legacy, single, batch))
+
+
+if __name__ == "__main__":
+    main()
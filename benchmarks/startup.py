@@ -0,0 +1,52 @@
+"""
+Cold-start cost of a process that sets Django up and loads the URLconf, as management commands and new
+workers do: wall time, modules loaded, and whether the Stripe SDK was imported (it shouldn't be until a
+Stripe call is made).  Each measurement runs in a fresh interpreter.
+
+    python -m benchmarks.startup [--repeat 5]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+SCENARIOS = (
+    ("django.setup", ""),
+    ("setup + URLconf", "from django.urls import resolve; resolve('/checkout/stripe-webhook/')"),
+    ("setup + URLconf + Stripe", (
+        "from django.urls import resolve; resolve('/checkout/stripe-webhook/'); "
+        "from oscar_stripe_sca.facade import Facade; Facade().client.request_options")),
+)
+
+CHILD = """
+import json, os, sys, time
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+start = time.perf_counter()
+import django
+django.setup()
+{code}
+print(json.dumps([(time.perf_counter() - start) * 1000, len(sys.modules), "stripe" in sys.modules]))
+"""
+
+
+def run(code):
+    output = subprocess.check_output([sys.executable, "-c", CHILD.format(code=code)])
+    return json.loads(output.decode().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print("{0:<26} {1:>10} {2:>8} {3:>8}".format("scenario", "ms", "modules", "stripe"))
+    for name, code in SCENARIOS:
+        results = [run(code) for __ in range(args.repeat)]
+        print("{0:<26} {1:>10.1f} {2:>8} {3:>8}".format(
+            name, statistics.median(result[0] for result in results), results[-1][1],
+            "loaded" if results[-1][2] else "-"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+A local stand-in for the Stripe API, for load testing the checkout without Stripe's test mode.  It serves the
+endpoints this package uses from benchmarks.stub.FakeStripe, with configurable latency and injected errors,
+and sends signed webhooks for the events Stripe would.  Point the site at it with STRIPE_API_BASE:
+
+    python -m benchmarks.stripe_server --port 12111 --latency 150 --jitter 100 --error-rate 0.01 \\
+        --webhook-url http://localhost:8000/checkout/stripe-webhook/ --webhook-secret whsec_local
+
+``POST /_test/checkout/sessions/<id>/complete`` does what the customer paying on Stripe's page would: the
+session completes, its payment is authorised and the webhooks are sent.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import logging
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+
+from benchmarks.stub import FakeStripe, StripeError
+
+logger = logging.getLogger("benchmarks.stripe_server")
+
+COMPLETE_SESSION = re.compile(r"^/_test/checkout/sessions/(?P<id>[^/]+)/complete$")
+
+
+class WebhookSender(object):
+    """
+    Posts events to ``url`` from a thread pool, signed the way Stripe signs them, retrying failed deliveries.
+    """
+    def __init__(self, url, secret, workers=4, retries=3):
+        self.url = url
+        self.secret = secret
+        self.retries = retries
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.session = requests.Session()
+        self.sent = self.failed = 0
+
+    def get_signature(self, payload, timestamp):
+        signed = "{0}.{1}".format(timestamp, payload).encode("utf-8")
+        return "t={0},v1={1}".format(timestamp, hmac.new(self.secret.encode("utf-8"), signed, hashlib.sha256).hexdigest())
+
+    def send(self, event):
+        self.executor.submit(self.deliver, event)
+
+    def deliver(self, event):
+        payload = json.dumps(event)
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.post(self.url, data=payload, timeout=30, headers={
+                    "Content-Type": "application/json",
+                    "Stripe-Signature": self.get_signature(payload, int(time.time())),
+                })
+                if response.status_code < 300:
+                    self.sent += 1
+                    return
+                logger.warning("Webhook %s %s got %s", event["id"], event["type"], response.status_code)
+            except requests.RequestException as e:
+                logger.warning("Webhook %s %s failed: %s", event["id"], event["type"], e)
+            time.sleep(2 ** attempt)
+        self.failed += 1
+
+
+class StripeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0, jitter=0, error_rate=0, rate_limit_rate=0, drop_rate=0,
+                 webhooks=None):
+        super(StripeServer, self).__init__(address, StripeRequestHandler)
+        self.fake_stripe = FakeStripe(on_event=webhooks.send if webhooks is not None else None)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.drop_rate = drop_rate
+
+    def get_delay(self):
+        return self.latency + random.uniform(0, self.jitter)
+
+    def get_injected_error(self):
+        """
+        Return ``"drop"``, an error ``(status, body)`` or None, at the configured rates.
+        """
+        roll = random.random()
+        if roll < self.drop_rate:
+            return "drop"
+        roll -= self.drop_rate
+        if roll < self.rate_limit_rate:
+            return 429, StripeError(429, "Too many requests", code="rate_limit", error_type="invalid_request_error").body
+        roll -= self.rate_limit_rate
+        if roll < self.error_rate:
+            return 500, StripeError(500, "An unknown error occurred", error_type="api_error").body
+        return None
+
+
+class StripeRequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive, as the package's pooled client expects
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.handle_api_request()
+
+    def do_POST(self):
+        self.handle_api_request()
+
+    def get_params(self):
+        url = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode("utf-8") if length else url.query
+        return url.path, dict(parse_qsl(body))
+
+    def handle_api_request(self):
+        path, params = self.get_params()
+        server = self.server
+
+        match = COMPLETE_SESSION.match(path)
+        if match:
+            try:
+                return self.respond(200, server.fake_stripe.complete_session(match.group("id")))
+            except StripeError as e:
+                return self.respond(e.status, e.body)
+
+        if not self.headers.get("Authorization", "").startswith("Bearer sk_"):
+            return self.respond(401, StripeError(
+                401, "You did not provide a valid API key.", error_type="authentication_error").body)
+
+        time.sleep(server.get_delay())
+        error = server.get_injected_error()
+        if error == "drop":
+            self.close_connection = True
+            return
+        if error is not None:
+            return self.respond(*error)
+
+        status, body = server.fake_stripe.handle(self.command, path, params, self.headers.get("Idempotency-Key"))
+        self.respond(status, body)
+
+    def respond(self, status, body):
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("Request-Id", "req_local_{0}".format(int(time.time() * 1000000)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="A local stand-in for the Stripe API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12111)
+    parser.add_argument("--latency", type=float, default=0, help="Added to every API request, in ms")
+    parser.add_argument("--jitter", type=float, default=0, help="Up to this much more random latency, in ms")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests answered with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0, help="Fraction of requests answered with a 429")
+    parser.add_argument("--drop-rate", type=float, default=0, help="Fraction of connections closed without an answer")
+    parser.add_argument("--webhook-url", help="Where to send webhook events")
+    parser.add_argument("--webhook-secret", default="whsec_local", help="The webhook signing secret")
+    options = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    webhooks = WebhookSender(options.webhook_url, options.webhook_secret) if options.webhook_url else None
+    server = StripeServer(
+        (options.host, options.port), latency=options.latency / 1000, jitter=options.jitter / 1000,
+        error_rate=options.error_rate, rate_limit_rate=options.rate_limit_rate, drop_rate=options.drop_rate,
+        webhooks=webhooks)
+    logger.info("Stripe stand-in listening on http://%s:%s", options.host, options.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""
+An in-memory stand-in for the parts of the Stripe API this package uses, and a requests transport adapter
+that serves it, so the benchmarks make real Stripe library calls without touching the network.
+"""
+import copy
+import itertools
+import json
+import re
+import threading
+import time
+import uuid
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+from requests.adapters import BaseAdapter
+
+# Payment intents in these states can still be cancelled
+CANCELABLE = ("requires_payment_method", "requires_confirmation", "requires_action", "requires_capture")
+
+ROUTES = [
+    ("POST", re.compile(r"^/v1/checkout/sessions$"), "create_session"),
+    ("GET", re.compile(r"^/v1/checkout/sessions/(?P<id>[^/]+)$"), "retrieve_session"),
+    ("POST", re.compile(r"^/v1/checkout/sessions/(?P<id>[^/]+)/expire$"), "expire_session"),
+    ("GET", re.compile(r"^/v1/payment_intents$"), "list_payment_intents"),
+    ("GET", re.compile(r"^/v1/payment_intents/(?P<id>[^/]+)$"), "retrieve_payment_intent"),
+    ("POST", re.compile(r"^/v1/payment_intents/(?P<id>[^/]+)$"), "modify_payment_intent"),
+    ("POST", re.compile(r"^/v1/payment_intents/(?P<id>[^/]+)/capture$"), "capture_payment_intent"),
+    ("POST", re.compile(r"^/v1/payment_intents/(?P<id>[^/]+)/cancel$"), "cancel_payment_intent"),
+    ("POST", re.compile(r"^/v1/products$"), "create_product"),
+    ("POST", re.compile(r"^/v1/products/(?P<id>[^/]+)$"), "modify_product"),
+    ("POST", re.compile(r"^/v1/prices$"), "create_price"),
+    ("POST", re.compile(r"^/v1/prices/(?P<id>[^/]+)$"), "modify_price"),
+]
+
+
+class StripeError(Exception):
+    def __init__(self, status, message, code=None, error_type="invalid_request_error"):
+        super(StripeError, self).__init__(message)
+        self.status = status
+        self.body = {"error": {"type": error_type, "code": code, "message": message}}
+
+
+def get_line_items_total(params, prices=None):
+    """
+    Add up the ``line_items`` of form-encoded session parameters, in either the Prices API or the legacy shape.
+    Lines referring to a price by id are looked up in ``prices``.
+    """
+    total = 0
+    currency = None
+    for index in itertools.count():
+        prefix = "line_items[{0}]".format(index)
+        quantity = params.get(prefix + "[quantity]")
+        if quantity is None:
+            return total, currency
+        if prefix + "[price]" in params:
+            price = prices[params[prefix + "[price]"]]
+            total += price["unit_amount"] * int(quantity)
+            currency = price["currency"]
+            continue
+        amount = params.get(prefix + "[price_data][unit_amount]", params.get(prefix + "[amount]", 0))
+        currency = params.get(prefix + "[price_data][currency]", params.get(prefix + "[currency]", currency))
+        total += int(amount) * int(quantity)
+
+
+class FakeStripe(object):
+    """
+    Keeps Checkout Sessions and payment intents in memory and moves them through Stripe's states.  Requests
+    with an idempotency key are answered once and replayed afterwards, as Stripe does.  ``on_event`` is
+    called with each event Stripe would send a webhook for.
+    """
+    def __init__(self, on_event=None):
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.sessions = {}
+        self.payment_intents = {}
+        self.products = {}
+        self.prices = {}
+        self.idempotent_responses = {}
+        self.on_event = on_event
+
+    def new_id(self, prefix):
+        return "{0}_test_{1:08d}".format(prefix, next(self.ids))
+
+    def emit(self, event_type, obj):
+        if self.on_event is not None:
+            self.on_event({
+                "id": self.new_id("evt"),
+                "object": "event",
+                "type": event_type,
+                "created": int(time.time()),
+                "livemode": False,
+                "data": {"object": copy.deepcopy(obj)},
+            })
+
+    def handle(self, method, path, params, idempotency_key=None):
+        """
+        Answer an API request with ``(status, body)``.
+        """
+        with self.lock:
+            if idempotency_key and (path, idempotency_key) in self.idempotent_responses:
+                return self.idempotent_responses[(path, idempotency_key)]
+            response = self.route(method, path, params)
+            if idempotency_key and method == "POST":
+                self.idempotent_responses[(path, idempotency_key)] = response
+            return response
+
+    def route(self, method, path, params):
+        for route_method, pattern, name in ROUTES:
+            match = pattern.match(path)
+            if route_method == method and match:
+                try:
+                    return 200, getattr(self, name)(params, **match.groupdict())
+                except StripeError as e:
+                    return e.status, e.body
+        return 404, StripeError(404, "Unrecognized request URL ({0}: {1})".format(method, path)).body
+
+    def get_object(self, objects, object_id):
+        try:
+            return objects[object_id]
+        except KeyError:
+            raise StripeError(404, "No such object: '{0}'".format(object_id), code="resource_missing")
+
+    def create_payment_intent(self, amount, currency, status="requires_payment_method", **fields):
+        intent = dict({
+            "id": self.new_id("pi"),
+            "object": "payment_intent",
+            "amount": amount,
+            "amount_capturable": amount if status == "requires_capture" else 0,
+            "amount_received": 0,
+            "currency": currency,
+            "capture_method": "manual",
+            "status": status,
+            "receipt_email": None,
+            "created": int(time.time()),
+        }, **fields)
+        self.payment_intents[intent["id"]] = intent
+        return intent
+
+    def create_session(self, params):
+        amount, currency = get_line_items_total(params, self.prices)
+        session_id = self.new_id("cs")
+        intent = self.create_payment_intent(
+            amount, currency, metadata={"checkout_session": session_id},
+            receipt_email=params.get("payment_intent_data[receipt_email]"))
+        session = {
+            "id": session_id,
+            "object": "checkout.session",
+            "mode": params.get("mode", "payment"),
+            "status": "open",
+            "payment_status": "unpaid",
+            "amount_total": amount,
+            "currency": currency,
+            "customer_email": params.get("customer_email"),
+            "client_reference_id": params.get("client_reference_id"),
+            "payment_intent": intent["id"],
+            "success_url": params.get("success_url"),
+            "cancel_url": params.get("cancel_url"),
+            "url": "https://checkout.stripe.com/c/pay/{0}".format(session_id),
+            "expires_at": int(time.time()) + 24 * 60 * 60,
+        }
+        if params.get("ui_mode") == "embedded":
+            # Mounted with Stripe.js rather than visited, and sent back to return_url when paid
+            session.update(
+                ui_mode="embedded", url=None, return_url=params.get("return_url"),
+                client_secret="{0}_secret_{1}".format(session_id, uuid.uuid4().hex))
+        self.sessions[session_id] = session
+        return session
+
+    def retrieve_session(self, params, id):
+        return self.get_object(self.sessions, id)
+
+    def expire_session(self, params, id):
+        session = self.get_object(self.sessions, id)
+        if session["status"] != "open":
+            raise StripeError(
+                400, "Only Checkout Sessions with a status in [\"open\"] can be expired.",
+                code="checkout_session_unexpected_state")
+        session["status"] = "expired"
+        self.payment_intents[session["payment_intent"]]["status"] = "canceled"
+        self.emit("checkout.session.expired", session)
+        return session
+
+    def complete_session(self, session_id):
+        """
+        What Stripe does when the customer pays: the session completes and its payment is authorised.
+        """
+        with self.lock:
+            session = self.get_object(self.sessions, session_id)
+            if session["status"] != "open":
+                raise StripeError(400, "This Checkout Session is {0}.".format(session["status"]))
+            session.update(status="complete", payment_status="unpaid")
+            intent = self.payment_intents[session["payment_intent"]]
+            intent.update(status="requires_capture", amount_capturable=intent["amount"])
+            self.emit("payment_intent.amount_capturable_updated", intent)
+            self.emit("checkout.session.completed", session)
+            return session
+
+    def list_payment_intents(self, params):
+        """
+        Newest first, filtered on ``created`` and paged with ``limit`` and ``starting_after`` as Stripe does.
+        """
+        intents = sorted(self.payment_intents.values(), key=lambda intent: (intent["created"], intent["id"]), reverse=True)
+        for bound, test in (("gte", int.__ge__), ("gt", int.__gt__), ("lte", int.__le__), ("lt", int.__lt__)):
+            value = params.get("created[{0}]".format(bound))
+            if value is not None:
+                intents = [intent for intent in intents if test(intent["created"], int(value))]
+        if params.get("starting_after"):
+            ids = [intent["id"] for intent in intents]
+            intents = intents[ids.index(params["starting_after"]) + 1:]
+        limit = int(params.get("limit", 10))
+        return {
+            "object": "list",
+            "url": "/v1/payment_intents",
+            "has_more": len(intents) > limit,
+            "data": intents[:limit],
+        }
+
+    def retrieve_payment_intent(self, params, id):
+        return self.get_object(self.payment_intents, id)
+
+    def modify_payment_intent(self, params, id):
+        intent = self.get_object(self.payment_intents, id)
+        if "receipt_email" in params:
+            intent["receipt_email"] = params["receipt_email"] or None
+        return intent
+
+    def capture_payment_intent(self, params, id):
+        intent = self.get_object(self.payment_intents, id)
+        if intent["status"] != "requires_capture":
+            raise StripeError(
+                400, "This PaymentIntent could not be captured because it has a status of {0}.".format(
+                    intent["status"]), code="payment_intent_unexpected_state")
+        amount = int(params.get("amount_to_capture", intent["amount_capturable"]))
+        intent.update(status="succeeded", amount_received=amount, amount_capturable=0)
+        self.emit("payment_intent.succeeded", intent)
+        return intent
+
+    def cancel_payment_intent(self, params, id):
+        intent = self.get_object(self.payment_intents, id)
+        if intent["status"] not in CANCELABLE:
+            raise StripeError(
+                400, "You cannot cancel this PaymentIntent because it has a status of {0}.".format(
+                    intent["status"]), code="payment_intent_unexpected_state")
+        intent.update(status="canceled", amount_capturable=0)
+        self.emit("payment_intent.canceled", intent)
+        return intent
+
+    def create_product(self, params):
+        product = {
+            "id": self.new_id("prod"),
+            "object": "product",
+            "active": True,
+            "name": params["name"],
+            "metadata": dict(
+                (key[len("metadata["):-1], value) for key, value in params.items() if key.startswith("metadata[")),
+        }
+        self.products[product["id"]] = product
+        return product
+
+    def modify_product(self, params, id):
+        product = self.get_object(self.products, id)
+        if "name" in params:
+            product["name"] = params["name"]
+        return product
+
+    def create_price(self, params):
+        self.get_object(self.products, params["product"])
+        price = {
+            "id": self.new_id("price"),
+            "object": "price",
+            "active": True,
+            "product": params["product"],
+            "unit_amount": int(params["unit_amount"]),
+            "currency": params["currency"].lower(),
+        }
+        self.prices[price["id"]] = price
+        return price
+
+    def modify_price(self, params, id):
+        price = self.get_object(self.prices, id)
+        if "active" in params:
+            price["active"] = params["active"] == "true"
+        return price
+
+
+class StubTransport(BaseAdapter):
+    """
+    A requests transport adapter answering Stripe API requests from a FakeStripe after ``latency`` seconds.
+    """
+    def __init__(self, stripe=None, latency=0):
+        super(StubTransport, self).__init__()
+        self.stripe = stripe or FakeStripe()
+        self.latency = latency
+        self.requests = 0
+
+    def send(self, request, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        self.requests += 1
+        url = urlsplit(request.url)
+        body = request.body or url.query or ""
+        if isinstance(body, bytes):
+            body = body.decode("utf-8")
+        status, data = self.stripe.handle(
+            request.method, url.path, dict(parse_qsl(body)), request.headers.get("Idempotency-Key"))
+
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps(data).encode("utf-8")
+        response.headers["Content-Type"] = "application/json"
+        response.headers["Request-Id"] = "req_stub_{0}".format(self.requests)
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def install(latency=0, stripe=None):
+    """
+    Route the package's Stripe requests to a new StubTransport and return it.
+    """
+    import stripe as stripe_module
+    from oscar_stripe_sca.client import get_http_client
+
+    transport = StubTransport(stripe, latency)
+    # The facade's requests all go through the pooled client's session
+    get_http_client()._session.mount(stripe_module.api_base, transport)
+    return transport
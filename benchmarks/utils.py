@@ -0,0 +1,136 @@
+import os
+import statistics
+import time
+import tracemalloc
+from decimal import Decimal as D
+
+import django
+
+
+def setup():
+    """
+    Configure Django with the benchmark settings and create the in-memory database.
+    """
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+    django.setup()
+    from django.core.management import call_command
+    call_command("migrate", verbosity=0)
+
+
+def make_basket(num_lines, variants=True, owner=None):
+    """
+    Create a basket with one line per product.  Every other product is a variant, so that titles and
+    product classes have to be looked up through the parent.
+    """
+    from oscar.apps.partner.strategy import Default
+    from oscar.test.factories import BasketFactory, create_product
+
+    basket = BasketFactory(owner=owner)
+    basket.strategy = Default()
+    parent = create_product(structure='parent', title="Parent product") if variants else None
+    for i in range(num_lines):
+        if parent is not None and i % 2:
+            product = create_product(
+                parent=parent, title="", structure='child', price=D('9.99') + i, num_in_stock=1000)
+        else:
+            product = create_product(title="Product %d" % i, price=D('9.99') + i, num_in_stock=1000)
+        basket.add_product(product, quantity=1 + i % 3)
+    return basket
+
+
+def start_checkout(user, country):
+    """
+    Log ``user`` in with a test client whose checkout session has a shipping address and method, ready for
+    the payment details page.
+    """
+    from django.test import Client
+
+    client = Client()
+    client.force_login(user)
+    session = client.session
+    session["checkout_data"] = {
+        "shipping": {
+            "new_address_fields": {
+                "first_name": "Ben", "last_name": "Chmark", "line1": "1 Test Street",
+                "line4": "London", "postcode": "N1 9GU", "country_id": country.pk,
+            },
+            "method_code": "free-shipping",
+        },
+    }
+    session.save()
+    return client
+
+
+def reload_basket(basket):
+    """
+    Return a fresh copy of the basket, as a new request would see it.
+    """
+    from oscar.apps.partner.strategy import Default
+
+    basket = basket.__class__.objects.get(pk=basket.pk)
+    basket.strategy = Default()
+    return basket
+
+
+def measure(func, repeat=5):
+    """
+    Run func ``repeat`` times and return (best wall time in ms, queries made by the last run).
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    best = None
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, len(queries)
+
+
+def profile(func, repeat=5, setup=None, counters=None):
+    """
+    Run ``func(*setup())`` ``repeat`` times, then once more under tracemalloc, and return a dict of the best
+    and median wall time in ms, the queries made by the last timed run, and the peak and retained memory
+    allocated by the traced run in KiB.  ``setup`` isn't timed.  ``counters`` maps result names to functions
+    returning a running count, e.g. of requests made; the result has what each went up by in the last timed run.
+    """
+    from django.db import connection
+
+    counters = counters or {}
+    counts = {}
+    queries = []
+
+    def count_query(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    timings = []
+    for _ in range(repeat):
+        args = setup() if setup is not None else ()
+        del queries[:]
+        # Not CaptureQueriesContext, as the test client's request_started signal clears the queries log
+        before = dict((name, read()) for name, read in counters.items())
+        with connection.execute_wrapper(count_query):
+            start = time.perf_counter()
+            func(*args)
+            timings.append(time.perf_counter() - start)
+        counts = dict((name, read() - before[name]) for name, read in counters.items())
+
+    args = setup() if setup is not None else ()
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        func(*args)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return dict({
+        "wall_ms": round(min(timings) * 1000, 3),
+        "wall_ms_median": round(statistics.median(timings) * 1000, 3),
+        "queries": len(queries),
+        "peak_kib": round((peak - baseline) / 1024, 1),
+        "retained_kib": round((current - baseline) / 1024, 1),
+    }, **counts)
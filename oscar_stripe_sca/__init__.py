@@ -1,2 +1,18 @@
 PAYMENT_EVENT_PURCHASE = 'Purchase'
+# Recorded instead of a purchase when the capture is deferred (STRIPE_CAPTURE_MODE "deferred")
+PAYMENT_EVENT_AUTHORISE = 'Authorise'
 PAYMENT_METHOD_STRIPE = 'Stripe'
+# Given by stripe_expire_abandoned_baskets --action abandon to frozen baskets nobody came back for
+BASKET_STATUS_ABANDONED = 'Abandoned'
+
+# How StripeSCAPaymentDetailsView hands the customer over to Stripe (STRIPE_CHECKOUT_MODE)
+CHECKOUT_MODE_TEMPLATE = 'template'
+CHECKOUT_MODE_REDIRECT = 'redirect'
+CHECKOUT_MODE_EMBEDDED = 'embedded'
+
+# When StripeSCASuccessResponseView captures the payment (STRIPE_CAPTURE_MODE)
+CAPTURE_MODE_IMMEDIATE = 'immediate'
+CAPTURE_MODE_DEFERRED = 'deferred'
+
+# STRIPE_COMPRESS_TO_ONE_LINE_ITEM value that itemizes what fits within the line item limits and summarizes the rest
+COMPRESS_ADAPTIVE = 'adaptive'
@@ -0,0 +1,132 @@
+import logging
+from datetime import timedelta
+
+from django.db.models import Max
+from django.utils import timezone
+from oscar.core.loading import get_model
+
+from oscar_stripe_sca import BASKET_STATUS_ABANDONED
+from oscar_stripe_sca.facade import Facade
+from oscar_stripe_sca.models import StripeCheckoutAttempt
+from oscar_stripe_sca.session_cache import CheckoutSessionCache
+from oscar_stripe_sca.utils import run_concurrently, stripe
+
+
+logger = logging.getLogger(__name__)
+Basket = get_model('basket', 'Basket')
+
+
+class AbandonedBasketExpirer(object):
+    """
+    Releases the baskets frozen by ``Facade.begin`` whose customer never came back from Stripe, e.g. because
+    they closed the tab.  Baskets are handled in batches: their open Checkout Sessions are expired at Stripe
+    by a bounded pool of concurrent requests, then the baskets and their checkout attempts are updated with
+    one query each.  ``action`` is "thaw", to give the baskets back to their owners, or "abandon", to retire
+    them with the BASKET_STATUS_ABANDONED status.
+
+    A basket whose session turns out to have been paid is left frozen, as the customer may still come back
+    to place the order, and so is one whose session couldn't be expired; the next run tries it again.
+    """
+    def __init__(self, older_than=timedelta(days=1), action="thaw", workers=8, rate=20, facade=None):
+        if action not in ("thaw", "abandon"):
+            raise ValueError("Unknown action: {0}".format(action))
+        self.older_than = older_than
+        self.action = action
+        self.workers = workers
+        self.rate = rate
+        self.facade = facade or Facade()
+        self.facades = {self.facade.account.name: self.facade}
+
+    def get_baskets(self, now=None):
+        """
+        Frozen baskets whose latest Checkout Session was created more than ``older_than`` ago.  Baskets frozen
+        without one, e.g. by another payment method, aren't ours to release.
+        """
+        cutoff = (now or timezone.now()) - self.older_than
+        return Basket.objects.filter(status=Basket.FROZEN).annotate(
+            last_attempt=Max('stripe_checkout_attempts__date_created')).filter(
+                last_attempt__lt=cutoff).order_by('id')
+
+    def get_facade(self, account):
+        if account not in self.facades:
+            self.facades[account] = Facade.for_account(account)
+        return self.facades[account]
+
+    def expire_session(self, session_id, account):
+        """
+        Expire a session at Stripe and return its status afterwards: "expired", or "complete" if it was paid.
+        """
+        facade = self.get_facade(account)
+        try:
+            facade.expire_session(session_id)
+            return "expired"
+        except stripe.error.InvalidRequestError:
+            # Only open sessions can be expired; find out whether it expired by itself or was paid
+            return facade.retrieve_session(session_id).status
+
+    def expire_batch(self, basket_ids):
+        """
+        Expire the sessions of a batch of baskets and release the baskets, and return a dict of counts.
+        """
+        sessions = list(StripeCheckoutAttempt.objects.filter(
+            basket_id__in=basket_ids, status=StripeCheckoutAttempt.OPEN).values_list(
+                'basket_id', 'session_id', 'account'))
+        expired, completed = [], []
+        # Baskets whose session has already been recorded as paid, e.g. by the webhook
+        paid = set(StripeCheckoutAttempt.objects.filter(
+            basket_id__in=basket_ids, status__in=StripeCheckoutAttempt.PAID_STATUSES).values_list(
+                'basket_id', flat=True))
+        failed = set()
+        for (basket_id, session_id, __), status, error in run_concurrently(
+                lambda item: self.expire_session(item[1], item[2]), sessions, self.workers, self.rate):
+            if error is not None:
+                logger.warning("Unable to expire Stripe session %s of basket #%s: %s", session_id, basket_id, error)
+                failed.add(basket_id)
+            elif status == "complete":
+                logger.warning("Stripe session %s of abandoned basket #%s has been paid", session_id, basket_id)
+                completed.append(session_id)
+                paid.add(basket_id)
+            elif status == "expired":
+                expired.append(session_id)
+            else:
+                logger.warning("Stripe session %s of basket #%s is still %s", session_id, basket_id, status)
+                failed.add(basket_id)
+
+        now = timezone.now()
+        if expired:
+            StripeCheckoutAttempt.objects.filter(session_id__in=expired).update(
+                status=StripeCheckoutAttempt.EXPIRED, date_updated=now)
+        if completed:
+            StripeCheckoutAttempt.objects.filter(session_id__in=completed).update(
+                status=StripeCheckoutAttempt.COMPLETE, date_updated=now)
+        released = [basket_id for basket_id in basket_ids if basket_id not in paid and basket_id not in failed]
+        status = Basket.OPEN if self.action == "thaw" else BASKET_STATUS_ABANDONED
+        # Only baskets still frozen, in case a customer came back meanwhile
+        updated = Basket.objects.filter(id__in=released, status=Basket.FROZEN).update(status=status)
+
+        session_cache = CheckoutSessionCache(facade=self.facade)
+        if session_cache.enabled:
+            for basket_id in released:
+                session_cache.delete(basket_id)
+        return {
+            'baskets': updated,
+            'sessions_expired': len(expired),
+            'paid': len(paid),
+            'failed': len(failed - paid),
+        }
+
+    def run(self, batch_size=100, limit=None):
+        """
+        Go through the abandoned baskets in batches, yielding the counts of each.
+        """
+        baskets = self.get_baskets()
+        last_id = 0
+        while limit is None or limit > 0:
+            size = batch_size if limit is None else min(batch_size, limit)
+            basket_ids = list(baskets.filter(id__gt=last_id).values_list('id', flat=True)[:size])
+            if not basket_ids:
+                return
+            yield self.expire_batch(basket_ids)
+            last_id = basket_ids[-1]
+            if limit is not None:
+                limit -= len(basket_ids)
@@ -0,0 +1,114 @@
+"""
+Lets one process take payments for several Stripe accounts, e.g. one per site or partner.  The accounts are
+configured in STRIPE_ACCOUNTS, and the STRIPE_ACCOUNT_RESOLVER picks the one to use for each request or
+basket.  Every account gets its own pooled client, and its credentials are passed with each request, so
+requests for different accounts can be made from any number of threads at once.
+"""
+import threading
+
+from django.conf import settings
+from django.contrib.sites.shortcuts import get_current_site
+from django.utils.module_loading import import_string
+
+
+DEFAULT_ACCOUNT = "default"
+
+_lock = threading.RLock()
+_resolver = None
+
+
+class UnknownAccountError(KeyError):
+    pass
+
+
+class StripeAccount(object):
+    def __init__(self, name, secret_key, publishable_key=None, webhook_secret=None, api_version=None):
+        self.name = name
+        self.secret_key = secret_key
+        self.publishable_key = publishable_key
+        self.webhook_secret = webhook_secret
+        self.api_version = api_version
+
+    def __repr__(self):
+        return "<StripeAccount {0}>".format(self.name)
+
+    @property
+    def client(self):
+        # The client module subclasses the Stripe SDK's HTTP client, so it's only imported when needed
+        from oscar_stripe_sca.client import get_client
+        return get_client(self.secret_key, self.api_version)
+
+
+def get_accounts():
+    """
+    The configured accounts by name.  The "default" account is the one in STRIPE_SECRET_KEY and friends,
+    unless STRIPE_ACCOUNTS has one of that name.
+    """
+    accounts = {
+        DEFAULT_ACCOUNT: StripeAccount(
+            DEFAULT_ACCOUNT,
+            getattr(settings, "STRIPE_SECRET_KEY", None),
+            getattr(settings, "STRIPE_PUBLISHABLE_KEY", None),
+            getattr(settings, "STRIPE_WEBHOOK_SECRET", None)),
+    }
+    for name, config in getattr(settings, "STRIPE_ACCOUNTS", {}).items():
+        accounts[name] = StripeAccount(
+            name, config["SECRET_KEY"], config.get("PUBLISHABLE_KEY"), config.get("WEBHOOK_SECRET"),
+            config.get("API_VERSION"))
+    return accounts
+
+
+def get_account(name=None):
+    try:
+        return get_accounts()[name or DEFAULT_ACCOUNT]
+    except KeyError:
+        raise UnknownAccountError("No Stripe account named {0!r} in STRIPE_ACCOUNTS".format(name))
+
+
+class AccountResolver(object):
+    """
+    Decides which account takes the payment for a request and its basket.  This one always uses the default
+    account; subclass and override ``get_account_name`` to route payments elsewhere.
+    """
+    def get_account_name(self, request=None, basket=None):
+        return DEFAULT_ACCOUNT
+
+    def resolve(self, request=None, basket=None):
+        name = self.get_account_name(request=request, basket=basket)
+        accounts = get_accounts()
+        return accounts.get(name) or accounts[DEFAULT_ACCOUNT]
+
+
+class SiteAccountResolver(AccountResolver):
+    """
+    Uses the account named after the current site's domain, falling back to the default account.
+    """
+    def get_account_name(self, request=None, basket=None):
+        if request is None:
+            return DEFAULT_ACCOUNT
+        return get_current_site(request).domain
+
+
+class PartnerAccountResolver(AccountResolver):
+    """
+    Uses the account named after the code of the partner fulfilling the basket, falling back to the default
+    account when the basket has lines from several partners.
+    """
+    def get_account_name(self, request=None, basket=None):
+        if basket is None or basket.id is None:
+            return DEFAULT_ACCOUNT
+        codes = list(basket.lines.order_by().values_list('stockrecord__partner__code', flat=True).distinct()[:2])
+        return codes[0] if len(codes) == 1 and codes[0] else DEFAULT_ACCOUNT
+
+
+def get_resolver():
+    global _resolver
+    path = getattr(settings, "STRIPE_ACCOUNT_RESOLVER", "oscar_stripe_sca.accounts.AccountResolver")
+    if _resolver is None or _resolver[0] != path:
+        with _lock:
+            _resolver = (path, import_string(path)())
+    return _resolver[1]
+
+
+def resolve_account(request=None, basket=None):
+    return get_resolver().resolve(request=request, basket=basket)
@@ -1,14 +1,19 @@
 from oscar.apps.checkout.apps import CheckoutConfig
-from oscar.core.loading import get_class
 from django.urls import path
 
 
 class StripeSCACheckoutConfig(CheckoutConfig):
     def ready(self):
-        stripe_payment_details_view = get_class("oscar_stripe_sca.views", "StripeSCAPaymentDetailsView")
-        stripe_success_view = get_class("oscar_stripe_sca.views", "StripeSCASuccessResponseView")
-        stripe_cancel_view = get_class("oscar_stripe_sca.views", "StripeSCACancelResponseView")
+        # oscar_stripe_sca isn't an Oscar app, so get_class can't load its views
+        from oscar_stripe_sca import views
+        self.stripe_payment_details_view = views.StripeSCAPaymentDetailsView
+        self.stripe_success_view = views.StripeSCASuccessResponseView
+        self.stripe_cancel_view = views.StripeSCACancelResponseView
+        self.stripe_webhook_view = views.StripeSCAWebhookView
+        self.stripe_metrics_view = views.StripeSCAMetricsView
         super().ready()
+        # After CheckoutConfig.ready, which sets Oscar's own
+        self.shipping_method_view = views.StripeSCAShippingMethodView
 
     def get_urls(self):
         urls = super(StripeSCACheckoutConfig, self).get_urls()
@@ -19,6 +24,12 @@ class StripeSCACheckoutConfig(CheckoutConfig):
                 self.stripe_success_view.as_view(preview=True), name='stripe-preview'),
             path('payment-cancel/<int:basket_id>/',
                 self.stripe_cancel_view.as_view(), name='stripe-cancel'),
+            path('stripe-webhook/',
+                self.stripe_webhook_view.as_view(), name='stripe-webhook'),
+            path('stripe-webhook/<str:account>/',
+                self.stripe_webhook_view.as_view(), name='stripe-account-webhook'),
+            path('stripe-metrics/',
+                self.stripe_metrics_view.as_view(), name='stripe-metrics'),
         ]
         return urls
     
@@ -0,0 +1,163 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+
+from oscar_stripe_sca import signals
+from oscar_stripe_sca.policy import is_retryable
+from oscar_stripe_sca.utils import stripe
+
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+_lock = threading.Lock()
+
+
+def get_circuit_open_error():
+    """
+    The CircuitOpenError class, raised instead of calling Stripe while the circuit is open.  It is a Stripe
+    error, so it is only defined when first asked for, to keep importing this module from importing stripe.
+    Use ``breaker.CircuitOpenError`` rather than importing the name from modules loaded with the URLconf.
+    """
+    global CircuitOpenError
+    with _lock:
+        if "CircuitOpenError" not in globals():
+            class CircuitOpenError(stripe.error.APIConnectionError):
+                """
+                Raised instead of calling Stripe while the circuit is open.
+                """
+    return CircuitOpenError
+
+
+def __getattr__(name):
+    if name == "CircuitOpenError":
+        return get_circuit_open_error()
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+
+class CircuitBreaker(object):
+    """
+    Stops calling Stripe while it is failing, so that requests fail at once instead of each waiting out its
+    timeout.  Errors that mean Stripe is in trouble (see policy.is_retryable) and calls slower than
+    ``slow_call`` seconds count as failures; ``failure_threshold`` of them within ``window`` seconds open
+    the circuit.  After ``recovery_timeout`` seconds one trial call at a time is let through: if it succeeds
+    the circuit closes, otherwise it stays open for another ``recovery_timeout``.
+
+    The state is kept in the Django cache, so all processes sharing a cache share a circuit.
+    """
+    key_prefix = "oscar_stripe_sca:breaker:"
+
+    def __init__(self, name="stripe", alias=None, failure_threshold=None, window=None, recovery_timeout=None,
+                 slow_call=None):
+        self.name = name
+        self.alias = alias or getattr(settings, "STRIPE_BREAKER_CACHE", "default")
+        self.failure_threshold = (
+            failure_threshold if failure_threshold is not None
+            else getattr(settings, "STRIPE_BREAKER_FAILURE_THRESHOLD", 5))
+        self.window = window or getattr(settings, "STRIPE_BREAKER_WINDOW", 60)
+        self.recovery_timeout = recovery_timeout or getattr(settings, "STRIPE_BREAKER_RECOVERY_TIMEOUT", 30)
+        self.slow_call = slow_call if slow_call is not None else getattr(settings, "STRIPE_BREAKER_SLOW_CALL", 10)
+
+    @property
+    def enabled(self):
+        return bool(self.failure_threshold)
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get_key(self, suffix):
+        return "{0}{1}:{2}".format(self.key_prefix, self.name, suffix)
+
+    def get_failures_key(self):
+        return self.get_key("failures:{0}".format(int(time.time() // self.window)))
+
+    def get_state(self):
+        state = self.cache.get(self.get_key("state"))
+        if state is None:
+            return CLOSED
+        if time.time() < state["opened_at"] + self.recovery_timeout:
+            return OPEN
+        return HALF_OPEN
+
+    def before_call(self, operation):
+        """
+        Raise CircuitOpenError if the call mustn't be made.  Returns True if the call is the half-open trial,
+        which must be passed on to after_call.
+        """
+        if not self.enabled:
+            return False
+        state = self.get_state()
+        if state == CLOSED:
+            return False
+        # Only one process gets to make the trial call; the rest fail fast until it has finished
+        if state == OPEN or not self.cache.add(self.get_key("trial"), 1, self.recovery_timeout):
+            raise get_circuit_open_error()("Not calling Stripe {0}: the circuit is open".format(operation))
+        self.send_state_changed(OPEN, HALF_OPEN)
+        return True
+
+    def after_call(self, operation, trial, duration, error=None):
+        if not self.enabled:
+            return
+        failed = (error is not None and is_retryable(error)) or bool(self.slow_call and duration >= self.slow_call)
+        if trial:
+            self.cache.delete(self.get_key("trial"))
+            if failed:
+                self.open(HALF_OPEN)
+            else:
+                self.close()
+        elif failed:
+            self.record_failure(operation, error, duration)
+
+    @contextmanager
+    def guard(self, operation):
+        trial = self.before_call(operation)
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.after_call(operation, trial, time.monotonic() - started, e)
+            raise
+        self.after_call(operation, trial, time.monotonic() - started)
+
+    def record_failure(self, operation, error, duration):
+        key = self.get_failures_key()
+        self.cache.add(key, 0, self.window * 2)
+        try:
+            failures = self.cache.incr(key)
+        except ValueError:
+            # Evicted since the add
+            failures = 1
+            self.cache.set(key, failures, self.window * 2)
+        logger.info(
+            "Stripe %s failed (%s, %.1fs), %s failures in the last %ss",
+            operation, error.__class__.__name__ if error is not None else "slow", duration, failures, self.window)
+        # add rather than set, so that only the process which trips the circuit reports it
+        if failures >= self.failure_threshold and self.cache.add(
+                self.get_key("state"), {"opened_at": time.time()}, None):
+            logger.warning("Stripe circuit opened after %s failures", failures)
+            self.send_state_changed(CLOSED, OPEN)
+
+    def open(self, previous):
+        self.cache.set(self.get_key("state"), {"opened_at": time.time()}, None)
+        logger.warning("Stripe circuit trial call failed, circuit reopened")
+        self.send_state_changed(previous, OPEN)
+
+    def close(self):
+        self.cache.delete_many([self.get_key("state"), self.get_failures_key()])
+        logger.warning("Stripe circuit closed")
+        self.send_state_changed(HALF_OPEN, CLOSED)
+
+    def reset(self):
+        self.cache.delete_many([self.get_key("state"), self.get_key("trial"), self.get_failures_key()])
+
+    def send_state_changed(self, old_state, new_state):
+        signals.circuit_breaker_state_changed.send(
+            sender=self.__class__, name=self.name, old_state=old_state, new_state=new_state)
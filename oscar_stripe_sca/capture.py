@@ -0,0 +1,218 @@
+"""
+Captures payments in the background once their order has been placed (STRIPE_CAPTURE_MODE "deferred"), so that
+placing an order doesn't wait on Stripe.  The success view records the payment as authorised and leaves the
+checkout attempt in the Authorised status with a capture due; the STRIPE_CAPTURE_EXECUTOR then makes the
+capture.  The attempts table is the queue: whatever the executor, captures that fail with a temporary error are
+tried again later, and the ``stripe_process_captures`` command picks up any that are due, e.g. because the
+process making them was stopped.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from oscar_stripe_sca import CAPTURE_MODE_DEFERRED, CAPTURE_MODE_IMMEDIATE
+from oscar_stripe_sca.models import StripeCheckoutAttempt
+from oscar_stripe_sca.policy import is_retryable
+from oscar_stripe_sca.utils import run_concurrently, stripe
+
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.RLock()
+_executor = None
+
+
+def is_deferred():
+    return getattr(settings, "STRIPE_CAPTURE_MODE", CAPTURE_MODE_IMMEDIATE) == CAPTURE_MODE_DEFERRED
+
+
+class CaptureQueue(object):
+    """
+    Captures the authorised attempts that are due.  Attempts are claimed for ``lease`` seconds before Stripe
+    is called, so that two workers never capture the same payment at once; one that isn't finished by then,
+    e.g. because its worker died, is due again.  A failed capture is retried after ``retry_delay`` seconds,
+    doubling each time, up to ``max_attempts`` attempts, and then given the Capture failed status.  Errors
+    that retrying can't fix, such as an expired authorisation, fail at once.
+
+    The Stripe requests are idempotent (see Facade.get_capture_params), so a capture that is repeated, e.g.
+    after a worker died between capturing and recording it, doesn't charge the customer twice.
+    """
+    def __init__(self, max_attempts=None, retry_delay=None, lease=300):
+        self.max_attempts = (
+            getattr(settings, "STRIPE_CAPTURE_MAX_ATTEMPTS", 5) if max_attempts is None else max_attempts)
+        self.retry_delay = (
+            getattr(settings, "STRIPE_CAPTURE_RETRY_DELAY", 60) if retry_delay is None else retry_delay)
+        self.lease = lease
+        self.facades = {}
+
+    def get_due(self, now=None):
+        return StripeCheckoutAttempt.objects.filter(
+            status=StripeCheckoutAttempt.AUTHORISED, order__isnull=False,
+            date_capture_due__lte=now or timezone.now()).order_by('date_capture_due')
+
+    def claim(self, attempt_ids=None, limit=100):
+        """
+        Claim the due attempts among ``attempt_ids`` (or any due attempts, at most ``limit``), and return them.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            due = self.get_due(now)
+            if attempt_ids is not None:
+                due = due.filter(id__in=attempt_ids)
+            # Other workers skip the rows being claimed rather than wait for them, where the database can
+            ids = list(due.select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+            StripeCheckoutAttempt.objects.filter(id__in=ids).update(
+                date_capture_due=now + timedelta(seconds=self.lease), date_updated=now)
+        return list(StripeCheckoutAttempt.objects.select_related('order').filter(id__in=ids).order_by('id'))
+
+    def get_facade(self, account):
+        # Imported here, as this module is loaded with the success view
+        from oscar_stripe_sca.facade import Facade
+        if account not in self.facades:
+            self.facades[account] = Facade.for_account(account)
+        return self.facades[account]
+
+    def capture(self, attempt):
+        """
+        Capture an attempt's payment at Stripe.  Doesn't touch the database.
+        """
+        facade = self.get_facade(attempt.account)
+        try:
+            facade.capture_charge(attempt.payment_intent_id, attempt.order.number, attempt=attempt.capture_attempts)
+        except stripe.error.InvalidRequestError as e:
+            # Already captured, e.g. by an earlier try whose outcome wasn't recorded, or by the webhook
+            if e.code != "payment_intent_unexpected_state" or (
+                    facade.retrieve_payment_intent(attempt.payment_intent_id).status != "succeeded"):
+                raise
+
+    def get_delay(self, attempts):
+        return self.retry_delay * 2 ** (attempts - 1)
+
+    def record(self, attempt, error=None):
+        """
+        Record the outcome of a capture, and return the attempt's status afterwards.
+        """
+        if error is None:
+            Source = apps.get_model('payment', 'Source')
+            source = Source.objects.filter(order=attempt.order, reference=attempt.payment_intent_id).first()
+            if source is not None:
+                # Also marks the attempt as captured
+                self.get_facade(attempt.account).mark_captured(attempt.order, source)
+            StripeCheckoutAttempt.objects.filter(pk=attempt.pk).update(
+                status=StripeCheckoutAttempt.CAPTURED, capture_attempts=attempt.capture_attempts + 1,
+                capture_error="", date_capture_due=None, date_updated=timezone.now())
+            return StripeCheckoutAttempt.CAPTURED
+
+        attempts = attempt.capture_attempts + 1
+        fields = {'capture_attempts': attempts, 'capture_error': str(error)}
+        if isinstance(error, stripe.error.StripeError) and is_retryable(error) and attempts < self.max_attempts:
+            delay = self.get_delay(attempts)
+            logger.warning(
+                "Unable to capture %s for order %s, trying again in %ss: %s",
+                attempt.payment_intent_id, attempt.order.number, delay, error)
+            fields.update(date_capture_due=timezone.now() + timedelta(seconds=delay))
+            status = StripeCheckoutAttempt.AUTHORISED
+        else:
+            logger.error(
+                "Unable to capture %s for order %s after %s attempts: %s",
+                attempt.payment_intent_id, attempt.order.number, attempts, error)
+            fields.update(status=StripeCheckoutAttempt.CAPTURE_FAILED, date_capture_due=None)
+            status = StripeCheckoutAttempt.CAPTURE_FAILED
+        # Unless something else, e.g. the webhook, has recorded the capture meanwhile
+        StripeCheckoutAttempt.objects.filter(pk=attempt.pk, status=StripeCheckoutAttempt.AUTHORISED).update(
+            date_updated=timezone.now(), **fields)
+        return status
+
+    def process(self, attempt_ids=None, limit=100, workers=1, rate=0):
+        """
+        Claim and capture due attempts, and return ``(attempt, status, error)`` for each.  Stripe is called by a
+        bounded pool of ``workers`` threads; the database is only used from the calling thread.
+        """
+        attempts = self.claim(attempt_ids, limit)
+        if workers > 1:
+            results = run_concurrently(self.capture, attempts, workers, rate)
+        else:
+            results = []
+            for attempt in attempts:
+                try:
+                    results.append((attempt, self.capture(attempt), None))
+                except Exception as e:
+                    results.append((attempt, None, e))
+        return [(attempt, self.record(attempt, error), error) for attempt, __, error in results]
+
+
+class CaptureExecutor(object):
+    """
+    Hands the capture of an authorised attempt over to be made in the background.  Subclass and override
+    ``submit`` to use your own task runner; the task only needs to call
+    ``CaptureQueue().process([attempt_id])``, which claims the attempt first, so it's safe to run more than
+    once.
+    """
+    def submit(self, attempt_id):
+        raise NotImplementedError
+
+
+class QueueCaptureExecutor(CaptureExecutor):
+    """
+    Leaves the captures to the ``stripe_process_captures`` command.
+    """
+    def submit(self, attempt_id):
+        pass
+
+
+class ThreadPoolCaptureExecutor(CaptureExecutor):
+    """
+    Captures on a process-wide pool of STRIPE_CAPTURE_WORKERS threads, and schedules the retries of failed
+    captures in the same process.  Captures still due when the process stops are left to the
+    ``stripe_process_captures`` command.
+    """
+    def __init__(self, workers=None):
+        self.pool = ThreadPoolExecutor(
+            max_workers=getattr(settings, "STRIPE_CAPTURE_WORKERS", 4) if workers is None else workers,
+            thread_name_prefix="stripe-capture")
+        self.queue = CaptureQueue()
+
+    def submit(self, attempt_id):
+        return self.pool.submit(self.run, attempt_id)
+
+    def run(self, attempt_id):
+        try:
+            for attempt, status, __ in self.queue.process([attempt_id]):
+                if status == StripeCheckoutAttempt.AUTHORISED:
+                    timer = threading.Timer(
+                        self.queue.get_delay(attempt.capture_attempts + 1), self.submit, [attempt_id])
+                    timer.daemon = True
+                    timer.start()
+        except Exception:
+            logger.exception("Unable to capture the payment of checkout attempt #%s", attempt_id)
+        finally:
+            # The connections opened by this worker thread
+            connections.close_all()
+
+
+def get_executor():
+    global _executor
+    path = getattr(settings, "STRIPE_CAPTURE_EXECUTOR", "oscar_stripe_sca.capture.ThreadPoolCaptureExecutor")
+    if _executor is None or _executor[0] != path:
+        with _lock:
+            if _executor is None or _executor[0] != path:
+                _executor = (path, import_string(path)())
+    return _executor[1]
+
+
+def defer(attempt, order):
+    """
+    Queue the capture of an attempt whose order has just been placed.  The executor is given it once the
+    order has been committed.
+    """
+    now = timezone.now()
+    StripeCheckoutAttempt.objects.filter(pk=attempt.pk).update(
+        order=order, status=StripeCheckoutAttempt.AUTHORISED, date_capture_due=now, date_updated=now)
+    transaction.on_commit(lambda: get_executor().submit(attempt.pk))
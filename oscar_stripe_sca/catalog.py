@@ -0,0 +1,166 @@
+import hashlib
+import logging
+
+from django.utils import timezone
+from oscar.core.loading import get_class, get_model
+
+from oscar_stripe_sca.facade import Facade
+from oscar_stripe_sca.models import StripePrice
+from oscar_stripe_sca.money import to_minor_units
+from oscar_stripe_sca.policy import idempotency_key
+from oscar_stripe_sca.utils import run_concurrently
+
+
+logger = logging.getLogger(__name__)
+StockRecord = get_model('partner', 'StockRecord')
+Selector = get_class('partner.strategy', 'Selector')
+
+
+class CatalogSync(object):
+    """
+    Mirrors stock records as Stripe Products and Prices, so that Checkout Sessions can refer to them by id
+    (see STRIPE_CATALOG_SYNC).  Each Oscar product becomes a Stripe Product and each of its stock records a
+    Price of it, at the price including tax that the default strategy gives.
+
+    Stock records are handled in batches: what exists already is loaded with one query, the Stripe requests
+    are made by a bounded pool of concurrent requests, and the results are saved with one bulk insert and
+    one bulk update.
+    """
+    def __init__(self, facade=None, workers=8, rate=20):
+        self.facade = facade or Facade()
+        self.account = self.facade.account.name
+        self.workers = workers
+        self.rate = rate
+        # Without a request, as the prices are for every customer
+        self.strategy = Selector().strategy()
+
+    def get_stockrecords(self, since=None):
+        """
+        Stock records to sync, in id order.  With ``since``, only those whose stock record or product has
+        changed since then.
+        """
+        stockrecords = StockRecord.objects.select_related('product', 'product__parent').order_by('id')
+        if since is not None:
+            stockrecords = stockrecords.filter(
+                date_updated__gt=since) | stockrecords.filter(
+                product__date_updated__gt=since) | stockrecords.filter(
+                product__parent__date_updated__gt=since)
+        return stockrecords
+
+    def get_price(self, stockrecord):
+        """
+        The unit amount in minor units and the currency customers pay, or None if it can't be known without
+        a customer, e.g. because the tax depends on their address.
+        """
+        price = self.strategy.pricing_policy(stockrecord.product, stockrecord)
+        if not price.exists or not price.is_tax_known:
+            return None
+        return to_minor_units(price.incl_tax, price.currency), price.currency
+
+    def call(self, func, items):
+        results = []
+        for item, result, error in run_concurrently(func, items, self.workers, self.rate):
+            if error is not None:
+                logger.warning("Unable to sync %s to Stripe: %s", item, error)
+            results.append((item, result, error))
+        return results
+
+    def sync_batch(self, stockrecords):
+        """
+        Create or update the Stripe objects for a batch of stock records, and return a dict of counts.
+        """
+        existing = dict(
+            (price.stockrecord_id, price)
+            for price in StripePrice.objects.filter(
+                account=self.account, stockrecord_id__in=[stockrecord.id for stockrecord in stockrecords]))
+        # Stripe products already made for these Oscar products, through any of their stock records
+        products = dict(StripePrice.objects.filter(
+            account=self.account, stockrecord__product_id__in=[stockrecord.product_id for stockrecord in stockrecords]
+        ).values_list('stockrecord__product_id', 'product_id'))
+
+        changes = []
+        new_products, renames = {}, {}
+        for stockrecord in stockrecords:
+            price = self.get_price(stockrecord)
+            if price is None:
+                continue
+            name = stockrecord.product.get_title()[:255]
+            current = existing.get(stockrecord.id)
+            if current is not None and (current.unit_amount, current.currency, current.name) == price + (name,):
+                continue
+            changes.append((stockrecord, price, name, current))
+            if stockrecord.product_id not in products:
+                new_products[stockrecord.product_id] = (stockrecord.product_id, name)
+            elif current is not None and current.name != name:
+                renames[current.product_id] = (current.product_id, name)
+
+        for (product_id, name), product, error in self.call(
+                lambda item: self.facade.create_product(
+                    item[1], {"oscar_product_id": item[0]},
+                    idempotency_key("product", self.account, item[0], hashlib.sha1(item[1].encode("utf-8")).hexdigest())),
+                list(new_products.values())):
+            if error is None:
+                products[product_id] = product.id
+        self.call(lambda item: self.facade.rename_product(*item), list(renames.values()))
+
+        repriced = [
+            (stockrecord, price, name, current) for stockrecord, price, name, current in changes
+            if stockrecord.product_id in products and (current is None or (current.unit_amount, current.currency) != price)
+        ]
+        created = dict(
+            (item[0].id, result) for item, result, error in self.call(
+                lambda item: self.facade.create_price(
+                    products[item[0].product_id], item[1][0], item[1][1],
+                    idempotency_key("price", self.account, item[0].id, products[item[0].product_id], *item[1])),
+                repriced)
+            if error is None)
+
+        now = timezone.now()
+        to_create, to_update, replaced = [], [], []
+        for stockrecord, (unit_amount, currency), name, current in changes:
+            if stockrecord.product_id not in products:
+                continue
+            if stockrecord.id in created:
+                price_id = created[stockrecord.id].id
+            elif current is not None and (current.unit_amount, current.currency) == (unit_amount, currency):
+                # Only renamed
+                price_id = current.price_id
+            else:
+                # Creating its price failed; try again next time.  Keeping the old price would charge the
+                # old amount.
+                continue
+            if current is None:
+                to_create.append(StripePrice(
+                    account=self.account, stockrecord=stockrecord, product_id=products[stockrecord.product_id],
+                    price_id=price_id, unit_amount=unit_amount, currency=currency, name=name))
+                continue
+            if current.price_id != price_id:
+                replaced.append(current.price_id)
+            current.price_id, current.unit_amount, current.currency, current.name = (
+                price_id, unit_amount, currency, name)
+            current.date_synced = now
+            to_update.append(current)
+        StripePrice.objects.bulk_create(to_create)
+        StripePrice.objects.bulk_update(
+            to_update, ['price_id', 'unit_amount', 'currency', 'name', 'date_synced'])
+        # Sessions already created with the old prices keep working; new ones use the new prices
+        self.call(self.facade.deactivate_price, replaced)
+        return {
+            'stockrecords': len(stockrecords),
+            'created': len(to_create),
+            'updated': len(to_update),
+            'failed': len(changes) - len(to_create) - len(to_update),
+        }
+
+    def run(self, since=None, batch_size=100):
+        """
+        Go through the stock records in batches, yielding the counts of each.
+        """
+        stockrecords = self.get_stockrecords(since)
+        last_id = 0
+        while True:
+            batch = list(stockrecords.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                return
+            yield self.sync_batch(batch)
+            last_id = batch[-1].id
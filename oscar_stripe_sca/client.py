@@ -0,0 +1,121 @@
+import threading
+from contextlib import contextmanager
+
+import requests
+import stripe
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+try:
+    from stripe import RequestsClient
+except ImportError:
+    # stripe<7
+    from stripe.http_client import RequestsClient
+
+
+STRIPE_API_VERSION = "2020-03-02"
+
+_lock = threading.RLock()
+_http_client = None
+_clients = {}
+
+
+class PooledRequestsClient(RequestsClient):
+    """
+    A RequestsClient whose read timeout can be narrowed for the requests made by the current thread, so that
+    each operation can be held to its own time budget.
+    """
+    def __init__(self, timeout, **kwargs):
+        self._local = threading.local()
+        super(PooledRequestsClient, self).__init__(timeout=timeout, **kwargs)
+
+    @property
+    def _timeout(self):
+        return getattr(self._local, "timeout", None) or self._default_timeout
+
+    @_timeout.setter
+    def _timeout(self, value):
+        self._default_timeout = value
+
+    @contextmanager
+    def timeout(self, seconds):
+        previous = getattr(self._local, "timeout", None)
+        connect_timeout, read_timeout = self._default_timeout
+        self._local.timeout = (min(connect_timeout, seconds), min(read_timeout, seconds))
+        try:
+            yield
+        finally:
+            self._local.timeout = previous
+
+
+def get_http_client():
+    """
+    Return the process-wide Stripe HTTP client, building it on first use.  It keeps a pool of keep-alive
+    connections to Stripe, so repeated calls from the same worker skip the TCP and TLS handshakes.
+    """
+    global _http_client
+    if _http_client is None:
+        with _lock:
+            if _http_client is None:
+                pool_size = getattr(settings, "STRIPE_HTTP_POOL_SIZE", 10)
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                timeout = (
+                    getattr(settings, "STRIPE_CONNECT_TIMEOUT", 10),
+                    getattr(settings, "STRIPE_READ_TIMEOUT", 80),
+                )
+                _http_client = PooledRequestsClient(timeout=timeout, session=session, **get_async_client_kwargs(timeout))
+                # Installed once per process; every request below passes its own key and version
+                stripe.default_http_client = _http_client
+                api_base = getattr(settings, "STRIPE_API_BASE", None)
+                if api_base:
+                    stripe.api_base = api_base
+    return _http_client
+
+
+def get_async_client_kwargs(timeout):
+    """
+    Newer versions of the stripe library make their ``*_async`` requests through a fallback client, which
+    needs httpx.  Older versions, or installs without httpx, get no fallback and AsyncFacade uses threads.
+    """
+    try:
+        from stripe import HTTPXClient
+        return {"async_fallback_client": HTTPXClient(timeout=timeout[1])}
+    except ImportError:
+        return {}
+
+
+class StripeClient(object):
+    """
+    The credentials used to talk to Stripe.  They are passed explicitly with every request rather than
+    written to the stripe module globals, so clients for different keys can be used from several threads.
+    """
+    def __init__(self, api_key, api_version=STRIPE_API_VERSION):
+        self.api_key = api_key
+        self.api_version = api_version
+        self.http_client = get_http_client()
+
+    @property
+    def request_options(self):
+        return {
+            "api_key": self.api_key,
+            "stripe_version": self.api_version,
+        }
+
+
+def get_client(api_key=None, api_version=None):
+    """
+    Return the process-wide client for an API key, defaulting to settings.STRIPE_SECRET_KEY.
+    """
+    api_key = api_key or settings.STRIPE_SECRET_KEY
+    api_version = api_version or getattr(settings, "STRIPE_API_VERSION", STRIPE_API_VERSION)
+    key = (api_key, api_version)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = StripeClient(api_key, api_version)
+    return client
@@ -1,47 +1,66 @@
+import hashlib
 import logging
+import time
+import uuid
 
-import stripe
+from asgiref.sync import sync_to_async
 from django.apps import apps
 from django.conf import settings
+from django.db.models import F
 from django.utils import timezone
-from decimal import Decimal as D, ROUND_HALF_UP
+from oscar_stripe_sca import CHECKOUT_MODE_EMBEDDED, CHECKOUT_MODE_TEMPLATE, PAYMENT_METHOD_STRIPE, speculative
+from oscar_stripe_sca.accounts import DEFAULT_ACCOUNT, get_account, resolve_account
+from oscar_stripe_sca.breaker import CircuitBreaker
+from oscar_stripe_sca.instrumentation import StripeCall, count, measure
+from oscar_stripe_sca.line_items import LineItemBuilder, PaymentItem
+from oscar_stripe_sca.models import StripeCheckoutAttempt
+from oscar_stripe_sca.money import ZERO_DECIMAL_CURRENCIES, to_minor_units
+from oscar_stripe_sca.offer_cache import FrozenBasketOfferCache
+from oscar_stripe_sca.policy import CallPolicy, idempotency_key
+from oscar_stripe_sca.session_cache import CheckoutSessionCache, session_fingerprint
+from oscar_stripe_sca.utils import stripe
 
 
 logger = logging.getLogger(__name__)
-Source = apps.get_model('payment', 'Source')
-Order = apps.get_model('order', 'Order')
-
-# https://support.stripe.com/questions/which-zero-decimal-currencies-does-stripe-support
-ZERO_DECIMAL_CURRENCIES = (
-    'BIF',  # Burundian Franc
-    'CLP',  # Chilean Peso
-    'DJF',  # Djiboutian Franc
-    'GNF',  # Guinean Franc
-    'JPY',  # Japanese Yen
-    'KMF',  # Comorian Franc
-    'KRW',  # South Korean Won
-    'MGA',  # Malagasy Ariary
-    'PYG',  # Paraguayan Guaraní
-    'RWF',  # Rwandan Franc
-    'VND',  # Vietnamese Đồng
-    'VUV',  # Vanuatu Vatu
-    'XAF',  # Central African Cfa Franc
-    'XOF',  # West African Cfa Franc
-    'XPF',  # Cfp Franc
-)
-
-
-class PaymentItem:
-    def __init__(self, **kwargs):
-        self.quantity = kwargs.get('quantity')
-        self.title = kwargs.get('title')
-        self.price_incl_tax = kwargs.get('price_incl_tax')
-        self.price_currency = kwargs.get('price_currency')
+
 
 class Facade(object):
-    def __init__(self):
-        stripe.api_key = settings.STRIPE_SECRET_KEY
-        stripe.api_version = "2020-03-02"
+    def __init__(self, client=None, policy=None, breaker=None, account=None):
+        # Requests are made for one Stripe account, the default one unless given (see accounts.py)
+        self.account = account or get_account()
+        self.client = client or self.account.client
+        self.policy = policy or CallPolicy()
+        self.breaker = breaker or CircuitBreaker(self.get_breaker_name())
+
+    @classmethod
+    def for_request(cls, request=None, basket=None, **kwargs):
+        """
+        A facade for the account STRIPE_ACCOUNT_RESOLVER picks for the request and basket.
+        """
+        return cls(account=resolve_account(request=request, basket=basket), **kwargs)
+
+    @classmethod
+    def for_account(cls, name=None, **kwargs):
+        """
+        A facade for the account of that name, e.g. the one recorded on a StripeCheckoutAttempt.
+        """
+        return cls(account=get_account(name), **kwargs)
+
+    def for_payment_intent(self, payment_intent_id):
+        """
+        A facade for the account the payment intent was created with, as recorded on its checkout attempt: this
+        one, unless the attempt names another account.
+        """
+        account = StripeCheckoutAttempt.get_accounts([payment_intent_id]).get(payment_intent_id)
+        if account is None or account == self.account.name:
+            return self
+        return self.for_account(account, policy=self.policy)
+
+    def get_breaker_name(self):
+        # One account failing, e.g. with a revoked key, mustn't stop payments for the others
+        if self.account.name == DEFAULT_ACCOUNT:
+            return "stripe"
+        return "stripe:{0}".format(self.account.name)
 
     @staticmethod
     def get_friendly_decline_message(error):
@@ -51,16 +70,24 @@ class Facade(object):
     def get_friendly_error_message(error):
         return 'An error occurred when communicating with the payment gateway.'
 
+    @staticmethod
+    def get_checkout_mode():
+        return getattr(settings, "STRIPE_CHECKOUT_MODE", CHECKOUT_MODE_TEMPLATE)
+
     def convert_to_cents(self, price, currency):
         """
-        Convert price to cents with proper rounding, handling zero-decimal currencies.
+        Convert price to cents with proper rounding, handling zero and three-decimal currencies.
         """
-        if currency.upper() in ZERO_DECIMAL_CURRENCIES:
-            return int(D(str(price)).quantize(D('1'), ROUND_HALF_UP))
-        else:
-            return int(D(str(price)).quantize(D('0.01'), ROUND_HALF_UP) * 100)
+        return to_minor_units(price, currency)
 
-    def begin(self, customer_email, basket, total, shipping_method):
+    def get_line_item_builder(self):
+        return LineItemBuilder(account=self.account.name)
+
+    def get_session_params(self, customer_email, basket, total, shipping_method):
+        """
+        Build the parameters for the Checkout Session.  Shared by Facade and AsyncFacade so that both send
+        identical requests.
+        """
         metadata = {
             "discounts": "",
         }
@@ -68,118 +95,327 @@ class Facade(object):
         for voucher in basket.grouped_voucher_discounts:
             metadata['discounts'] += "{0} ({1}), ".format(voucher['voucher'].name, voucher['discount'])
 
-        all_line_items = []
-        for line in basket.all_lines():
-            # this loop will split line into discounted and non-discounted lines
-            for prices in line.get_price_breakdown():
-                price_incl_tax, _, quantity = prices
-                all_line_items.append(
-                    PaymentItem(
-                        quantity=quantity,
-                        title=line.product.title,
-                        price_incl_tax=price_incl_tax,
-                        price_currency=line.price_currency
-                    )
-                )
-
-        if basket.is_shipping_required() and shipping_method:
-            price = shipping_method.calculate(basket)
-            all_line_items.append(
-                PaymentItem(
-                    quantity=1,
-                    title=shipping_method.name,
-                    price_incl_tax=price.incl_tax,
-                    price_currency=price.currency
-                )
-            )
-
-        # Four cases here.  Two versions of the Stripe API, and whether we want to compress the line items or not.
-        if settings.STRIPE_COMPRESS_TO_ONE_LINE_ITEM:
-            line_items_summary = ", ".join(["{0}x{1}".format(l.quantity, l.title) for l in all_line_items])
-            if not settings.STRIPE_USE_PRICES_API:
-                line_items = [{
-                    "name": line_items_summary,
-                    "amount": self.convert_to_cents(total.incl_tax, total.currency),
-                    "currency": total.currency,
-                    "quantity": 1,
-                }]
-            else:
-                line_items = [{
-                    "price_data":  {
-                        "product_data": {
-                            "name": line_items_summary,
-                        },
-                        "currency": total.currency,
-                        "unit_amount": self.convert_to_cents(total.incl_tax, total.currency),
-                    },
-                    "quantity": 1,
-                }]
-        else:
-            line_items = []
-            if not settings.STRIPE_USE_PRICES_API:
-                for line_item in all_line_items:
-                    line_items.append({
-                        "name": line_item.title,
-                        "amount": self.convert_to_cents(line_item.price_incl_tax, line_item.price_currency),
-                        "currency": line_item.price_currency,
-                        "quantity": line_item.quantity
-                    })
-            else:
-                for line_item in all_line_items:
-                    line_items.append({
-                        "price_data":  {
-                            "product_data": {
-                                "name": line_item.title,
-                            },
-                            "currency": line_item.price_currency,
-                            "unit_amount": self.convert_to_cents(line_item.price_incl_tax, line_item.price_currency),
-                        },
-                        "quantity": line_item.quantity,
-                    })
+        line_items = self.get_line_item_builder().get_line_items(basket, total, shipping_method)
 
-        basket.freeze()
-        session = stripe.checkout.Session.create(
+        params = dict(
             mode="payment",
             customer_email=customer_email,
+            client_reference_id=str(basket.id),
             payment_method_types=['card'],
             line_items=line_items,
             metadata=metadata,
             success_url=settings.STRIPE_PAYMENT_SUCCESS_URL.format(basket.id),
             cancel_url=settings.STRIPE_PAYMENT_CANCEL_URL.format(basket.id),
-            payment_intent_data={
-                'capture_method': 'manual',
-            },
+            payment_intent_data=self.get_payment_intent_data(customer_email),
         )
+        if self.get_checkout_mode() == CHECKOUT_MODE_EMBEDDED:
+            # Embedded sessions send the customer back to return_url, and have no cancel button of their own
+            params.update(ui_mode="embedded", return_url=params.pop("success_url"))
+            del params["cancel_url"]
+        return params
+
+    def get_payment_intent_data(self, customer_email):
+        payment_intent_data = {
+            'capture_method': 'manual',
+        }
+        if getattr(settings, "STRIPE_SEND_RECEIPT", True) and customer_email:
+            # Set once here, so that capturing the payment doesn't need a separate request to add it
+            payment_intent_data['receipt_email'] = customer_email
+        return payment_intent_data
+
+    def prepare_request(self, resource, method, idempotency_key, params):
+        params.update(self.client.request_options)
+        if idempotency_key is not None:
+            params["idempotency_key"] = idempotency_key
+        operation = "{0}.{1}".format(resource.OBJECT_NAME, method)
+        # Reads are always safe to retry; writes only when an idempotency key stops them acting twice
+        can_retry = method == "retrieve" or idempotency_key is not None
+        return operation, params, can_retry
+
+    def request(self, resource, method, *args, idempotency_key=None, **params):
+        """
+        Make a Stripe request with this facade's credentials, within the operation's time budget and with
+        retries as the policy allows.  Raises CircuitOpenError without calling Stripe while the circuit
+        breaker is open.
+        """
+        operation, params, can_retry = self.prepare_request(resource, method, idempotency_key, params)
+        func = getattr(resource, method)
+        with measure(operation) as call, self.breaker.guard(operation):
+            call.response = self.policy.run(
+                operation, lambda: func(*args, **params), http_client=self.client.http_client, can_retry=can_retry,
+                call=call)
+        return call.response
+
+    def get_reusable_session(self, basket, params, claim=False):
+        """
+        Return the session from an earlier render of the payment page, or created ahead of it, if the basket
+        hasn't changed since.
+        """
+        session_cache = CheckoutSessionCache(facade=self)
+        if not session_cache.enabled:
+            return None
+        return session_cache.get(basket.id, session_fingerprint(params), claim=claim)
+
+    def remember_session(self, basket, params, session, total, speculative=False):
+        StripeCheckoutAttempt.record(basket, session, total, self.account.name)
+        session_cache = CheckoutSessionCache(facade=self)
+        if session_cache.enabled:
+            session_cache.set(basket.id, session_fingerprint(params), session, speculative=speculative)
+
+    def get_session_idempotency_key(self, basket, params):
+        """
+        While sessions are being reused, the same basket contents get the same key for the reuse period, and a
+        new one whenever the basket's session is expired or paid so that Stripe doesn't replay a dead session.
+        Otherwise every call gets a fresh key, which only protects its own retries.
+        """
+        session_cache = CheckoutSessionCache(facade=self)
+        if not session_cache.enabled:
+            return idempotency_key("checkout-session", basket.id, uuid.uuid4().hex)
+        return idempotency_key(
+            "checkout-session", basket.id, session_cache.get_generation(basket.id),
+            int(time.time() // session_cache.ttl), session_fingerprint(params)[:32])
+
+    def prepare(self, customer_email, basket, total, shipping_method):
+        """
+        Start creating the basket's Checkout Session in the background, e.g. once the shipping method is
+        chosen, so that it is ready when ``begin`` is called for the payment details page.  The basket isn't
+        frozen; if it or the shipping method changes in the meantime, ``begin`` discards the session.  Needs
+        STRIPE_SESSION_REUSE_TTL, as the session is handed over through the session cache.
+        """
+        if not CheckoutSessionCache(facade=self).enabled:
+            return None
+        # The basket is read here, in the request's thread; the worker only talks to Stripe and the cache
+        params = self.get_session_params(customer_email, basket, total, shipping_method)
+        return speculative.submit(basket.id, self.create_speculative_session, basket, params, total)
+
+    def create_speculative_session(self, basket, params, total):
+        if self.get_reusable_session(basket, params) is not None:
+            return
+        session = self.request(
+            stripe.checkout.Session, "create", idempotency_key=self.get_session_idempotency_key(basket, params),
+            **params)
+        self.remember_session(basket, params, session, total, speculative=True)
+        count("speculative_session.created")
+
+    def begin(self, customer_email, basket, total, shipping_method):
+        params = self.get_session_params(customer_email, basket, total, shipping_method)
+        session = None
+        if CheckoutSessionCache(facade=self).enabled:
+            # Only sessions in the cache can be reused, or have been created ahead of the page
+            speculative.wait(basket.id)
+            session = self.get_reusable_session(basket, params, claim=True)
+        basket.freeze()
+        # Whatever happened to the basket while it was open, its offers are applied afresh
+        FrozenBasketOfferCache().invalidate(basket.id)
+        if session is None:
+            key = self.get_session_idempotency_key(basket, params)
+            try:
+                session = self.request(stripe.checkout.Session, "create", idempotency_key=key, **params)
+            except stripe.error.StripeError:
+                # Don't leave the customer with a frozen, and so apparently empty, basket
+                basket.thaw()
+                raise
+            self.remember_session(basket, params, session, total)
         return session
 
+    def expire_session(self, session_id):
+        return self.request(
+            stripe.checkout.Session, "expire", session_id, idempotency_key=idempotency_key("expire", session_id))
+
+    def retrieve_session(self, session_id):
+        return self.request(stripe.checkout.Session, "retrieve", session_id)
+
     def retrieve_payment_intent(self, pi):
-        return stripe.PaymentIntent.retrieve(pi)
+        return self.request(stripe.PaymentIntent, "retrieve", pi)
 
-    def capture(self, order_number, **kwargs):
+    def create_product(self, name, metadata, idempotency_key=None):
+        return self.request(stripe.Product, "create", name=name, metadata=metadata, idempotency_key=idempotency_key)
+
+    def rename_product(self, product_id, name):
+        return self.request(
+            stripe.Product, "modify", product_id, name=name,
+            idempotency_key=idempotency_key("rename", product_id, hashlib.sha1(name.encode("utf-8")).hexdigest()))
+
+    def create_price(self, product_id, unit_amount, currency, idempotency_key=None):
+        return self.request(
+            stripe.Price, "create", product=product_id, unit_amount=unit_amount, currency=currency,
+            idempotency_key=idempotency_key)
+
+    def deactivate_price(self, price_id):
+        return self.request(
+            stripe.Price, "modify", price_id, active=False, idempotency_key=idempotency_key("deactivate", price_id))
+
+    def iter_payment_intent_pages(self, created, starting_after=None, page_size=100):
         """
-        if capture is set to false in charge, the charge will only be pre-authorized
-        one need to use capture to actually charge the customer
+        Page through the payment intents created in a window, newest first, e.g. ``created={"gte": start,
+        "lt": end}``.  Each page is fetched through ``request``, so it is retried and measured like any other
+        call, and the last id of a page can be saved and passed back as ``starting_after`` to resume.
         """
-        logger.info("Initiating payment capture for order '%s' via stripe" % (order_number))
+        while True:
+            params = {"created": created, "limit": page_size}
+            if starting_after:
+                params["starting_after"] = starting_after
+            page = self.request(stripe.PaymentIntent, "list", **params)
+            if not page.data:
+                return
+            yield page.data
+            if not page.has_more:
+                return
+            starting_after = page.data[-1].id
+
+    @staticmethod
+    def get_capture_params(pi, order_number, expand, attempt=0):
+        """
+        Capture by id, in one request.  Pass ``expand`` (e.g. ``["latest_charge"]``) to have anything else that
+        is needed from Stripe returned by the capture itself rather than fetched separately.  Stripe replays the
+        outcome of a request for its idempotency key, errors included, so a capture tried again after it
+        failed passes the number of the ``attempt`` to get a key of its own.
+        """
+        parts = ("capture", order_number or pi) + ((attempt,) if attempt else ())
+        params = {"idempotency_key": idempotency_key(*parts)}
+        if expand:
+            params["expand"] = list(expand)
+        return params
+
+    def capture_payment_intent(self, pi, order_number=None, expand=None, attempt=0):
+        return self.request(
+            stripe.PaymentIntent, "capture", pi, **self.get_capture_params(pi, order_number, expand, attempt))
+
+    @staticmethod
+    def get_payment_source(order_number):
+        """
+        Look up the order and its Stripe payment source for a capture.
+        """
+        Order = apps.get_model('order', 'Order')
+        Source = apps.get_model('payment', 'Source')
         try:
-            order = Order.objects.get(number=order_number)
-            payment_source = Source.objects.get(order=order)
-            # get charge_id from source
-            charge_id = payment_source.reference
-
-            stripe.PaymentIntent.modify(
-                charge_id,
-                receipt_email=order.user.email
-            )
-
-            stripe.PaymentIntent.capture(charge_id)
-            # set captured timestamp
-            payment_source.date_captured = timezone.now()
-            payment_source.save()
-            logger.info("payment for order '%s' (id:%s) was captured via stripe (stripe_ref:%s)" % (order.number, order.id, charge_id))
+            order = Order.objects.select_related('user').get(number=order_number)
+            return order, Source.objects.get(order=order)
         except Source.DoesNotExist as e:
             logger.exception('Source Error for order: \'{}\''.format(order_number) )
             raise Exception("Capture Failure could not find payment source for Order %s" % order_number)
         except Order.DoesNotExist as e:
             logger.exception('Order Error for order: \'{}\''.format(order_number) )
             raise Exception("Capture Failure Order %s does not exist" % order_number)
+
+    @staticmethod
+    def get_uncaptured_sources():
+        """
+        Stripe payment sources with an authorisation that hasn't been captured, i.e. less has been debited
+        than was allocated.
+        """
+        return apps.get_model('payment', 'Source').objects.filter(
+            source_type__name=PAYMENT_METHOD_STRIPE, amount_debited__lt=F('amount_allocated'))
+
+    @staticmethod
+    def mark_captured(order, payment_source):
+        # set captured timestamp
+        payment_source.date_captured = timezone.now()
+        if payment_source.amount_debited < payment_source.amount_allocated:
+            # Record the capture as Oscar does, as a debit of the outstanding amount (debit() saves)
+            payment_source.debit(
+                payment_source.amount_allocated - payment_source.amount_debited, reference=payment_source.reference)
+        else:
+            payment_source.save()
+        StripeCheckoutAttempt.update_payment_intent(
+            payment_source.reference, order=order, status=StripeCheckoutAttempt.CAPTURED)
+        logger.info("payment for order '%s' (id:%s) was captured via stripe (stripe_ref:%s)" % (order.number, order.id, payment_source.reference))
+
+    @staticmethod
+    def mark_cancelled(order, payment_source):
+        # Nothing is held against the card any more
+        payment_source.amount_allocated = payment_source.amount_debited
+        payment_source.save()
+        StripeCheckoutAttempt.update_payment_intent(
+            payment_source.reference, order=order, status=StripeCheckoutAttempt.CANCELLED)
+        logger.info("payment for order '%s' (id:%s) was cancelled via stripe (stripe_ref:%s)" % (order.number, order.id, payment_source.reference))
+
+    def capture_charge(self, charge_id, order_number=None, expand=None, attempt=0):
+        """
+        Capture an authorised payment intent at Stripe.  Doesn't touch the database.  The receipt email was
+        set when the Checkout Session was created.
+        """
+        return self.capture_payment_intent(charge_id, order_number, expand, attempt)
+
+    def cancel_charge(self, charge_id):
+        """
+        Release an uncaptured payment intent at Stripe.  Doesn't touch the database.
+        """
+        self.request(stripe.PaymentIntent, "cancel", charge_id, idempotency_key=idempotency_key("cancel", charge_id))
+
+    def capture(self, order_number, **kwargs):
+        """
+        if capture is set to false in charge, the charge will only be pre-authorized
+        one need to use capture to actually charge the customer
+        """
+        logger.info("Initiating payment capture for order '%s' via stripe" % (order_number))
+        order, payment_source = self.get_payment_source(order_number)
+        # get charge_id from source, and capture it with the account it was authorised with
+        self.for_payment_intent(payment_source.reference).capture_charge(payment_source.reference, order.number)
+        self.mark_captured(order, payment_source)
+
+
+class AsyncFacade(Facade):
+    """
+    Awaitable equivalents of the Facade operations, for views served under ASGI.  The Stripe requests are
+    built by the same code as Facade's, so both send identical payloads.  Where the installed stripe library
+    has native async support (the ``*_async`` methods) it is used; otherwise each request runs in a worker
+    thread.  Database work always runs through sync_to_async.
+    """
+    async def request(self, resource, method, *args, idempotency_key=None, **params):
+        native = getattr(resource, "{0}_async".format(method), None)
+        if native is None:
+            return await sync_to_async(super(AsyncFacade, self).request, thread_sensitive=False)(
+                resource, method, *args, idempotency_key=idempotency_key, **params)
+        operation, params, can_retry = self.prepare_request(resource, method, idempotency_key, params)
+        call = StripeCall(operation)
+        try:
+            trial = await sync_to_async(self.breaker.before_call)(operation)
+        except Exception as e:
+            await sync_to_async(call.finish)(e)
+            raise
+        try:
+            call.response = await self.policy.run_async(
+                operation, lambda: native(*args, **params), can_retry=can_retry, call=call)
+        except Exception as e:
+            await sync_to_async(self.breaker.after_call)(operation, trial, time.monotonic() - call.started, e)
+            await sync_to_async(call.finish)(e)
+            raise
+        await sync_to_async(self.breaker.after_call)(operation, trial, time.monotonic() - call.started)
+        await sync_to_async(call.finish)()
+        return call.response
+
+    async def begin(self, customer_email, basket, total, shipping_method):
+        params = await sync_to_async(self.get_session_params)(customer_email, basket, total, shipping_method)
+        session = None
+        if CheckoutSessionCache(facade=self).enabled:
+            await sync_to_async(speculative.wait, thread_sensitive=False)(basket.id)
+            session = await sync_to_async(self.get_reusable_session)(basket, params, claim=True)
+        await sync_to_async(basket.freeze)()
+        await sync_to_async(FrozenBasketOfferCache().invalidate)(basket.id)
+        if session is None:
+            key = await sync_to_async(self.get_session_idempotency_key)(basket, params)
+            try:
+                session = await self.request(stripe.checkout.Session, "create", idempotency_key=key, **params)
+            except stripe.error.StripeError:
+                await sync_to_async(basket.thaw)()
+                raise
+            await sync_to_async(self.remember_session)(basket, params, session, total)
+        return session
+
+    async def retrieve_session(self, session_id):
+        return await self.request(stripe.checkout.Session, "retrieve", session_id)
+
+    async def retrieve_payment_intent(self, pi):
+        return await self.request(stripe.PaymentIntent, "retrieve", pi)
+
+    async def capture_payment_intent(self, pi, order_number=None, expand=None, attempt=0):
+        return await self.request(
+            stripe.PaymentIntent, "capture", pi, **self.get_capture_params(pi, order_number, expand, attempt))
+
+    async def capture(self, order_number, **kwargs):
+        logger.info("Initiating payment capture for order '%s' via stripe" % (order_number))
+        order, payment_source = await sync_to_async(self.get_payment_source)(order_number)
+        facade = await sync_to_async(self.for_payment_intent)(payment_source.reference)
+        await facade.capture_payment_intent(payment_source.reference, order.number)
+        await sync_to_async(self.mark_captured)(order, payment_source)
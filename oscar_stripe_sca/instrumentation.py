@@ -0,0 +1,290 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from oscar_stripe_sca import breaker, signals
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SINKS = (
+    "oscar_stripe_sca.instrumentation.LoggingSink",
+    "oscar_stripe_sca.instrumentation.HistogramSink",
+)
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+SUCCESS = "success"
+ERROR = "error"
+# Not sent to Stripe because the circuit breaker is open
+REJECTED = "rejected"
+
+# How often a process re-checks that the counters it writes are listed in the shared registry
+REGISTRY_CHECK_INTERVAL = 60
+
+_lock = threading.Lock()
+_sinks = None
+
+
+class StripeCall(object):
+    """
+    The timing and outcome of one Stripe operation, retries included.
+    """
+    __slots__ = ('operation', 'started', 'duration', 'outcome', 'http_status', 'error', 'retries', 'response')
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.started = time.monotonic()
+        self.duration = None
+        self.outcome = None
+        self.http_status = None
+        self.error = None
+        self.retries = 0
+        self.response = None
+
+    def finish(self, error=None):
+        self.duration = time.monotonic() - self.started
+        if error is None:
+            self.outcome = SUCCESS
+            last_response = getattr(self.response, "last_response", None)
+            self.http_status = getattr(last_response, "code", None)
+        else:
+            self.outcome = REJECTED if isinstance(error, breaker.CircuitOpenError) else ERROR
+            self.http_status = getattr(error, "http_status", None)
+            self.error = error.__class__.__name__
+        emit(self)
+
+
+def get_sinks():
+    """
+    The process-wide sink instances named by STRIPE_INSTRUMENTATION_SINKS.
+    """
+    global _sinks
+    if _sinks is None:
+        with _lock:
+            if _sinks is None:
+                _sinks = [
+                    import_string(path)()
+                    for path in getattr(settings, "STRIPE_INSTRUMENTATION_SINKS", DEFAULT_SINKS)
+                ]
+    return _sinks
+
+
+def emit(call):
+    for sink in get_sinks():
+        try:
+            sink.record(call)
+        except Exception:
+            # Instrumentation mustn't break checkout
+            logger.exception("Instrumentation sink %s failed", sink.__class__.__name__)
+
+
+def count(event, value=1):
+    """
+    Count an event that isn't a Stripe call, e.g. a speculative Checkout Session being used, in the sinks that
+    keep counts.
+    """
+    for sink in get_sinks():
+        if not hasattr(sink, "count"):
+            continue
+        try:
+            sink.count(event, value)
+        except Exception:
+            logger.exception("Instrumentation sink %s failed", sink.__class__.__name__)
+
+
+@contextmanager
+def measure(operation):
+    """
+    Time the Stripe operation run in the block and pass the result to the sinks.  Set ``call.response`` to
+    the Stripe object returned, so that its HTTP status can be recorded.
+    """
+    call = StripeCall(operation)
+    try:
+        yield call
+    except Exception as e:
+        call.finish(e)
+        raise
+    call.finish()
+
+
+class LoggingSink(object):
+    def record(self, call):
+        level = logging.INFO if call.outcome == SUCCESS else logging.WARNING
+        logger.log(
+            level, "Stripe %s %s in %.3fs (status %s, %s retries%s)",
+            call.operation, call.outcome, call.duration, call.http_status, call.retries,
+            ", {0}".format(call.error) if call.error else "")
+
+    def count(self, event, value):
+        logger.debug("Stripe %s (%s)", event, value)
+
+
+class SignalSink(object):
+    def record(self, call):
+        signals.stripe_call_finished.send(sender=self.__class__, call=call)
+
+
+class HistogramSink(object):
+    """
+    Keeps a latency histogram per operation and outcome, plus error and retry counts, for the Prometheus
+    view.  The counters are held in memory unless STRIPE_METRICS_CACHE names a cache, in which case they're
+    kept there so that the view reports the calls made by every process sharing the cache.
+    """
+    key_prefix = "oscar_stripe_sca:metrics:"
+
+    def __init__(self, buckets=None, alias=None):
+        self.buckets = tuple(sorted(buckets or getattr(settings, "STRIPE_METRICS_BUCKETS", DEFAULT_BUCKETS)))
+        self.alias = alias or getattr(settings, "STRIPE_METRICS_CACHE", None)
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.registered = set()
+        self.registry_checked = time.monotonic()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get_increments(self, call):
+        series = (call.operation, call.outcome)
+        increments = [
+            (("bucket",) + series + (bisect.bisect_left(self.buckets, call.duration),), 1),
+            (("count",) + series, 1),
+            # Cache backends can only increment integers
+            (("sum_us",) + series, int(call.duration * 1000000)),
+        ]
+        if call.error:
+            increments.append((("errors", call.operation, call.error, str(call.http_status or "")), 1))
+        if call.retries:
+            increments.append((("retries", call.operation), call.retries))
+        return increments
+
+    def record(self, call):
+        self.increment(self.get_increments(call))
+
+    def count(self, event, value):
+        self.increment([(("events", event), value)])
+
+    def increment(self, increments):
+        if self.alias is None:
+            with self.lock:
+                for key, value in increments:
+                    self.counters[key] = self.counters.get(key, 0) + value
+            return
+        self.register([key for key, _ in increments])
+        for key, value in increments:
+            cache_key = self.get_cache_key(key)
+            try:
+                self.cache.incr(cache_key, value)
+            except ValueError:
+                if not self.cache.add(cache_key, value, None):
+                    self.cache.incr(cache_key, value)
+
+    def get_cache_key(self, key):
+        return "{0}{1}".format(self.key_prefix, "|".join(str(part) for part in key))
+
+    def register(self, keys):
+        """
+        Add counters to the shared list the view reads.  The list is updated without a lock, so an update can
+        be lost to a concurrent one; each process re-adds its counters every REGISTRY_CHECK_INTERVAL.
+        """
+        if time.monotonic() - self.registry_checked > REGISTRY_CHECK_INTERVAL:
+            self.registered = set()
+            self.registry_checked = time.monotonic()
+        new = [key for key in keys if key not in self.registered]
+        if not new:
+            return
+        registry_key = "{0}registry".format(self.key_prefix)
+        registry = self.cache.get(registry_key) or []
+        missing = [list(key) for key in new if list(key) not in registry]
+        if missing:
+            self.cache.set(registry_key, registry + missing, None)
+        self.registered.update(new)
+
+    def collect(self):
+        """
+        Return the counters as a dict of key tuple to value.
+        """
+        if self.alias is None:
+            with self.lock:
+                return dict(self.counters)
+        registry = self.cache.get("{0}registry".format(self.key_prefix)) or []
+        keys = [tuple(key) for key in registry]
+        values = self.cache.get_many([self.get_cache_key(key) for key in keys])
+        return dict((key, values.get(self.get_cache_key(key), 0)) for key in keys)
+
+
+def format_labels(**labels):
+    return "{{{0}}}".format(",".join(
+        '{0}="{1}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in labels.items()))
+
+
+def render_prometheus(counters, buckets):
+    """
+    Render HistogramSink counters in the Prometheus text exposition format.
+    """
+    histograms = {}
+    errors = []
+    retries = []
+    events = []
+    for key, value in counters.items():
+        if key[0] in ("bucket", "count", "sum_us"):
+            series = histograms.setdefault(key[1:3], {"buckets": [0] * (len(buckets) + 1), "count": 0, "sum": 0})
+            if key[0] == "bucket":
+                series["buckets"][int(key[3])] += value
+            elif key[0] == "count":
+                series["count"] = value
+            else:
+                series["sum"] = value / 1000000.0
+        elif key[0] == "errors":
+            errors.append((key[1:], value))
+        elif key[0] == "retries":
+            retries.append((key[1], value))
+        elif key[0] == "events":
+            events.append((key[1], value))
+
+    name = "oscar_stripe_sca_request_duration_seconds"
+    lines = [
+        "# HELP {0} Time taken by Stripe API operations, including retries.".format(name),
+        "# TYPE {0} histogram".format(name),
+    ]
+    for (operation, outcome), series in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(list(buckets) + ["+Inf"], series["buckets"]):
+            cumulative += count
+            lines.append("{0}_bucket{1} {2}".format(
+                name, format_labels(operation=operation, outcome=outcome, le=bound), cumulative))
+        labels = format_labels(operation=operation, outcome=outcome)
+        lines.append("{0}_sum{1} {2}".format(name, labels, series["sum"]))
+        lines.append("{0}_count{1} {2}".format(name, labels, series["count"]))
+
+    name = "oscar_stripe_sca_request_errors_total"
+    lines += [
+        "# HELP {0} Failed Stripe API operations by error class and HTTP status.".format(name),
+        "# TYPE {0} counter".format(name),
+    ]
+    for (operation, error, status), value in sorted(errors):
+        lines.append("{0}{1} {2}".format(name, format_labels(operation=operation, error=error, status=status), value))
+
+    name = "oscar_stripe_sca_request_retries_total"
+    lines += [
+        "# HELP {0} Retried Stripe API requests.".format(name),
+        "# TYPE {0} counter".format(name),
+    ]
+    for operation, value in sorted(retries):
+        lines.append("{0}{1} {2}".format(name, format_labels(operation=operation), value))
+
+    name = "oscar_stripe_sca_events_total"
+    lines += [
+        "# HELP {0} Checkout events other than Stripe calls.".format(name),
+        "# TYPE {0} counter".format(name),
+    ]
+    for event, value in sorted(events):
+        lines.append("{0}{1} {2}".format(name, format_labels(event=event), value))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,208 @@
+import logging
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.db.models import prefetch_related_objects
+
+from oscar_stripe_sca import COMPRESS_ADAPTIVE
+from oscar_stripe_sca.accounts import DEFAULT_ACCOUNT
+from oscar_stripe_sca.models import StripePrice
+from oscar_stripe_sca.money import AmountMismatchError, to_minor_units, to_minor_units_batch, validate_total
+
+
+logger = logging.getLogger(__name__)
+
+# Longest name given to a line summarizing several items in adaptive mode
+SUMMARY_NAME_LENGTH = 250
+
+
+def encoded_size(line_item, prefix="line_items[100]"):
+    """
+    About how many bytes a line item adds to the form-encoded Checkout Session request.
+    """
+    pairs = []
+    stack = [(prefix, line_item)]
+    while stack:
+        key, value = stack.pop()
+        if isinstance(value, dict):
+            stack.extend(("{0}[{1}]".format(key, name), item) for name, item in value.items())
+        else:
+            pairs.append((key, value))
+    return len(urlencode(pairs)) + 1
+
+
+class PaymentItem(object):
+    __slots__ = ('quantity', 'title', 'price_incl_tax', 'price_currency', 'stockrecord_id')
+
+    def __init__(self, quantity=None, title=None, price_incl_tax=None, price_currency=None, stockrecord_id=None):
+        self.quantity = quantity
+        self.title = title
+        self.price_incl_tax = price_incl_tax
+        self.price_currency = price_currency
+        self.stockrecord_id = stockrecord_id
+
+
+class LineItemBuilder(object):
+    """
+    Turns a basket into the line_items sent to Stripe.  Both versions of the Stripe API (the legacy line item
+    object and the Prices API) and the compressed single line are produced by the same pass over the basket.
+
+    With STRIPE_CATALOG_SYNC, lines whose stock record has been synced to a Stripe Price at the price being
+    charged refer to it by id; the others, including discounted lines, are described in full.
+
+    In adaptive mode (``compress="adaptive"``), as many lines as fit within ``max_items`` and ``max_size``
+    bytes are itemized and the rest are summarized in one last line, which makes the lines add up to the
+    total to the minor unit.
+    """
+    def __init__(self, use_prices_api=None, compress=None, account=DEFAULT_ACCOUNT, max_items=None, max_size=None):
+        self.use_prices_api = settings.STRIPE_USE_PRICES_API if use_prices_api is None else use_prices_api
+        compress = settings.STRIPE_COMPRESS_TO_ONE_LINE_ITEM if compress is None else compress
+        self.adaptive = compress == COMPRESS_ADAPTIVE
+        self.compress = bool(compress) and not self.adaptive
+        self.account = account
+        self.max_items = getattr(settings, "STRIPE_MAX_LINE_ITEMS", 100) if max_items is None else max_items
+        self.max_size = getattr(settings, "STRIPE_MAX_LINE_ITEMS_SIZE", 20000) if max_size is None else max_size
+
+    @property
+    def use_catalog(self):
+        return self.use_prices_api and not self.compress and getattr(settings, "STRIPE_CATALOG_SYNC", False)
+
+    def get_synced_prices(self, items):
+        """
+        The synced prices of the items' stock records, keyed by stock record id, loaded with one query.
+        """
+        stockrecord_ids = set(item.stockrecord_id for item in items if item.stockrecord_id is not None)
+        if not stockrecord_ids:
+            return {}
+        return dict(
+            (stockrecord_id, (price_id, unit_amount, currency.upper()))
+            for stockrecord_id, price_id, unit_amount, currency in StripePrice.objects.filter(
+                account=self.account, stockrecord_id__in=stockrecord_ids).values_list(
+                    'stockrecord_id', 'price_id', 'unit_amount', 'currency'))
+
+    def get_payment_items(self, basket, shipping_method):
+        lines = list(basket.all_lines())
+        # Load in bulk what would otherwise be queried line by line: the stockrecords the strategy picks
+        # prices from, and the parents that variants take their title and product class from
+        prefetch_related_objects(
+            lines, 'product__stockrecords', 'product__product_class', 'product__parent__product_class')
+
+        items = []
+        for line in lines:
+            title = line.product.get_title()
+            currency = line.price_currency
+            # this loop will split line into discounted and non-discounted lines
+            for price_incl_tax, _, quantity in line.get_price_breakdown():
+                items.append(PaymentItem(quantity, title, price_incl_tax, currency, line.stockrecord_id))
+
+        if shipping_method and basket.is_shipping_required():
+            price = shipping_method.calculate(basket)
+            items.append(PaymentItem(1, shipping_method.name, price.incl_tax, price.currency))
+        return items
+
+    def format_line_item(self, name, amount, currency, quantity):
+        if not self.use_prices_api:
+            return {
+                "name": name,
+                "amount": amount,
+                "currency": currency,
+                "quantity": quantity,
+            }
+        return {
+            "price_data": {
+                "product_data": {
+                    "name": name,
+                },
+                "currency": currency,
+                "unit_amount": amount,
+            },
+            "quantity": quantity,
+        }
+
+    def summarize(self, items):
+        return ", ".join(["{0}x{1}".format(item.quantity, item.title) for item in items])
+
+    def build(self, items, total):
+        if self.compress or (self.adaptive and set(item.price_currency for item in items) != {total.currency}):
+            # Stripe can't take lines in another currency than the total anyway
+            return [self.format_line_item(
+                self.summarize(items), to_minor_units(total.incl_tax, total.currency), total.currency, 1)]
+
+        currencies = set(item.price_currency for item in items)
+        if currencies == {total.currency}:
+            amounts = to_minor_units_batch([item.price_incl_tax for item in items], total.currency)
+            if not self.adaptive:
+                try:
+                    validate_total(amounts, [item.quantity for item in items], total.incl_tax, total.currency)
+                except AmountMismatchError as e:
+                    # Stripe will charge the sum of the lines, so this needs looking into, but it isn't the
+                    # customer's problem
+                    logger.warning("%s", e)
+        else:
+            amounts = [to_minor_units(item.price_incl_tax, item.price_currency) for item in items]
+
+        line_items = self.format_line_items(items, amounts)
+        if self.adaptive:
+            return self.fit(items, amounts, line_items, total)
+        return line_items
+
+    def format_line_items(self, items, amounts):
+        format_line_item = self.format_line_item
+        if not self.use_catalog:
+            return [
+                format_line_item(item.title, amount, item.price_currency, item.quantity)
+                for item, amount in zip(items, amounts)
+            ]
+
+        prices = self.get_synced_prices(items)
+        line_items = []
+        for item, amount in zip(items, amounts):
+            price = prices.get(item.stockrecord_id)
+            if price is not None and price[1:] == (amount, item.price_currency.upper()):
+                line_items.append({"price": price[0], "quantity": item.quantity})
+            else:
+                # Not synced yet, or charged at a different price, e.g. because of a discount
+                line_items.append(format_line_item(item.title, amount, item.price_currency, item.quantity))
+        return line_items
+
+    def fit(self, items, amounts, line_items, total):
+        """
+        Keep the longest run of leading line items that fits within the limits, and replace the others with
+        one line charging the rest of the total.  Only the lines that might be kept are measured, so the
+        cost doesn't grow with the size of the basket.
+        """
+        expected = to_minor_units(total.incl_tax, total.currency)
+        charged, size = 0, 0
+        # Each entry is the amount charged and the size of the first k line items
+        prefixes = [(0, 0)]
+        for item, amount, line_item in zip(items, amounts, line_items[:self.max_items]):
+            charged += amount * item.quantity
+            size += encoded_size(line_item)
+            prefixes.append((charged, size))
+        if len(line_items) <= self.max_items and size <= self.max_size and charged == expected:
+            return line_items
+
+        kept = min(len(line_items) - 1, self.max_items - 1)
+        while kept > 0 and prefixes[kept][0] > expected:
+            kept -= 1
+        while True:
+            summary = self.format_line_item(
+                self.get_summary_name(items[kept:]), expected - prefixes[kept][0], total.currency, 1)
+            if kept == 0 or prefixes[kept][1] + encoded_size(summary) <= self.max_size:
+                return line_items[:kept] + [summary]
+            kept -= 1
+
+    def get_summary_name(self, items):
+        """
+        The name of a line summarizing several items, cut short at SUMMARY_NAME_LENGTH characters.
+        """
+        names, length = [], 0
+        for item in items:
+            names.append("{0}x{1}".format(item.quantity, item.title))
+            length += len(names[-1]) + 2
+            if length > SUMMARY_NAME_LENGTH:
+                return ", ".join(names)[:SUMMARY_NAME_LENGTH - 1] + "\u2026"
+        return ", ".join(names)
+
+    def get_line_items(self, basket, total, shipping_method):
+        return self.build(self.get_payment_items(basket, shipping_method), total)
@@ -0,0 +1,104 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from oscar_stripe_sca.facade import Facade
+from oscar_stripe_sca.models import StripeCheckoutAttempt, StripeCheckpoint
+from oscar_stripe_sca.utils import run_concurrently
+
+
+class Command(BaseCommand):
+    help = (
+        "Capture (or cancel) the Stripe payments of placed orders whose authorisation hasn't been captured yet. "
+        "Stripe releases uncaptured authorisations after 7 days, so run this before then.  Progress is saved "
+        "after every batch and an interrupted run carries on where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--action', choices=('capture', 'cancel'), default='capture')
+        parser.add_argument(
+            '--min-age', type=float, default=0,
+            help="Only include orders placed at least this many hours ago")
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=8, help="Number of concurrent requests to Stripe")
+        parser.add_argument('--rate', type=float, default=20, help="Maximum payments handled per second (0 for no limit)")
+        parser.add_argument('--limit', type=int, default=None, help="Stop after this many payments")
+        parser.add_argument('--restart', action='store_true', help="Ignore the progress saved by an earlier run")
+        parser.add_argument('--dry-run', action='store_true', help="List the payments without touching them")
+
+    def handle(self, *args, **options):
+        facade = Facade()
+        # One facade per Stripe account; payments are made with the account their session was created with
+        facades = {}
+        accounts = {}
+
+        def get_facade(source):
+            name = accounts.get(source.reference)
+            if name not in facades:
+                facades[name] = Facade.for_account(name)
+            return facades[name]
+
+        action = options['action']
+        checkpoint = StripeCheckpoint.load("capture_authorizations:{0}".format(action))
+        if options['restart']:
+            checkpoint.advance("", succeeded=0, failed=0)
+        last_id = int(checkpoint.position or 0)
+        if last_id:
+            self.stdout.write("Resuming after payment source #{0}".format(last_id))
+
+        sources = facade.get_uncaptured_sources().select_related('order', 'order__user').order_by('id')
+        if options['min_age']:
+            sources = sources.filter(order__date_placed__lte=timezone.now() - timedelta(hours=options['min_age']))
+
+        if action == 'capture':
+            def call_stripe(source):
+                get_facade(source).capture_charge(source.reference, source.order.number)
+            mark = facade.mark_captured
+        else:
+            def call_stripe(source):
+                get_facade(source).cancel_charge(source.reference)
+            mark = facade.mark_cancelled
+
+        succeeded = failed = 0
+        remaining = options['limit']
+        start = time.monotonic()
+        while remaining is None or remaining > 0:
+            batch_size = options['batch_size'] if remaining is None else min(options['batch_size'], remaining)
+            batch = list(sources.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+
+            accounts = StripeCheckoutAttempt.get_accounts([source.reference for source in batch])
+
+            if options['dry_run']:
+                for source in batch:
+                    self.stdout.write("{0} order {1}: {2} {3}".format(
+                        source.reference, source.order.number, source.balance, source.currency))
+            else:
+                for source, _, error in run_concurrently(call_stripe, batch, options['workers'], options['rate']):
+                    if error is None:
+                        mark(source.order, source)
+                        succeeded += 1
+                    else:
+                        self.stderr.write("Unable to {0} {1} for order {2}: {3}".format(
+                            action, source.reference, source.order.number, error))
+                        failed += 1
+
+            last_id = batch[-1].id
+            if remaining is not None:
+                remaining -= len(batch)
+            if not options['dry_run']:
+                checkpoint.advance(last_id, succeeded=succeeded, failed=failed)
+                elapsed = time.monotonic() - start
+                self.stdout.write("{0} succeeded, {1} failed, {2:.1f} per second".format(
+                    succeeded, failed, (succeeded + failed) / elapsed if elapsed else 0))
+
+        if not options['dry_run'] and remaining is None:
+            # Finished; the next run starts from the beginning again to pick up anything that failed
+            checkpoint.advance("")
+        elapsed = time.monotonic() - start
+        done = {'capture': 'captured', 'cancel': 'cancelled'}[action]
+        self.stdout.write(self.style.SUCCESS("Done: {0} {1}, {2} failed in {3:.1f}s ({4:.1f} per second)".format(
+            succeeded, done, failed, elapsed, (succeeded + failed) / elapsed if elapsed else 0)))
@@ -0,0 +1,48 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from oscar_stripe_sca.abandoned import AbandonedBasketExpirer
+
+
+class Command(BaseCommand):
+    help = (
+        "Release the baskets frozen for a Stripe payment that was never completed, e.g. because the customer "
+        "closed the tab, and expire their Checkout Sessions.  Baskets whose session was paid are left alone."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--action', choices=('thaw', 'abandon'), default='thaw',
+                            help="Give the baskets back to their owners, or retire them")
+        parser.add_argument('--min-age', type=float, default=24,
+                            help="Only include baskets frozen at least this many hours ago")
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=8, help="Number of concurrent requests to Stripe")
+        parser.add_argument('--rate', type=float, default=20, help="Maximum sessions expired per second (0 for no limit)")
+        parser.add_argument('--limit', type=int, default=None, help="Stop after this many baskets")
+        parser.add_argument('--dry-run', action='store_true', help="Count the baskets without touching them")
+
+    def handle(self, *args, **options):
+        expirer = AbandonedBasketExpirer(
+            older_than=timedelta(hours=options['min_age']), action=options['action'],
+            workers=options['workers'], rate=options['rate'])
+        if options['dry_run']:
+            self.stdout.write("{0} abandoned baskets".format(expirer.get_baskets().count()))
+            return
+
+        totals = dict(baskets=0, sessions_expired=0, paid=0, failed=0)
+        start = time.monotonic()
+        for counts in expirer.run(options['batch_size'], options['limit']):
+            for key, value in counts.items():
+                totals[key] += value
+            elapsed = time.monotonic() - start
+            self.stdout.write("{0} baskets released, {1} sessions expired, {2:.1f} baskets per second".format(
+                totals['baskets'], totals['sessions_expired'], totals['baskets'] / elapsed if elapsed else 0))
+
+        done = {'thaw': 'thawed', 'abandon': 'abandoned'}[options['action']]
+        self.stdout.write(self.style.SUCCESS(
+            "Done: {0} baskets {1} and {2} sessions expired in {3:.1f}s; {4} left frozen as their session was "
+            "paid, {5} failed".format(
+                totals['baskets'], done, totals['sessions_expired'], time.monotonic() - start, totals['paid'],
+                totals['failed'])))
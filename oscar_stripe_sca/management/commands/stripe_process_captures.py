@@ -0,0 +1,49 @@
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from oscar_stripe_sca.capture import CaptureQueue
+from oscar_stripe_sca.models import StripeCheckoutAttempt
+
+
+class Command(BaseCommand):
+    help = (
+        "Capture the payments of orders placed with STRIPE_CAPTURE_MODE \"deferred\" that are due: those left to "
+        "this command by the QueueCaptureExecutor, those whose capture failed with a temporary error and is due "
+        "to be tried again, and those whose worker stopped before capturing them.  With --interval it keeps "
+        "polling for more."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=8, help="Number of concurrent requests to Stripe")
+        parser.add_argument('--rate', type=float, default=20, help="Maximum captures per second (0 for no limit)")
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help="Keep running, checking for due captures every this many seconds (default: run once)")
+
+    def handle(self, *args, **options):
+        queue = CaptureQueue()
+        totals = Counter()
+        start = time.monotonic()
+        while True:
+            results = queue.process(limit=options['batch_size'], workers=options['workers'], rate=options['rate'])
+            for attempt, status, error in results:
+                totals[status] += 1
+                if status == StripeCheckoutAttempt.CAPTURE_FAILED:
+                    self.stderr.write("Unable to capture {0} for order {1}: {2}".format(
+                        attempt.payment_intent_id, attempt.order.number, error))
+            if results:
+                elapsed = time.monotonic() - start
+                self.stdout.write("{0} captured, {1} retries scheduled, {2} failed, {3:.1f} per second".format(
+                    totals[StripeCheckoutAttempt.CAPTURED], totals[StripeCheckoutAttempt.AUTHORISED],
+                    totals[StripeCheckoutAttempt.CAPTURE_FAILED], sum(totals.values()) / elapsed if elapsed else 0))
+            elif not options['interval']:
+                break
+            else:
+                time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS("Done: {0} captured, {1} retries scheduled, {2} failed in {3:.1f}s".format(
+            totals[StripeCheckoutAttempt.CAPTURED], totals[StripeCheckoutAttempt.AUTHORISED],
+            totals[StripeCheckoutAttempt.CAPTURE_FAILED], time.monotonic() - start)))
@@ -0,0 +1,178 @@
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from oscar.core.loading import get_model
+
+from oscar_stripe_sca import PAYMENT_METHOD_STRIPE
+from oscar_stripe_sca.facade import Facade
+from oscar_stripe_sca.models import StripeCheckoutAttempt, StripeCheckpoint
+from oscar_stripe_sca.money import to_minor_units
+
+Order = get_model('order', 'Order')
+Source = get_model('payment', 'Source')
+
+MISSING_ORDER = "missing-order"
+AMOUNT_MISMATCH = "amount-mismatch"
+CAPTURE_NOT_RECORDED = "capture-not-recorded"
+CANCELLED_AT_STRIPE = "cancelled-at-stripe"
+UNCAPTURED = "uncaptured"
+KINDS = (MISSING_ORDER, AMOUNT_MISMATCH, CAPTURE_NOT_RECORDED, CANCELLED_AT_STRIPE, UNCAPTURED)
+
+# Intent statuses with money taken or held, which should have an order
+PAID_STATUSES = ("succeeded", "requires_capture")
+# Attempts whose authorisation can still be captured: paid or being paid, or with the capture queued
+AWAITING_CAPTURE = StripeCheckoutAttempt.PAYABLE_STATUSES + (StripeCheckoutAttempt.AUTHORISED,)
+
+
+class Command(BaseCommand):
+    help = (
+        "Check the Stripe payment intents created in a window against the orders' payment sources, and look for "
+        "payment sources of orders placed in it that were never captured.  Prints one tab-separated line per "
+        "discrepancy (kind, payment intent, order number, detail) and a summary.  Intents are read a page at a "
+        "time and matched in bulk, so memory use doesn't grow with the window; progress is saved after every "
+        "page and an interrupted run carries on where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help="Start of the window, as a date or datetime (default: 30 days ago)")
+        parser.add_argument('--until', help="End of the window, exclusive (default: now)")
+        parser.add_argument('--page-size', type=int, default=100, help="Payment intents per Stripe request (at most 100)")
+        parser.add_argument('--batch-size', type=int, default=500, help="Payment sources loaded per query")
+        parser.add_argument('--account', help="The Stripe account to check (default: the default account)")
+        parser.add_argument('--restart', action='store_true', help="Ignore the progress saved by an earlier run")
+
+    def parse_time(self, value, default):
+        if not value:
+            return default
+        parsed = parse_datetime(value)
+        if parsed is None:
+            date = parse_date(value)
+            if date is None:
+                raise CommandError("Not a date or datetime: {0}".format(value))
+            parsed = datetime(date.year, date.month, date.day)
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+
+    def handle(self, *args, **options):
+        facade = Facade.for_account(options['account'])
+        checkpoint = StripeCheckpoint.load("reconcile:{0}".format(facade.account.name))
+        if checkpoint.position and not options['restart'] and not (options['since'] or options['until']):
+            # Carry on with the window of the interrupted run
+            window = checkpoint.data['window']
+        else:
+            # Up to the end of the current second, so that intents created in it are included
+            until = self.parse_time(options['until'], timezone.now() + timedelta(seconds=1))
+            since = self.parse_time(options['since'], until - timedelta(days=30))
+            window = [int(since.timestamp()), int(until.timestamp())]
+        since, until = [datetime.fromtimestamp(bound, tz=dt_timezone.utc) for bound in window]
+
+        if options['restart'] or not checkpoint.position or checkpoint.data.get('window') != window:
+            if checkpoint.position and not options['restart']:
+                self.stdout.write("The saved progress is for a different window; starting over")
+            checkpoint.advance("intents:", window=window, intents=0, counts=dict((kind, 0) for kind in KINDS))
+        else:
+            self.stdout.write("Resuming from {0}".format(checkpoint.position))
+        self.counts = checkpoint.data['counts']
+        phase, __, cursor = checkpoint.position.partition(":")
+
+        start = time.monotonic()
+        if phase == "intents":
+            scanned = checkpoint.data['intents']
+            pages = facade.iter_payment_intent_pages(
+                {"gte": window[0], "lt": window[1]}, starting_after=cursor or None,
+                page_size=min(options['page_size'], 100))
+            for intents in pages:
+                for discrepancy in self.check_intents(intents):
+                    self.report(*discrepancy)
+                scanned += len(intents)
+                checkpoint.advance("intents:{0}".format(intents[-1].id), intents=scanned, counts=self.counts)
+                elapsed = time.monotonic() - start
+                # The report goes to stdout, so progress goes to stderr
+                self.stderr.write("{0} payment intents checked, {1:.1f} per second".format(
+                    scanned, scanned / elapsed if elapsed else 0))
+            cursor = ""
+            checkpoint.advance("sources:")
+
+        sources = Facade.get_uncaptured_sources().select_related('order').filter(
+            order__date_placed__gte=since, order__date_placed__lt=until).order_by('id')
+        last_id = int(cursor or 0)
+        while True:
+            batch = list(sources.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            for source in batch:
+                self.report(UNCAPTURED, source.reference, source.order.number, "{0} {1} authorised but not captured".format(
+                    source.amount_allocated - source.amount_debited, source.currency))
+            last_id = batch[-1].id
+            checkpoint.advance("sources:{0}".format(last_id), counts=self.counts)
+
+        # Finished; the next run starts from the beginning again
+        checkpoint.advance("", counts=self.counts)
+        summary = ", ".join("{0} {1}".format(self.counts[kind], kind) for kind in KINDS)
+        style = self.style.SUCCESS if not any(self.counts.values()) else self.style.WARNING
+        self.stdout.write(style("Done: {0} payment intents checked in {1:.1f}s; {2}".format(
+            checkpoint.data['intents'], time.monotonic() - start, summary)))
+
+    def report(self, kind, reference, order_number, detail):
+        self.counts[kind] += 1
+        self.stdout.write("\t".join((kind, reference, order_number or "-", detail)))
+
+    def load_page(self, intents):
+        """
+        The checkout attempt statuses and the Stripe payment sources for a page of intents, both keyed by payment
+        intent.  The attempts are found by their indexed payment intent, and the payment sources with one query
+        through the orders placed for the attempts, or from their baskets, which are indexed too.  Only paid
+        intents without an attempt, i.e. from before attempts were recorded, are looked up by the unindexed
+        payment source reference.
+        """
+        ids = [intent.id for intent in intents]
+        attempts = list(StripeCheckoutAttempt.objects.filter(payment_intent_id__in=ids).values_list(
+            'payment_intent_id', 'status', 'order_id', 'basket_id'))
+        order_ids = set(order_id for __, __, order_id, __ in attempts if order_id)
+        # Orders placed without going through the success view, e.g. from the checkout_session_completed signal
+        basket_ids = set(basket_id for __, __, order_id, basket_id in attempts if not order_id and basket_id)
+
+        stripe_sources = Source.objects.select_related('order').filter(source_type__name=PAYMENT_METHOD_STRIPE)
+        sources = {}
+        if order_ids or basket_ids:
+            for source in stripe_sources.filter(
+                    Q(order_id__in=order_ids) | Q(order__basket_id__in=basket_ids), reference__in=ids):
+                sources[source.reference] = source
+        statuses = dict((payment_intent_id, status) for payment_intent_id, status, __, __ in attempts)
+        legacy = [intent.id for intent in intents if intent.id not in statuses and intent.status in PAID_STATUSES]
+        if legacy:
+            for source in stripe_sources.filter(reference__in=legacy):
+                sources[source.reference] = source
+        return statuses, sources
+
+    def check_intents(self, intents):
+        """
+        Yield ``(kind, payment intent id, order number, detail)`` for each discrepancy in a page of intents.
+        """
+        statuses, sources = self.load_page(intents)
+        for intent in intents:
+            source = sources.get(intent.id)
+            if source is None:
+                if intent.status == "requires_capture" and statuses.get(intent.id) in AWAITING_CAPTURE:
+                    # Within the capture window: the customer may still place the order, or its capture is queued
+                    continue
+                if intent.status in PAID_STATUSES:
+                    yield MISSING_ORDER, intent.id, None, "{0}, {1} {2}".format(
+                        intent.status, intent.amount, intent.currency.upper())
+                continue
+            order_number = source.order.number
+            uncaptured = source.amount_debited < source.amount_allocated
+            charged = intent.amount_received if intent.status == "succeeded" else intent.amount
+            expected = to_minor_units(source.amount_allocated, source.currency)
+            if intent.currency.upper() != source.currency.upper() or (intent.status in PAID_STATUSES and charged != expected):
+                yield AMOUNT_MISMATCH, intent.id, order_number, "Stripe {0} {1}, order {2} {3} (minor units)".format(
+                    charged, intent.currency.upper(), expected, source.currency)
+            if intent.status == "succeeded" and uncaptured:
+                yield CAPTURE_NOT_RECORDED, intent.id, order_number, "captured at Stripe, not recorded on the order"
+            elif intent.status == "canceled" and uncaptured:
+                yield CANCELLED_AT_STRIPE, intent.id, order_number, "cancelled at Stripe, still authorised on the order"
@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from oscar_stripe_sca.catalog import CatalogSync
+from oscar_stripe_sca.facade import Facade
+from oscar_stripe_sca.models import StripeCheckpoint
+
+
+class Command(BaseCommand):
+    help = (
+        "Create Stripe Products and Prices for the stock records, so that Checkout Sessions can refer to them by "
+        "id when STRIPE_CATALOG_SYNC is on.  Only stock records and products changed since the last complete run "
+        "are synced, unless --full is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', help="The Stripe account to sync to (default: the default account)")
+        parser.add_argument('--full', action='store_true', help="Sync every stock record, not just the changed ones")
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=8, help="Number of concurrent requests to Stripe")
+        parser.add_argument('--rate', type=float, default=20, help="Maximum requests per second (0 for no limit)")
+
+    def handle(self, *args, **options):
+        sync = CatalogSync(Facade.for_account(options['account']), workers=options['workers'], rate=options['rate'])
+        checkpoint = StripeCheckpoint.load("catalog_sync:{0}".format(sync.account))
+        since = None if options['full'] or not checkpoint.position else parse_datetime(checkpoint.position)
+        started = timezone.now()
+
+        totals = dict(stockrecords=0, created=0, updated=0, failed=0)
+        start = time.monotonic()
+        for counts in sync.run(since, options['batch_size']):
+            for key, value in counts.items():
+                totals[key] += value
+            elapsed = time.monotonic() - start
+            self.stdout.write("{0} stock records checked, {1:.1f} per second".format(
+                totals['stockrecords'], totals['stockrecords'] / elapsed if elapsed else 0))
+
+        if not totals['failed']:
+            # Changes made while this run was going are picked up by the next one
+            checkpoint.advance(started.isoformat())
+        style = self.style.SUCCESS if not totals['failed'] else self.style.WARNING
+        self.stdout.write(style(
+            "Done: {0} stock records checked in {1:.1f}s; {2} prices created, {3} updated, {4} failed".format(
+                totals['stockrecords'], time.monotonic() - start, totals['created'], totals['updated'],
+                totals['failed'])))
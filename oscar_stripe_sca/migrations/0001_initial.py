@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, unique=True, verbose_name='Event ID')),
+                ('type', models.CharField(db_index=True, max_length=255, verbose_name='Type')),
+                ('date_received', models.DateTimeField(auto_now_add=True, verbose_name='Date received')),
+                ('date_processed', models.DateTimeField(blank=True, null=True, verbose_name='Date processed')),
+            ],
+            options={
+                'verbose_name': 'Stripe event',
+                'verbose_name_plural': 'Stripe events',
+            },
+        ),
+    ]
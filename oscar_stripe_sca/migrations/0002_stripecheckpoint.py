@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oscar_stripe_sca', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Name')),
+                ('position', models.CharField(blank=True, max_length=255, verbose_name='Position')),
+                ('data', models.JSONField(blank=True, default=dict, verbose_name='Data')),
+                ('date_updated', models.DateTimeField(auto_now=True, verbose_name='Date updated')),
+            ],
+            options={
+                'verbose_name': 'Stripe checkpoint',
+                'verbose_name_plural': 'Stripe checkpoints',
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0001_initial'),
+        ('basket', '0001_initial'),
+        ('oscar_stripe_sca', '0002_stripecheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeCheckoutAttempt',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.CharField(max_length=255, unique=True, verbose_name='Checkout Session ID')),
+                ('payment_intent_id', models.CharField(blank=True, db_index=True, max_length=255, verbose_name='Payment intent ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Amount')),
+                ('currency', models.CharField(max_length=12, verbose_name='Currency')),
+                ('status', models.CharField(choices=[('Open', 'Open - waiting for the customer to pay'), ('Complete', 'Complete - authorised at Stripe'), ('Captured', 'Captured'), ('Cancelled', 'Cancelled'), ('Expired', 'Expired')], default='Open', max_length=32, verbose_name='Status')),
+                ('date_created', models.DateTimeField(auto_now_add=True, verbose_name='Date created')),
+                ('date_updated', models.DateTimeField(auto_now=True, verbose_name='Date updated')),
+                ('basket', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stripe_checkout_attempts', to='basket.basket', verbose_name='Basket')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stripe_checkout_attempts', to='order.order', verbose_name='Order')),
+            ],
+            options={
+                'verbose_name': 'Stripe checkout attempt',
+                'verbose_name_plural': 'Stripe checkout attempts',
+                'get_latest_by': 'date_created',
+                'indexes': [models.Index(fields=['basket', 'status', 'date_created'], name='oscar_strip_basket__4ebaf5_idx')],
+            },
+        ),
+    ]
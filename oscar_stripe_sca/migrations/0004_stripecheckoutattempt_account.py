@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oscar_stripe_sca', '0003_stripecheckoutattempt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stripecheckoutattempt',
+            name='account',
+            field=models.CharField(default='default', max_length=255, verbose_name='Account'),
+        ),
+    ]
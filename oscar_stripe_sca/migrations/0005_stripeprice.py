@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partner', '0001_initial'),
+        ('oscar_stripe_sca', '0004_stripecheckoutattempt_account'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripePrice',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account', models.CharField(default='default', max_length=255, verbose_name='Account')),
+                ('product_id', models.CharField(max_length=255, verbose_name='Stripe product ID')),
+                ('price_id', models.CharField(max_length=255, verbose_name='Stripe price ID')),
+                ('unit_amount', models.BigIntegerField(verbose_name='Unit amount')),
+                ('currency', models.CharField(max_length=12, verbose_name='Currency')),
+                ('name', models.CharField(max_length=255, verbose_name='Name')),
+                ('date_synced', models.DateTimeField(auto_now=True, verbose_name='Date synced')),
+                ('stockrecord', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stripe_prices', to='partner.stockrecord', verbose_name='Stock record')),
+            ],
+            options={
+                'verbose_name': 'Stripe price',
+                'verbose_name_plural': 'Stripe prices',
+                'unique_together': {('account', 'stockrecord')},
+            },
+        ),
+    ]
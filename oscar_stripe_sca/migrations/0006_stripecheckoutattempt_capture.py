@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oscar_stripe_sca', '0005_stripeprice'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stripecheckoutattempt',
+            name='capture_attempts',
+            field=models.PositiveIntegerField(default=0, verbose_name='Capture attempts'),
+        ),
+        migrations.AddField(
+            model_name='stripecheckoutattempt',
+            name='capture_error',
+            field=models.TextField(blank=True, verbose_name='Capture error'),
+        ),
+        migrations.AddField(
+            model_name='stripecheckoutattempt',
+            name='date_capture_due',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Date capture due'),
+        ),
+        migrations.AlterField(
+            model_name='stripecheckoutattempt',
+            name='status',
+            field=models.CharField(choices=[('Open', 'Open - waiting for the customer to pay'), ('Complete', 'Complete - authorised at Stripe'), ('Authorised', 'Authorised - order placed, waiting to be captured'), ('Captured', 'Captured'), ('Capture failed', 'Capture failed'), ('Cancelled', 'Cancelled'), ('Expired', 'Expired')], default='Open', max_length=32, verbose_name='Status'),
+        ),
+        migrations.AddIndex(
+            model_name='stripecheckoutattempt',
+            index=models.Index(fields=['status', 'date_capture_due'], name='oscar_strip_status_7f7a44_idx'),
+        ),
+    ]
@@ -0,0 +1,172 @@
+from django.db import models
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+
+class StripeEvent(models.Model):
+    """
+    A webhook event received from Stripe.  The unique event id lets repeated deliveries of the same event be
+    recognised and skipped.
+    """
+    event_id = models.CharField(_("Event ID"), max_length=255, unique=True)
+    type = models.CharField(_("Type"), max_length=255, db_index=True)
+    date_received = models.DateTimeField(_("Date received"), auto_now_add=True)
+    date_processed = models.DateTimeField(_("Date processed"), null=True, blank=True)
+
+    class Meta:
+        verbose_name = _("Stripe event")
+        verbose_name_plural = _("Stripe events")
+
+    def __str__(self):
+        return "{0} ({1})".format(self.event_id, self.type)
+
+
+class StripeCheckoutAttempt(models.Model):
+    """
+    A Checkout Session created for a basket, and what became of it.  The views, the capture paths and the
+    webhook find attempts by basket, session or payment intent with a single indexed query, so none of this
+    has to be kept in the customer's session.
+    """
+    OPEN, COMPLETE, CAPTURED, CANCELLED, EXPIRED = ("Open", "Complete", "Captured", "Cancelled", "Expired")
+    AUTHORISED, CAPTURE_FAILED = ("Authorised", "Capture failed")
+    STATUS_CHOICES = (
+        (OPEN, _("Open - waiting for the customer to pay")),
+        (COMPLETE, _("Complete - authorised at Stripe")),
+        (AUTHORISED, _("Authorised - order placed, waiting to be captured")),
+        (CAPTURED, _("Captured")),
+        (CAPTURE_FAILED, _("Capture failed")),
+        (CANCELLED, _("Cancelled")),
+        (EXPIRED, _("Expired")),
+    )
+    # Attempts that can still turn into an order
+    PAYABLE_STATUSES = (OPEN, COMPLETE)
+    # Attempts whose session has been paid
+    PAID_STATUSES = (COMPLETE, AUTHORISED, CAPTURED, CAPTURE_FAILED)
+
+    basket = models.ForeignKey(
+        'basket.Basket', on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='stripe_checkout_attempts', verbose_name=_("Basket"))
+    order = models.ForeignKey(
+        'order.Order', on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='stripe_checkout_attempts', verbose_name=_("Order"))
+    # The name of the Stripe account the session was created with (see STRIPE_ACCOUNTS)
+    account = models.CharField(_("Account"), max_length=255, default="default")
+    session_id = models.CharField(_("Checkout Session ID"), max_length=255, unique=True)
+    # Empty until paid for sessions created with API versions from 2022-08-01
+    payment_intent_id = models.CharField(_("Payment intent ID"), max_length=255, blank=True, db_index=True)
+    amount = models.DecimalField(_("Amount"), decimal_places=2, max_digits=12)
+    currency = models.CharField(_("Currency"), max_length=12)
+    status = models.CharField(_("Status"), max_length=32, choices=STATUS_CHOICES, default=OPEN)
+    # The background capture of authorised attempts (see STRIPE_CAPTURE_MODE)
+    capture_attempts = models.PositiveIntegerField(_("Capture attempts"), default=0)
+    capture_error = models.TextField(_("Capture error"), blank=True)
+    date_capture_due = models.DateTimeField(_("Date capture due"), null=True, blank=True)
+    date_created = models.DateTimeField(_("Date created"), auto_now_add=True)
+    date_updated = models.DateTimeField(_("Date updated"), auto_now=True)
+
+    class Meta:
+        verbose_name = _("Stripe checkout attempt")
+        verbose_name_plural = _("Stripe checkout attempts")
+        get_latest_by = 'date_created'
+        indexes = [
+            models.Index(fields=['basket', 'status', 'date_created']),
+            models.Index(fields=['status', 'date_capture_due']),
+        ]
+
+    def __str__(self):
+        return "{0} for basket #{1} ({2})".format(self.session_id, self.basket_id, self.status)
+
+    @classmethod
+    def record(cls, basket, session, total, account="default"):
+        """
+        Record a newly created session.  A replayed create request returns a session that is already known.
+        """
+        return cls.objects.get_or_create(session_id=session.id, defaults={
+            'basket': basket,
+            'account': account,
+            'payment_intent_id': session.get("payment_intent") or "",
+            'amount': total.incl_tax,
+            'currency': total.currency,
+        })[0]
+
+    @classmethod
+    def get_accounts(cls, payment_intent_ids):
+        """
+        The account each of the payment intents was created with, for those that have an attempt.
+        """
+        return dict(cls.objects.filter(payment_intent_id__in=payment_intent_ids).values_list(
+            'payment_intent_id', 'account'))
+
+    @classmethod
+    def get_payable(cls, basket_id):
+        """
+        The basket's most recent attempt that hasn't been captured, cancelled or expired.
+        """
+        return cls.objects.filter(
+            basket_id=basket_id, status__in=cls.PAYABLE_STATUSES).order_by('-date_created').first()
+
+    @classmethod
+    def update_session(cls, session_id, statuses=None, **fields):
+        return cls.filter_statuses(cls.objects.filter(session_id=session_id), statuses).update(
+            date_updated=timezone.now(), **fields)
+
+    @classmethod
+    def update_payment_intent(cls, payment_intent_id, statuses=None, **fields):
+        return cls.filter_statuses(cls.objects.filter(payment_intent_id=payment_intent_id), statuses).update(
+            date_updated=timezone.now(), **fields)
+
+    @staticmethod
+    def filter_statuses(queryset, statuses):
+        return queryset if statuses is None else queryset.filter(status__in=statuses)
+
+
+class StripePrice(models.Model):
+    """
+    The Stripe Product and Price a stock record has been synced to by the stripe_sync_catalog command, so that
+    Checkout Sessions can refer to the price by id instead of describing the line in full.  Prices can't be
+    changed at Stripe, so a stock record whose price changes gets a new one.
+    """
+    account = models.CharField(_("Account"), max_length=255, default="default")
+    stockrecord = models.ForeignKey(
+        'partner.StockRecord', on_delete=models.CASCADE, related_name='stripe_prices', verbose_name=_("Stock record"))
+    product_id = models.CharField(_("Stripe product ID"), max_length=255)
+    price_id = models.CharField(_("Stripe price ID"), max_length=255)
+    # What the price was created for: the stock record's price including tax, in minor units
+    unit_amount = models.BigIntegerField(_("Unit amount"))
+    currency = models.CharField(_("Currency"), max_length=12)
+    name = models.CharField(_("Name"), max_length=255)
+    date_synced = models.DateTimeField(_("Date synced"), auto_now=True)
+
+    class Meta:
+        verbose_name = _("Stripe price")
+        verbose_name_plural = _("Stripe prices")
+        unique_together = ('account', 'stockrecord')
+
+    def __str__(self):
+        return "{0} for stock record #{1}".format(self.price_id, self.stockrecord_id)
+
+
+class StripeCheckpoint(models.Model):
+    """
+    Where a long-running management command got to, so that an interrupted run can carry on from there.
+    """
+    name = models.CharField(_("Name"), max_length=255, unique=True)
+    position = models.CharField(_("Position"), max_length=255, blank=True)
+    data = models.JSONField(_("Data"), default=dict, blank=True)
+    date_updated = models.DateTimeField(_("Date updated"), auto_now=True)
+
+    class Meta:
+        verbose_name = _("Stripe checkpoint")
+        verbose_name_plural = _("Stripe checkpoints")
+
+    def __str__(self):
+        return "{0}: {1}".format(self.name, self.position)
+
+    @classmethod
+    def load(cls, name):
+        return cls.objects.get_or_create(name=name)[0]
+
+    def advance(self, position, **data):
+        self.position = str(position)
+        self.data.update(data)
+        self.save()
@@ -0,0 +1,113 @@
+from decimal import Decimal as D, ROUND_HALF_UP
+
+
+# ISO 4217 minor units of the currencies Stripe doesn't treat as having two decimal places.
+# https://stripe.com/docs/currencies#zero-decimal
+ZERO_DECIMAL_CURRENCIES = (
+    'BIF',  # Burundian Franc
+    'CLP',  # Chilean Peso
+    'DJF',  # Djiboutian Franc
+    'GNF',  # Guinean Franc
+    'JPY',  # Japanese Yen
+    'KMF',  # Comorian Franc
+    'KRW',  # South Korean Won
+    'MGA',  # Malagasy Ariary
+    'PYG',  # Paraguayan Guaraní
+    'RWF',  # Rwandan Franc
+    'UGX',  # Ugandan Shilling
+    'VND',  # Vietnamese Đồng
+    'VUV',  # Vanuatu Vatu
+    'XAF',  # Central African Cfa Franc
+    'XOF',  # West African Cfa Franc
+    'XPF',  # Cfp Franc
+)
+
+# https://stripe.com/docs/currencies#three-decimal
+THREE_DECIMAL_CURRENCIES = (
+    'BHD',  # Bahraini Dinar
+    'IQD',  # Iraqi Dinar
+    'JOD',  # Jordanian Dinar
+    'KWD',  # Kuwaiti Dinar
+    'LYD',  # Libyan Dinar
+    'OMR',  # Omani Rial
+    'TND',  # Tunisian Dinar
+)
+
+MINOR_UNITS = dict(
+    [(currency, 0) for currency in ZERO_DECIMAL_CURRENCIES] +
+    [(currency, 3) for currency in THREE_DECIMAL_CURRENCIES]
+)
+DEFAULT_MINOR_UNITS = 2
+
+
+class AmountMismatchError(ValueError):
+    pass
+
+
+class MinorUnitConverter(object):
+    """
+    Converts amounts in one currency to the integer minor units Stripe expects.  The quantizer and
+    multiplier are worked out once per currency.  Stripe requires three-decimal amounts to be a multiple of
+    ten, so those are rounded to two places before scaling.
+    """
+    __slots__ = ('currency', 'minor_units', 'quantizer', 'multiplier')
+
+    def __init__(self, currency):
+        self.currency = currency
+        self.minor_units = MINOR_UNITS.get(currency, DEFAULT_MINOR_UNITS)
+        self.quantizer = D(1).scaleb(-min(self.minor_units, 2))
+        self.multiplier = 10 ** self.minor_units
+
+    def convert(self, amount):
+        if not isinstance(amount, D):
+            amount = D(str(amount))
+        return int(amount.quantize(self.quantizer, ROUND_HALF_UP) * self.multiplier)
+
+    def convert_all(self, amounts):
+        quantizer = self.quantizer
+        multiplier = self.multiplier
+        return [
+            int((amount if isinstance(amount, D) else D(str(amount))).quantize(quantizer, ROUND_HALF_UP) * multiplier)
+            for amount in amounts
+        ]
+
+
+_converters = {}
+
+
+def get_converter(currency):
+    converter = _converters.get(currency)
+    if converter is None:
+        converter = _converters.get(currency.upper())
+        if converter is None:
+            converter = MinorUnitConverter(currency.upper())
+            _converters[currency.upper()] = converter
+        _converters[currency] = converter
+    return converter
+
+
+def to_minor_units(amount, currency):
+    """
+    Convert an amount to minor units with proper rounding, e.g. cents for USD, yen for JPY and fils for KWD.
+    """
+    return get_converter(currency).convert(amount)
+
+
+def to_minor_units_batch(amounts, currency):
+    """
+    Convert a list of amounts in one currency to minor units in one call.
+    """
+    return get_converter(currency).convert_all(amounts)
+
+
+def validate_total(unit_amounts, quantities, total, currency):
+    """
+    Check that the converted line amounts add up to the total to the minor unit.  Raises
+    AmountMismatchError otherwise, as Stripe would charge the sum of the lines rather than the order total.
+    """
+    expected = to_minor_units(total, currency)
+    actual = sum(amount * quantity for amount, quantity in zip(unit_amounts, quantities))
+    if actual != expected:
+        raise AmountMismatchError(
+            "Line items add up to {0} {1} but the total is {2} {1}".format(actual, currency, expected))
+    return expected
@@ -0,0 +1,159 @@
+import io
+import logging
+import pickle
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import prefetch_related_objects
+from oscar.core.loading import get_model
+
+
+logger = logging.getLogger(__name__)
+
+Basket = get_model('basket', 'Basket')
+ConditionalOffer = get_model('offer', 'ConditionalOffer')
+Product = get_model('catalogue', 'Product')
+StockRecord = get_model('partner', 'StockRecord')
+Voucher = get_model('voucher', 'Voucher')
+
+
+class SnapshotPickler(pickle.Pickler):
+    """
+    Pickles a basket's lines and offer applications, leaving out the objects that must be current when the
+    snapshot is restored: the basket itself (and so its strategy and the request), the stock records,
+    offers and vouchers, whose counters are checked or saved when the order is placed, and the products,
+    which don't survive pickling.
+    """
+    models = (
+        ("product", Product), ("stockrecord", StockRecord), ("offer", ConditionalOffer), ("voucher", Voucher),
+    )
+
+    def __init__(self, *args, **kwargs):
+        super(SnapshotPickler, self).__init__(*args, **kwargs)
+        self.references = dict((name, set()) for name, model in self.models)
+
+    def persistent_id(self, obj):
+        if isinstance(obj, Basket):
+            return ("basket", None)
+        for name, model in self.models:
+            if isinstance(obj, model):
+                self.references[name].add(obj.pk)
+                return (name, obj.pk)
+        return None
+
+
+class SnapshotUnpickler(pickle.Unpickler):
+    def __init__(self, data, objects):
+        super(SnapshotUnpickler, self).__init__(io.BytesIO(data))
+        self.objects = objects
+
+    def persistent_load(self, pid):
+        name, pk = pid
+        return self.objects[name][pk]
+
+
+class FrozenBasketOfferCache(object):
+    """
+    Remembers the offers applied to each frozen basket, in any Django cache, so that the preview and place
+    order requests don't run the offer engine again for a basket that can't change.  Entries are keyed on a
+    revision of the basket that changes whenever it is frozen or thawed, so a basket that is thawed, edited
+    and frozen again is never given its old offers.
+    """
+    key_prefix = "oscar_stripe_sca:frozen_basket:"
+
+    def __init__(self, alias=None, ttl=None):
+        self.alias = alias or getattr(settings, "STRIPE_OFFER_CACHE", "default")
+        self.ttl = ttl if ttl is not None else getattr(settings, "STRIPE_OFFER_CACHE_TTL", 900)
+
+    @property
+    def enabled(self):
+        return bool(self.ttl)
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get_revision_key(self, basket_id):
+        return "{0}{1}:revision".format(self.key_prefix, basket_id)
+
+    def get_revision(self, basket_id):
+        """
+        Read before the offers are applied, so that a snapshot taken while the basket is thawed is stored
+        under a revision nothing will ask for.
+        """
+        if not self.enabled:
+            return None
+        return self.cache.get(self.get_revision_key(basket_id), "0")
+
+    def get_key(self, basket_id, revision, user):
+        return "{0}{1}:{2}:{3}".format(self.key_prefix, basket_id, revision, getattr(user, "pk", None) or "")
+
+    def invalidate(self, basket_id):
+        if self.enabled:
+            # Revisions are random, so one that expires and is recreated can't match an old entry
+            self.cache.set(self.get_revision_key(basket_id), uuid.uuid4().hex, self.ttl * 2)
+
+    def restore(self, basket, user, revision):
+        """
+        Give ``basket`` the lines and offer applications cached for it, and return whether there were any.
+        """
+        if revision is None:
+            return False
+        entry = self.cache.get(self.get_key(basket.id, revision, user))
+        if entry is None:
+            return False
+        if entry["snapshot"] is None:
+            # No offers applied, so there is nothing to restore
+            return True
+        references = entry["references"]
+        objects = {
+            "basket": {None: basket},
+            "product": Product.objects.in_bulk(references["product"]),
+            "stockrecord": StockRecord.objects.in_bulk(references["stockrecord"]),
+            "offer": (
+                ConditionalOffer.objects.select_related("condition", "benefit").in_bulk(references["offer"])
+                if references["offer"] else {}),
+            "voucher": Voucher.objects.in_bulk(references["voucher"]) if references["voucher"] else {},
+        }
+        try:
+            lines, offer_applications = SnapshotUnpickler(entry["snapshot"], objects).load()
+            for offer_id, voucher_id in entry["offer_vouchers"].items():
+                objects["offer"][offer_id].set_voucher(objects["voucher"][voucher_id])
+        except KeyError:
+            # A stock record, offer or voucher has been deleted since
+            return False
+        except Exception:
+            logger.warning("Unable to restore the offers of basket #%s", basket.id, exc_info=True)
+            return False
+        # As Basket.all_lines prefetches them
+        prefetch_related_objects(list(objects["product"].values()), "images")
+        for line in lines:
+            # Fetched again from the current strategy and stock records
+            line.__dict__.pop("_info", None)
+        basket._lines = lines
+        basket.offer_applications = offer_applications
+        return True
+
+    def store(self, basket, user, revision):
+        if revision is None:
+            return
+        key = self.get_key(basket.id, revision, user)
+        if not basket.offer_applications.applications:
+            self.cache.set(key, {"snapshot": None}, self.ttl)
+            return
+        snapshot = io.BytesIO()
+        pickler = SnapshotPickler(snapshot, pickle.HIGHEST_PROTOCOL)
+        try:
+            pickler.dump((basket.all_lines(), basket.offer_applications))
+        except (pickle.PicklingError, TypeError, AttributeError):
+            logger.warning("Unable to cache the offers of basket #%s", basket.id, exc_info=True)
+            return
+        self.cache.set(key, {
+            "snapshot": snapshot.getvalue(),
+            "references": dict((name, sorted(pks)) for name, pks in pickler.references.items()),
+            # Offers only know their voucher while it is set on the instance
+            "offer_vouchers": dict(
+                (offer_id, offer.get_voucher().pk)
+                for offer_id, offer in basket.offer_applications.offers.items() if offer.get_voucher()),
+        }, self.ttl)
@@ -0,0 +1,75 @@
+"""
+Makes sure an order is only placed once for a basket when the success view is posted to more than once at a
+time, e.g. after a double click, a retry from a flaky mobile network or a re-posted form.  The first request
+takes a short lock on the basket; the others wait for it to finish and are given its outcome instead of
+placing the order again.
+
+The lock lives in a Django cache, so it only covers the processes sharing that cache: use a shared backend
+such as Redis or Memcached, rather than the per-process local memory cache, when running several workers.
+"""
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class OrderPlacementLock(object):
+    """
+    A lock on placing the order for a basket, held for at most ``ttl`` seconds so that a request that dies
+    doesn't keep the basket locked.  The outcome of placing the order is kept for as long, for the duplicate
+    requests that come in meanwhile or soon after.
+    """
+    key_prefix = "oscar_stripe_sca:place_order:"
+    poll_interval = 0.05
+
+    def __init__(self, alias=None, ttl=None):
+        self.alias = alias or getattr(settings, "STRIPE_ORDER_LOCK_CACHE", "default")
+        self.ttl = ttl if ttl is not None else getattr(settings, "STRIPE_ORDER_LOCK_TTL", 60)
+
+    @property
+    def enabled(self):
+        return bool(self.ttl)
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get_key(self, basket_id, name):
+        return "{0}{1}:{2}".format(self.key_prefix, basket_id, name)
+
+    def acquire(self, basket_id):
+        """
+        Take the lock, and return a token to release it with, or None if another request holds it.
+        """
+        token = uuid.uuid4().hex
+        if self.cache.add(self.get_key(basket_id, "lock"), token, self.ttl):
+            return token
+        return None
+
+    def release(self, basket_id, token, result=None):
+        """
+        Release the lock, first recording ``result`` for the requests waiting on it.
+        """
+        if result is not None:
+            self.cache.set(self.get_key(basket_id, "result"), result, self.ttl)
+        # Unless it has expired and been taken by another request meanwhile
+        if self.cache.get(self.get_key(basket_id, "lock")) == token:
+            self.cache.delete(self.get_key(basket_id, "lock"))
+
+    def get_result(self, basket_id):
+        return self.cache.get(self.get_key(basket_id, "result"))
+
+    def wait(self, basket_id, timeout):
+        """
+        Wait up to ``timeout`` seconds for the request holding the lock to finish, and return its result.
+        Returns None if it finished without one, or is still going.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            result = self.get_result(basket_id)
+            if result is not None or self.cache.get(self.get_key(basket_id, "lock")) is None:
+                return result
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import random
+import time
+
+from django.conf import settings
+
+from oscar_stripe_sca.utils import stripe
+
+
+logger = logging.getLogger(__name__)
+
+# The total time, in seconds, each operation may take including retries
+DEFAULT_TIMEOUTS = {
+    "checkout.session.create": 20,
+    "checkout.session.expire": 10,
+    "payment_intent.retrieve": 10,
+    "payment_intent.modify": 10,
+    "payment_intent.capture": 30,
+    "payment_intent.cancel": 20,
+}
+DEFAULT_TIMEOUT = 20
+
+# Don't start an attempt with less time than this left
+MIN_ATTEMPT_TIMEOUT = 1
+
+
+def idempotency_key(*parts):
+    """
+    Build an idempotency key from the things that identify an operation, e.g. the order number, so that
+    retrying it can never act twice.
+    """
+    return ":".join(["oscar-stripe-sca"] + [str(part) for part in parts])[:255]
+
+
+def is_retryable(error):
+    """
+    Network failures, rate limiting and Stripe's own server errors are worth another try; anything else
+    (a declined card, invalid parameters, bad credentials) will fail the same way again.
+    """
+    if isinstance(error, (stripe.error.APIConnectionError, stripe.error.RateLimitError)):
+        return True
+    if not isinstance(error, stripe.error.StripeError):
+        return False
+    # The SDK raises these as APIErrors, with the code only on the error object
+    if error.http_status == 409:
+        return getattr(error.error, "code", None) == "lock_timeout"
+    if isinstance(error, stripe.error.APIError):
+        return error.http_status is None or error.http_status >= 500
+    return False
+
+
+class CallPolicy(object):
+    """
+    Runs a Stripe request within its operation's time budget, retrying retryable errors with exponential
+    backoff and full jitter.  Each attempt's timeout is whatever is left of the budget, so an operation never
+    takes much longer than its budget however many attempts it needs.
+    """
+    def __init__(self, timeouts=None, max_retries=None, backoff=None, max_backoff=None):
+        self.timeouts = dict(DEFAULT_TIMEOUTS, **getattr(settings, "STRIPE_OPERATION_TIMEOUTS", {}))
+        self.timeouts.update(timeouts or {})
+        self.max_retries = max_retries if max_retries is not None else getattr(settings, "STRIPE_MAX_RETRIES", 2)
+        self.backoff = backoff if backoff is not None else getattr(settings, "STRIPE_RETRY_BACKOFF", 0.5)
+        self.max_backoff = max_backoff if max_backoff is not None else getattr(settings, "STRIPE_RETRY_MAX_BACKOFF", 4)
+
+    def get_timeout(self, operation):
+        return self.timeouts.get(operation, DEFAULT_TIMEOUT)
+
+    def get_delay(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def should_retry(self, operation, error, attempt, deadline, delay, can_retry):
+        if not can_retry or attempt >= self.max_retries or not is_retryable(error):
+            return False
+        if deadline - time.monotonic() - delay < MIN_ATTEMPT_TIMEOUT:
+            return False
+        logger.warning("Retrying Stripe %s after %s (attempt %s)", operation, error.__class__.__name__, attempt + 1)
+        return True
+
+    def run(self, operation, func, http_client=None, can_retry=True, call=None):
+        """
+        Call ``func()``.  ``can_retry`` must be False for requests that change something at Stripe without
+        an idempotency key.  Retries are counted on ``call``, an instrumentation.StripeCall, if given.
+        """
+        deadline = time.monotonic() + self.get_timeout(operation)
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                if http_client is not None:
+                    with http_client.timeout(remaining):
+                        return func()
+                return func()
+            except stripe.error.StripeError as e:
+                delay = self.get_delay(attempt)
+                if not self.should_retry(operation, e, attempt, deadline, delay, can_retry):
+                    raise
+            time.sleep(delay)
+            attempt += 1
+            if call is not None:
+                call.retries = attempt
+
+    async def run_async(self, operation, func, can_retry=True, call=None):
+        """
+        Await ``func()``, the asyncio equivalent of run.
+        """
+        deadline = time.monotonic() + self.get_timeout(operation)
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                return await asyncio.wait_for(func(), remaining)
+            except asyncio.TimeoutError:
+                raise stripe.error.APIConnectionError(
+                    "Stripe {0} didn't finish within {1}s".format(operation, self.get_timeout(operation)))
+            except stripe.error.StripeError as e:
+                delay = self.get_delay(attempt)
+                if not self.should_retry(operation, e, attempt, deadline, delay, can_retry):
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1
+            if call is not None:
+                call.retries = attempt
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from oscar_stripe_sca.instrumentation import count
+from oscar_stripe_sca.models import StripeCheckoutAttempt
+from oscar_stripe_sca.utils import stripe
+
+
+logger = logging.getLogger(__name__)
+
+# Don't hand out a session that is about to expire at Stripe's end
+EXPIRY_MARGIN = 300
+# Stripe keeps idempotency keys for at least 24 hours, so the generations have to outlive them
+GENERATION_TIMEOUT = 2 * 24 * 60 * 60
+
+
+def session_fingerprint(params):
+    """
+    Hash the parameters a Checkout Session would be created with.  These cover the basket lines and their
+    prices, the vouchers, the shipping charge, the currency and the customer email, so two baskets with the
+    same fingerprint would produce identical sessions.
+    """
+    payload = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CheckoutSessionCache(object):
+    """
+    Remembers the Checkout Session created for each basket, in any Django cache, so that reloading the
+    payment details page doesn't create a new session every time.
+    """
+    key_prefix = "oscar_stripe_sca:checkout_session:"
+
+    def __init__(self, alias=None, ttl=None, facade=None):
+        self._facade = facade
+        self.alias = alias or getattr(settings, "STRIPE_SESSION_CACHE", "default")
+        self.ttl = ttl if ttl is not None else getattr(settings, "STRIPE_SESSION_REUSE_TTL", 3600)
+
+    @property
+    def enabled(self):
+        return bool(self.ttl)
+
+    @property
+    def facade(self):
+        if self._facade is None:
+            from oscar_stripe_sca.facade import Facade
+            self._facade = Facade()
+        return self._facade
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get_key(self, basket_id):
+        return "{0}{1}".format(self.key_prefix, basket_id)
+
+    def get(self, basket_id, fingerprint, claim=False):
+        """
+        Return the cached session for the basket if it is still open and was created from the same
+        fingerprint.  A session whose fingerprint no longer matches is expired at Stripe and forgotten.
+        ``claim`` marks a speculatively created session as used by the payment details page.
+        """
+        entry = self.cache.get(self.get_key(basket_id))
+        if entry is None:
+            return None
+        if entry["fingerprint"] != fingerprint:
+            logger.info("Basket #%s changed since Stripe session %s was created - expiring it",
+                        basket_id, entry["session"]["id"])
+            if entry.get("speculative"):
+                count("speculative_session.discarded")
+            self.expire(entry["session"]["id"])
+            self.delete(basket_id)
+            return None
+        if entry["expires_at"] - EXPIRY_MARGIN <= time.time():
+            if entry.get("speculative"):
+                count("speculative_session.discarded")
+            self.delete(basket_id)
+            return None
+        if claim and entry.get("speculative"):
+            count("speculative_session.used")
+            entry["speculative"] = False
+            self.cache.set(self.get_key(basket_id), entry, self.get_timeout(entry["expires_at"]))
+        logger.info("Reusing Stripe session %s for basket #%s", entry["session"]["id"], basket_id)
+        return stripe.checkout.Session.construct_from(entry["session"], self.facade.client.api_key)
+
+    def get_timeout(self, expires_at):
+        return max(min(self.ttl, int(expires_at - time.time()) - EXPIRY_MARGIN), 1)
+
+    def set(self, basket_id, fingerprint, session, speculative=False):
+        expires_at = session.get("expires_at") or time.time() + self.ttl
+        entry = {
+            "fingerprint": fingerprint,
+            "expires_at": expires_at,
+            # Created ahead of the payment details page, and not used by it yet
+            "speculative": speculative,
+            "session": {
+                "id": session.id,
+                "object": session.get("object", "checkout.session"),
+                "payment_intent": session.get("payment_intent"),
+                "url": session.get("url"),
+                "client_secret": session.get("client_secret"),
+                "expires_at": session.get("expires_at"),
+            },
+        }
+        self.cache.set(self.get_key(basket_id), entry, self.get_timeout(expires_at))
+
+    def get_generation_key(self, basket_id):
+        return "{0}{1}:generation".format(self.key_prefix, basket_id)
+
+    def get_generation(self, basket_id):
+        """
+        How many sessions have been given up on for this basket.  Part of the idempotency key for creating
+        sessions, so a basket that goes back to earlier contents doesn't get its expired session replayed.
+        """
+        return self.cache.get(self.get_generation_key(basket_id), 0)
+
+    def delete(self, basket_id):
+        self.cache.delete(self.get_key(basket_id))
+        self.cache.set(self.get_generation_key(basket_id), self.get_generation(basket_id) + 1, GENERATION_TIMEOUT)
+
+    def expire(self, session_id):
+        try:
+            self.facade.expire_session(session_id)
+        except stripe.error.StripeError:
+            # The session may already have completed or expired; either way it can't be reused
+            logger.warning("Unable to expire Stripe session %s", session_id, exc_info=True)
+            return
+        StripeCheckoutAttempt.update_session(session_id, status=StripeCheckoutAttempt.EXPIRED)
@@ -1,11 +1,55 @@
 from django.conf import settings
 from django.urls import reverse_lazy
+from django.utils.text import format_lazy
 
 STRIPE_SEND_RECEIPT = getattr(settings, "STRIPE_SEND_RECEIPT", True)
 STRIPE_PUBLISHABLE_KEY = getattr(settings, "STRIPE_PUBLISHABLE_KEY", None)
 STRIPE_SECRET_KEY = getattr(settings, "STRIPE_SECRET_KEY", None)
+STRIPE_WEBHOOK_SECRET = getattr(settings, "STRIPE_WEBHOOK_SECRET", None)
+STRIPE_ACCOUNTS = getattr(settings, "STRIPE_ACCOUNTS", {})
+STRIPE_ACCOUNT_RESOLVER = getattr(settings, "STRIPE_ACCOUNT_RESOLVER", "oscar_stripe_sca.accounts.AccountResolver")
+STRIPE_API_VERSION = getattr(settings, "STRIPE_API_VERSION", "2020-03-02")
+STRIPE_API_BASE = getattr(settings, "STRIPE_API_BASE", None)
+STRIPE_HTTP_POOL_SIZE = getattr(settings, "STRIPE_HTTP_POOL_SIZE", 10)
+STRIPE_CONNECT_TIMEOUT = getattr(settings, "STRIPE_CONNECT_TIMEOUT", 10)
+STRIPE_READ_TIMEOUT = getattr(settings, "STRIPE_READ_TIMEOUT", 80)
+STRIPE_OPERATION_TIMEOUTS = getattr(settings, "STRIPE_OPERATION_TIMEOUTS", {})
+STRIPE_MAX_RETRIES = getattr(settings, "STRIPE_MAX_RETRIES", 2)
+STRIPE_RETRY_BACKOFF = getattr(settings, "STRIPE_RETRY_BACKOFF", 0.5)
+STRIPE_RETRY_MAX_BACKOFF = getattr(settings, "STRIPE_RETRY_MAX_BACKOFF", 4)
+STRIPE_BREAKER_FAILURE_THRESHOLD = getattr(settings, "STRIPE_BREAKER_FAILURE_THRESHOLD", 5)
+STRIPE_BREAKER_WINDOW = getattr(settings, "STRIPE_BREAKER_WINDOW", 60)
+STRIPE_BREAKER_RECOVERY_TIMEOUT = getattr(settings, "STRIPE_BREAKER_RECOVERY_TIMEOUT", 30)
+STRIPE_BREAKER_SLOW_CALL = getattr(settings, "STRIPE_BREAKER_SLOW_CALL", 10)
+STRIPE_BREAKER_CACHE = getattr(settings, "STRIPE_BREAKER_CACHE", "default")
+STRIPE_INSTRUMENTATION_SINKS = getattr(settings, "STRIPE_INSTRUMENTATION_SINKS", (
+    "oscar_stripe_sca.instrumentation.LoggingSink",
+    "oscar_stripe_sca.instrumentation.HistogramSink",
+))
+STRIPE_METRICS_CACHE = getattr(settings, "STRIPE_METRICS_CACHE", None)
+STRIPE_METRICS_BUCKETS = getattr(settings, "STRIPE_METRICS_BUCKETS", (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+STRIPE_METRICS_TOKEN = getattr(settings, "STRIPE_METRICS_TOKEN", None)
 STRIPE_COMPRESS_TO_ONE_LINE_ITEM = getattr(settings, "STRIPE_COMPRESS_TO_ONE_LINE_ITEM", True)
+STRIPE_MAX_LINE_ITEMS = getattr(settings, "STRIPE_MAX_LINE_ITEMS", 100)
+STRIPE_MAX_LINE_ITEMS_SIZE = getattr(settings, "STRIPE_MAX_LINE_ITEMS_SIZE", 20000)
 STRIPE_USE_PRICES_API = getattr(settings, "STRIPE_USE_PRICES_API", True)
+STRIPE_CATALOG_SYNC = getattr(settings, "STRIPE_CATALOG_SYNC", False)
+STRIPE_CHECKOUT_MODE = getattr(settings, "STRIPE_CHECKOUT_MODE", "template")
+STRIPE_CAPTURE_MODE = getattr(settings, "STRIPE_CAPTURE_MODE", "immediate")
+STRIPE_CAPTURE_EXECUTOR = getattr(settings, "STRIPE_CAPTURE_EXECUTOR", "oscar_stripe_sca.capture.ThreadPoolCaptureExecutor")
+STRIPE_CAPTURE_WORKERS = getattr(settings, "STRIPE_CAPTURE_WORKERS", 4)
+STRIPE_CAPTURE_MAX_ATTEMPTS = getattr(settings, "STRIPE_CAPTURE_MAX_ATTEMPTS", 5)
+STRIPE_CAPTURE_RETRY_DELAY = getattr(settings, "STRIPE_CAPTURE_RETRY_DELAY", 60)
+STRIPE_SESSION_REUSE_TTL = getattr(settings, "STRIPE_SESSION_REUSE_TTL", 3600)
+STRIPE_SESSION_CACHE = getattr(settings, "STRIPE_SESSION_CACHE", "default")
+STRIPE_SPECULATIVE_SESSIONS = getattr(settings, "STRIPE_SPECULATIVE_SESSIONS", False)
+STRIPE_SPECULATIVE_WORKERS = getattr(settings, "STRIPE_SPECULATIVE_WORKERS", 4)
+STRIPE_OFFER_CACHE_TTL = getattr(settings, "STRIPE_OFFER_CACHE_TTL", 900)
+STRIPE_OFFER_CACHE = getattr(settings, "STRIPE_OFFER_CACHE", "default")
+STRIPE_ORDER_LOCK_TTL = getattr(settings, "STRIPE_ORDER_LOCK_TTL", 60)
+STRIPE_ORDER_LOCK_WAIT = getattr(settings, "STRIPE_ORDER_LOCK_WAIT", 30)
+STRIPE_ORDER_LOCK_CACHE = getattr(settings, "STRIPE_ORDER_LOCK_CACHE", "default")
 STRIPE_RETURN_URL_BASE = getattr(settings, "STRIPE_RETURN_URL_BASE", "http://localhost/")
-STRIPE_PAYMENT_SUCCESS_URL = getattr(settings, "STRIPE_PAYMENT_SUCCESS_URL", "{0}{1}".format(settings.STRIPE_RETURN_URL_BASE, reverse_lazy("checkout:stripe-preview")))
-STRIPE_PAYMENT_CANCEL_URL = getattr(settings, "STRIPE_PAYMENT_CANCEL_URL", "{0}{1}".format(settings.STRIPE_RETURN_URL_BASE, reverse_lazy("checkout:stripe-cancel")))
\ No newline at end of file
+# Lazy, so that reading these settings doesn't load the URLconf
+STRIPE_PAYMENT_SUCCESS_URL = getattr(settings, "STRIPE_PAYMENT_SUCCESS_URL", format_lazy("{0}{1}", settings.STRIPE_RETURN_URL_BASE, reverse_lazy("checkout:stripe-preview")))
+STRIPE_PAYMENT_CANCEL_URL = getattr(settings, "STRIPE_PAYMENT_CANCEL_URL", format_lazy("{0}{1}", settings.STRIPE_RETURN_URL_BASE, reverse_lazy("checkout:stripe-cancel")))
\ No newline at end of file
@@ -0,0 +1,13 @@
+from django.dispatch import Signal
+
+# Sent when a customer completes a Checkout Session.  Arguments: session, basket_id
+checkout_session_completed = Signal()
+
+# Sent for every payment_intent.* webhook event.  Arguments: event_type, payment_intent
+payment_intent_updated = Signal()
+
+# Sent when the circuit breaker around Stripe calls changes state.  Arguments: name, old_state, new_state
+circuit_breaker_state_changed = Signal()
+
+# Sent after every Stripe API operation when instrumentation.SignalSink is enabled.  Arguments: call
+stripe_call_finished = Signal()
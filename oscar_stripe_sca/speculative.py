@@ -0,0 +1,77 @@
+"""
+Creates Checkout Sessions in the background before the customer reaches the payment details page.  A
+process-wide pool of threads makes the Stripe requests; the payment details page waits for one that is still
+in flight for its basket rather than racing it.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.RLock()
+_executor = None
+_pending = {}
+
+
+def is_enabled():
+    return getattr(settings, "STRIPE_SPECULATIVE_SESSIONS", False)
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, "STRIPE_SPECULATIVE_WORKERS", 4),
+                    thread_name_prefix="stripe-speculative")
+    return _executor
+
+
+def run(basket_id, func, args):
+    try:
+        return func(*args)
+    except Exception:
+        # Nothing is lost: the payment details page creates the session itself
+        logger.warning("Unable to create a Stripe session ahead of time for basket #%s", basket_id, exc_info=True)
+    finally:
+        # Any connections opened by the cache or the sinks belong to this worker thread
+        connections.close_all()
+
+
+def submit(basket_id, func, *args):
+    """
+    Run ``func(*args)`` in the background, unless a session is already being created for the basket.
+    """
+    with _lock:
+        future = _pending.get(basket_id)
+        if future is not None and not future.done():
+            return future
+        future = get_executor().submit(run, basket_id, func, args)
+        _pending[basket_id] = future
+        future.add_done_callback(lambda done: forget(basket_id, done))
+    return future
+
+
+def forget(basket_id, future):
+    with _lock:
+        if _pending.get(basket_id) is future:
+            del _pending[basket_id]
+
+
+def wait(basket_id, timeout=None):
+    """
+    Wait for a session being created for the basket in this process, so that it can be used.
+    """
+    with _lock:
+        future = _pending.get(basket_id)
+    if future is not None:
+        try:
+            future.result(timeout)
+        except Exception:
+            pass
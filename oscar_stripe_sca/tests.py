@@ -1,5 +1,1332 @@
-from django.test import TestCase
+"""
+Run from the repository root with the benchmark settings, which use an in-memory SQLite database:
 
+    DJANGO_SETTINGS_MODULE=benchmarks.settings python -m django test oscar_stripe_sca
 
-class StripeSCATestCase(TestCase):
-    pass
+Stripe is replaced by the in-memory stand-in in ``benchmarks.stub``.
+"""
+import asyncio
+import io
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal as D
+from unittest import mock
+
+import requests
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connections
+from django.test import AsyncClient, Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import path, reverse
+from django.utils import timezone
+from oscar.apps.basket.models import Basket
+from oscar.apps.offer.applicator import Applicator
+from oscar.apps.order.models import Order
+from oscar.apps.payment.models import Source, SourceType
+from oscar.apps.shipping.methods import Free
+from oscar.core.prices import Price
+from oscar.test.factories import CountryFactory, UserFactory, create_offer, create_order
+
+from benchmarks.loadtest import SESSION_ID
+from benchmarks.stub import FakeStripe, StripeError, install
+from benchmarks.urls import urlpatterns as benchmark_urlpatterns
+from benchmarks.utils import make_basket, reload_basket, start_checkout
+from oscar_stripe_sca import CHECKOUT_MODE_REDIRECT, COMPRESS_ADAPTIVE, PAYMENT_METHOD_STRIPE, breaker, signals
+from oscar_stripe_sca.abandoned import AbandonedBasketExpirer
+from oscar_stripe_sca.breaker import CircuitBreaker
+from oscar_stripe_sca.capture import CaptureQueue
+from oscar_stripe_sca.catalog import CatalogSync
+from oscar_stripe_sca.facade import Facade
+from oscar_stripe_sca.line_items import SUMMARY_NAME_LENGTH, LineItemBuilder, PaymentItem, encoded_size
+from oscar_stripe_sca.management.commands.stripe_reconcile import Command as ReconcileCommand
+from oscar_stripe_sca.models import StripeCheckoutAttempt, StripeCheckpoint, StripeEvent, StripePrice
+from oscar_stripe_sca.money import AmountMismatchError, to_minor_units, to_minor_units_batch, validate_total
+from oscar_stripe_sca.offer_cache import FrozenBasketOfferCache
+from oscar_stripe_sca.order_lock import OrderPlacementLock
+from oscar_stripe_sca.policy import MIN_ATTEMPT_TIMEOUT, CallPolicy
+from oscar_stripe_sca.session_cache import CheckoutSessionCache
+from oscar_stripe_sca.utils import stripe
+from oscar_stripe_sca.views import AsyncStripeSCAPaymentDetailsView, AsyncStripeSCASuccessResponseView
+from oscar_stripe_sca.webhooks import WebhookHandler
+
+
+# The benchmark site, with the async versions of the payment details and success views
+urlpatterns = [
+    path('checkout/payment-details-stripe/', AsyncStripeSCAPaymentDetailsView.as_view()),
+    path('checkout/preview-stripe/<int:basket_id>/', AsyncStripeSCASuccessResponseView.as_view(preview=True)),
+] + benchmark_urlpatterns
+
+
+class StripeStubMixin(object):
+    """
+    Routes the Stripe requests to a fresh FakeStripe, keeping the events it would send webhooks for.
+    """
+    def setUp(self):
+        # The circuit breaker and the session, offer and lock caches
+        cache.clear()
+        self.events = []
+        self.fake_stripe = FakeStripe(on_event=self.events.append)
+        self.transport = install(stripe=self.fake_stripe)
+        self.country = CountryFactory(iso_3166_1_a2="GB", printable_name="United Kingdom")
+        self.user = UserFactory()
+
+    def start_checkout(self, lines=3):
+        """
+        Freeze a basket of ``lines`` lines at the payment details page, and return the client and the basket.
+        """
+        basket = make_basket(lines, owner=self.user)
+        client = start_checkout(self.user, self.country)
+        response = client.get(reverse("checkout:stripe-payment-details"))
+        self.assertEqual(response.status_code, 200)
+        self.session_id = SESSION_ID.search(response.content.decode()).group("id")
+        return client, basket
+
+    def pay(self, client, basket):
+        """
+        Pay for the basket at Stripe and look at the preview page, and return the URL to place the order at.
+        """
+        self.fake_stripe.complete_session(self.session_id)
+        url = reverse("checkout:stripe-preview", args=[basket.id])
+        self.assertEqual(client.get(url).status_code, 200)
+        return url
+
+    @contextmanager
+    def assertStripeRequests(self, expected):
+        requests = self.transport.requests
+        yield
+        self.assertEqual(self.transport.requests - requests, expected, "Unexpected number of Stripe requests")
+
+    def send_webhooks(self, event_type=None):
+        handler = WebhookHandler()
+        for event in self.events:
+            if event_type is None or event["type"] == event_type:
+                handler.process(stripe.Event.construct_from(event, "sk_test_benchmarks"))
+
+
+class StripeSCATestCase(StripeStubMixin, TestCase):
+    def send_webhooks(self, event_type=None):
+        # The handlers leave their Stripe requests until the event has been committed
+        with self.captureOnCommitCallbacks(execute=True):
+            super(StripeSCATestCase, self).send_webhooks(event_type)
+
+
+class AbandonedBasketExpirerTests(StripeSCATestCase):
+    def age(self, basket):
+        old = timezone.now() - timedelta(days=2)
+        Basket.objects.filter(pk=basket.pk).update(date_created=old)
+        StripeCheckoutAttempt.objects.filter(basket=basket).update(date_created=old)
+
+    def test_releases_basket_with_open_session(self):
+        __, basket = self.start_checkout()
+        self.age(basket)
+
+        counts = AbandonedBasketExpirer().expire_batch([basket.id])
+
+        self.assertEqual(counts['baskets'], 1)
+        self.assertEqual(counts['sessions_expired'], 1)
+        self.assertEqual(Basket.objects.get(pk=basket.pk).status, Basket.OPEN)
+        self.assertEqual(self.fake_stripe.sessions[self.session_id]["status"], "expired")
+
+    def test_keeps_basket_paid_at_stripe(self):
+        __, basket = self.start_checkout()
+        self.fake_stripe.complete_session(self.session_id)
+        self.age(basket)
+
+        counts = AbandonedBasketExpirer().expire_batch([basket.id])
+
+        self.assertEqual(counts['paid'], 1)
+        self.assertEqual(Basket.objects.get(pk=basket.pk).status, Basket.FROZEN)
+
+    def test_keeps_basket_whose_payment_webhook_ran_first(self):
+        # The webhook has recorded the payment before the expirer gets to the basket
+        __, basket = self.start_checkout()
+        self.fake_stripe.complete_session(self.session_id)
+        self.send_webhooks("checkout.session.completed")
+        self.assertEqual(
+            StripeCheckoutAttempt.objects.get(session_id=self.session_id).status, StripeCheckoutAttempt.COMPLETE)
+        self.age(basket)
+
+        expirer = AbandonedBasketExpirer()
+        self.assertEqual(list(expirer.get_baskets().values_list('id', flat=True)), [basket.id])
+        counts = expirer.expire_batch([basket.id])
+
+        self.assertEqual(counts, {'baskets': 0, 'sessions_expired': 0, 'paid': 1, 'failed': 0})
+        self.assertEqual(Basket.objects.get(pk=basket.pk).status, Basket.FROZEN)
+        self.assertEqual(
+            self.fake_stripe.payment_intents[self.fake_stripe.sessions[self.session_id]["payment_intent"]]["status"],
+            "requires_capture")
+
+    def test_selects_baskets_by_their_latest_session(self):
+        __, stale = self.start_checkout()
+        self.age(stale)
+        # Created long ago, but its latest session is recent
+        __, recent = self.start_checkout()
+        self.age(recent)
+        StripeCheckoutAttempt.objects.create(
+            basket=recent, session_id="cs_test_recent", amount=D('10.00'), currency="GBP")
+        # Frozen without ever being sent to Stripe
+        other = make_basket(1)
+        other.freeze()
+        Basket.objects.filter(pk=other.pk).update(date_created=timezone.now() - timedelta(days=2))
+
+        self.assertEqual(list(AbandonedBasketExpirer().get_baskets().values_list('id', flat=True)), [stale.id])
+
+
+class StripeRequestTests(StripeSCATestCase):
+    """
+    The number of Stripe requests each step of the checkout makes.  Each one is a round trip the customer
+    waits for, so a change that adds one should fail here.
+    """
+    def get_total(self, basket):
+        return Price(basket.currency, basket.total_excl_tax, incl_tax=basket.total_incl_tax)
+
+    def test_begin_creates_session_in_one_request(self):
+        basket = make_basket(3)
+        with self.assertStripeRequests(1):
+            Facade().begin(self.user.email, reload_basket(basket), self.get_total(basket), Free())
+
+    def test_begin_reuses_session_without_requests(self):
+        basket = make_basket(3)
+        Facade().begin(self.user.email, reload_basket(basket), self.get_total(basket), Free())
+        with self.assertStripeRequests(0):
+            Facade().begin(self.user.email, reload_basket(basket), self.get_total(basket), Free())
+
+    def test_capture_in_one_request(self):
+        order = create_order(basket=make_basket(3), user=self.user)
+        intent = self.fake_stripe.create_payment_intent(
+            int(order.total_incl_tax * 100), "gbp", status="requires_capture")
+        source = Source.objects.create(
+            order=order, source_type=SourceType.objects.create(name=PAYMENT_METHOD_STRIPE), currency=order.currency,
+            amount_allocated=order.total_incl_tax, amount_debited=D('0.00'), reference=intent["id"])
+
+        with self.assertStripeRequests(1):
+            Facade().capture(order.number)
+
+        self.assertEqual(self.fake_stripe.payment_intents[intent["id"]]["status"], "succeeded")
+        self.assertEqual(Source.objects.get(pk=source.pk).amount_debited, order.total_incl_tax)
+
+    def test_payment_details_in_one_request(self):
+        basket = make_basket(3, owner=self.user)
+        client = start_checkout(self.user, self.country)
+        with self.assertStripeRequests(1):
+            self.assertEqual(client.get(reverse("checkout:stripe-payment-details")).status_code, 200)
+        self.assertEqual(Basket.objects.get(pk=basket.pk).status, Basket.FROZEN)
+
+    @override_settings(STRIPE_SESSION_REUSE_TTL=0)
+    def test_begin_without_session_reuse_skips_the_session_cache(self):
+        basket = make_basket(3)
+        with mock.patch("oscar_stripe_sca.facade.speculative.wait") as wait, \
+                mock.patch.object(CheckoutSessionCache, "get") as get, self.assertStripeRequests(1):
+            Facade().begin(self.user.email, reload_basket(basket), self.get_total(basket), Free())
+        wait.assert_not_called()
+        get.assert_not_called()
+
+    @override_settings(STRIPE_CHECKOUT_MODE=CHECKOUT_MODE_REDIRECT, STRIPE_SESSION_REUSE_TTL=0)
+    def test_payment_details_mounts_a_session_without_url_in_one_request(self):
+        basket = make_basket(3, owner=self.user)
+        client = start_checkout(self.user, self.country)
+        create_session = self.fake_stripe.create_session
+
+        def create_session_without_url(*args, **kwargs):
+            session = create_session(*args, **kwargs)
+            session.update(url=None, client_secret="{0}_secret".format(session["id"]))
+            return session
+
+        with mock.patch.object(self.fake_stripe, "create_session", create_session_without_url), \
+                self.assertStripeRequests(1):
+            response = client.get(reverse("checkout:stripe-payment-details"))
+
+        self.assertEqual(response.status_code, 200)
+        attempt = StripeCheckoutAttempt.objects.get(basket=basket)
+        self.assertIn("{0}_secret".format(attempt.session_id), response.content.decode())
+
+    @override_settings(STRIPE_CHECKOUT_MODE=CHECKOUT_MODE_REDIRECT)
+    def test_payment_details_redirects_in_one_request(self):
+        make_basket(3, owner=self.user)
+        client = start_checkout(self.user, self.country)
+        with self.assertStripeRequests(1):
+            response = client.get(reverse("checkout:stripe-payment-details"))
+        self.assertEqual(response.status_code, 303)
+        self.assertTrue(response["Location"].startswith("https://checkout.stripe.com/"))
+
+    def test_preview_without_requests(self):
+        client, basket = self.start_checkout()
+        self.fake_stripe.complete_session(self.session_id)
+        with self.assertStripeRequests(0):
+            self.assertEqual(client.get(reverse("checkout:stripe-preview", args=[basket.id])).status_code, 200)
+
+    def test_place_order_in_one_request(self):
+        client, basket = self.start_checkout()
+        url = self.pay(client, basket)
+
+        with self.assertStripeRequests(1):
+            response = client.post(url)
+
+        self.assertRedirects(response, reverse("checkout:thank-you"), fetch_redirect_response=False)
+        order = Order.objects.get(basket_id=basket.id)
+        self.assertEqual(order.sources.get().amount_debited, order.total_incl_tax)
+
+    @override_settings(
+        STRIPE_CAPTURE_MODE="deferred", STRIPE_CAPTURE_EXECUTOR="oscar_stripe_sca.capture.QueueCaptureExecutor")
+    def test_place_order_deferred_without_requests(self):
+        client, basket = self.start_checkout()
+        url = self.pay(client, basket)
+        # The webhook has recorded the authorisation, so Stripe needn't be asked
+        self.send_webhooks("checkout.session.completed")
+
+        with self.assertStripeRequests(0):
+            client.post(url)
+
+        order = Order.objects.get(basket_id=basket.id)
+        self.assertEqual(order.sources.get().amount_debited, D('0.00'))
+        with self.assertStripeRequests(1):
+            [(__, status, error)] = CaptureQueue().process()
+        self.assertEqual((status, error), (StripeCheckoutAttempt.CAPTURED, None))
+        self.assertEqual(order.sources.get().amount_debited, order.total_incl_tax)
+
+    @override_settings(
+        STRIPE_CAPTURE_MODE="deferred", STRIPE_CAPTURE_EXECUTOR="oscar_stripe_sca.capture.QueueCaptureExecutor")
+    def test_place_order_deferred_before_webhook_in_one_request(self):
+        client, basket = self.start_checkout()
+        url = self.pay(client, basket)
+
+        # The payment intent is retrieved to check the authorisation
+        with self.assertStripeRequests(1):
+            client.post(url)
+        self.assertTrue(Order.objects.filter(basket_id=basket.id).exists())
+
+
+@override_settings(
+    STRIPE_CAPTURE_MODE="deferred", STRIPE_CAPTURE_EXECUTOR="oscar_stripe_sca.capture.QueueCaptureExecutor",
+    STRIPE_MAX_RETRIES=0)
+class DeferredCaptureTests(StripeSCATestCase):
+    def get_intent(self):
+        return self.fake_stripe.payment_intents[self.fake_stripe.sessions[self.session_id]["payment_intent"]]
+
+    def place_order(self, account=None):
+        client, basket = self.start_checkout()
+        if account is not None:
+            # As if STRIPE_ACCOUNT_RESOLVER had picked it
+            StripeCheckoutAttempt.objects.filter(session_id=self.session_id).update(account=account)
+        url = self.pay(client, basket)
+        self.send_webhooks("checkout.session.completed")
+        self.assertRedirects(client.post(url), reverse("checkout:thank-you"), fetch_redirect_response=False)
+        return StripeCheckoutAttempt.objects.get(session_id=self.session_id)
+
+    def fail_captures(self, status=500, code=None, error_type="api_error"):
+        return mock.patch.object(
+            self.fake_stripe, "capture_payment_intent",
+            side_effect=StripeError(status, "Capture failed", code=code, error_type=error_type))
+
+    def get_capture_keys(self):
+        return [key for path, key in self.fake_stripe.idempotent_responses if path.endswith("/capture")]
+
+    def record_capture_api_keys(self, api_keys):
+        send = self.transport.send
+
+        def record(request, **kwargs):
+            if request.url.endswith("/capture"):
+                api_keys.append(request.headers["Authorization"])
+            return send(request, **kwargs)
+
+        return mock.patch.object(self.transport, "send", record)
+
+    @override_settings(STRIPE_ACCOUNTS={"eu": {"SECRET_KEY": "sk_test_eu"}})
+    def test_queue_captures_with_the_attempts_account(self):
+        self.place_order(account="eu")
+        api_keys = []
+
+        with self.record_capture_api_keys(api_keys):
+            [(__, status, error)] = CaptureQueue().process()
+
+        self.assertEqual((status, error), (StripeCheckoutAttempt.CAPTURED, None))
+        self.assertEqual(api_keys, ["Bearer sk_test_eu"])
+
+    @override_settings(STRIPE_ACCOUNTS={"eu": {"SECRET_KEY": "sk_test_eu"}})
+    def test_webhook_captures_with_the_attempts_account(self):
+        # Delivered to the default account's endpoint, e.g. by a Connect webhook
+        attempt = self.place_order(account="eu")
+        api_keys = []
+
+        with self.record_capture_api_keys(api_keys):
+            self.send_webhooks("payment_intent.amount_capturable_updated")
+
+        self.assertEqual(api_keys, ["Bearer sk_test_eu"])
+        self.assertEqual(self.get_intent()["status"], "succeeded")
+        self.assertEqual(attempt.order.sources.get().amount_debited, attempt.order.total_incl_tax)
+
+    def test_webhook_captures_once_the_event_is_recorded(self):
+        attempt = self.place_order()
+        capture_payment_intent = self.fake_stripe.capture_payment_intent
+        processed = []
+
+        def capture(*args, **kwargs):
+            processed.extend(StripeEvent.objects.filter(
+                type="payment_intent.amount_capturable_updated").values_list('date_processed', flat=True))
+            return capture_payment_intent(*args, **kwargs)
+
+        with mock.patch.object(self.fake_stripe, "capture_payment_intent", capture):
+            self.send_webhooks("payment_intent.amount_capturable_updated")
+
+        self.assertEqual(len(processed), 1)
+        self.assertIsNotNone(processed[0])
+        self.assertEqual(self.get_intent()["status"], "succeeded")
+        self.assertEqual(
+            StripeCheckoutAttempt.objects.get(pk=attempt.pk).status, StripeCheckoutAttempt.CAPTURED)
+
+    def test_failed_webhook_capture_is_left_to_the_queue(self):
+        attempt = self.place_order()
+
+        with self.fail_captures():
+            self.send_webhooks("payment_intent.amount_capturable_updated")
+
+        self.assertIsNotNone(StripeEvent.objects.get(type="payment_intent.amount_capturable_updated").date_processed)
+        self.assertEqual(list(CaptureQueue().get_due()), [attempt])
+
+    def test_unpaid_session_is_refused(self):
+        client, basket = self.start_checkout()
+        url = reverse("checkout:stripe-preview", args=[basket.id])
+
+        response = client.post(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("hasn&#x27;t been authorised", response.content.decode())
+        self.assertFalse(Order.objects.filter(basket_id=basket.id).exists())
+        self.assertEqual(self.get_intent()["status"], "requires_payment_method")
+
+    def test_authorisation_short_of_the_total_is_refused(self):
+        client, basket = self.start_checkout()
+        url = self.pay(client, basket)
+        self.get_intent()["amount_capturable"] -= 1
+
+        client.post(url)
+
+        self.assertFalse(Order.objects.filter(basket_id=basket.id).exists())
+
+    def test_order_is_placed_authorised(self):
+        attempt = self.place_order()
+
+        self.assertEqual(attempt.status, StripeCheckoutAttempt.AUTHORISED)
+        self.assertEqual(attempt.order.sources.get().amount_debited, D('0.00'))
+        self.assertEqual(self.get_intent()["status"], "requires_capture")
+
+    def test_claimed_attempts_are_leased(self):
+        attempt = self.place_order()
+        queue = CaptureQueue(lease=300)
+
+        self.assertEqual(queue.claim(), [attempt])
+        # Another worker doesn't get it while the lease lasts
+        self.assertEqual(queue.claim(), [])
+        StripeCheckoutAttempt.objects.filter(pk=attempt.pk).update(
+            date_capture_due=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(queue.claim(), [attempt])
+
+    def test_temporary_failure_is_retried_later(self):
+        attempt = self.place_order()
+        queue = CaptureQueue(retry_delay=60)
+
+        with self.fail_captures():
+            [(__, status, error)] = queue.process()
+
+        self.assertEqual(status, StripeCheckoutAttempt.AUTHORISED)
+        attempt.refresh_from_db()
+        self.assertEqual(attempt.capture_attempts, 1)
+        self.assertGreater(attempt.date_capture_due, timezone.now() + timedelta(seconds=55))
+        self.assertEqual(queue.process(), [])
+
+        StripeCheckoutAttempt.objects.filter(pk=attempt.pk).update(date_capture_due=timezone.now())
+        [(__, status, error)] = queue.process()
+
+        self.assertEqual((status, error), (StripeCheckoutAttempt.CAPTURED, None))
+        self.assertEqual(self.get_intent()["status"], "succeeded")
+        # Each try has its own idempotency key, so the retry isn't answered with the first one's error
+        self.assertEqual(len(set(self.get_capture_keys())), 2)
+
+    def test_gives_up_after_max_attempts(self):
+        attempt = self.place_order()
+        queue = CaptureQueue(max_attempts=2, retry_delay=0)
+
+        with self.fail_captures():
+            self.assertEqual(queue.process()[0][1], StripeCheckoutAttempt.AUTHORISED)
+            self.assertEqual(queue.process()[0][1], StripeCheckoutAttempt.CAPTURE_FAILED)
+
+        attempt.refresh_from_db()
+        self.assertEqual((attempt.status, attempt.capture_attempts), (StripeCheckoutAttempt.CAPTURE_FAILED, 2))
+        self.assertIsNone(attempt.date_capture_due)
+        self.assertEqual(queue.process(), [])
+
+    def test_permanent_failure_is_not_retried(self):
+        attempt = self.place_order()
+
+        with self.fail_captures(402, code="card_declined", error_type="card_error"):
+            [(__, status, error)] = CaptureQueue().process()
+
+        self.assertEqual(status, StripeCheckoutAttempt.CAPTURE_FAILED)
+        attempt.refresh_from_db()
+        self.assertEqual(attempt.capture_attempts, 1)
+
+    def test_repeated_capture_is_idempotent(self):
+        # A worker captured the payment but died before recording it
+        attempt = self.place_order()
+        queue = CaptureQueue()
+        queue.capture(queue.claim()[0])
+        StripeCheckoutAttempt.objects.filter(pk=attempt.pk).update(date_capture_due=timezone.now())
+
+        with self.assertStripeRequests(1):
+            [(__, status, error)] = queue.process()
+
+        self.assertEqual((status, error), (StripeCheckoutAttempt.CAPTURED, None))
+        self.assertEqual(len(self.get_capture_keys()), 1)
+        self.assertEqual(attempt.order.sources.get().amount_debited, attempt.order.total_incl_tax)
+
+    def test_payment_captured_elsewhere_is_recorded(self):
+        attempt = self.place_order()
+        Facade().capture_payment_intent(attempt.payment_intent_id)
+
+        [(__, status, error)] = CaptureQueue().process()
+
+        self.assertEqual((status, error), (StripeCheckoutAttempt.CAPTURED, None))
+        self.assertEqual(attempt.order.sources.get().amount_debited, attempt.order.total_incl_tax)
+
+
+@override_settings(STRIPE_MAX_RETRIES=2, STRIPE_RETRY_BACKOFF=0)
+class CallPolicyTests(StripeSCATestCase):
+    """
+    The retries CallPolicy makes, through a transport whose first requests fail.
+    """
+    def setUp(self):
+        super(CallPolicyTests, self).setUp()
+        self.start_checkout()
+        self.idempotency_keys = []
+
+    def fail_requests(self, times, status=None, code=None, error_type="api_error", delay=0):
+        """
+        Fail the next ``times`` requests: with a connection error, or with an error response of ``status``.
+        """
+        failures = iter(range(times))
+        send = self.transport.send
+
+        def flaky_send(request, **kwargs):
+            self.idempotency_keys.append(request.headers.get("Idempotency-Key"))
+            if next(failures, None) is None:
+                return send(request, **kwargs)
+            time.sleep(delay)
+            if status is None:
+                raise requests.exceptions.ConnectionError("Connection reset")
+            error = StripeError(status, "Request failed", code=code, error_type=error_type)
+            with mock.patch.object(self.fake_stripe, "handle", return_value=(error.status, error.body)):
+                return send(request, **kwargs)
+
+        return mock.patch.object(self.transport, "send", flaky_send)
+
+    def test_retries_connection_errors(self):
+        with self.fail_requests(2):
+            session = Facade().retrieve_session(self.session_id)
+
+        self.assertEqual(session.id, self.session_id)
+        self.assertEqual(len(self.idempotency_keys), 3)
+
+    def test_gives_up_after_max_retries(self):
+        with self.fail_requests(3, status=503), self.assertRaises(stripe.error.APIError):
+            Facade().retrieve_session(self.session_id)
+
+        self.assertEqual(len(self.idempotency_keys), 3)
+
+    @override_settings(STRIPE_MAX_RETRIES=0)
+    def test_retries_can_be_disabled(self):
+        with self.fail_requests(1), self.assertRaises(stripe.error.APIConnectionError):
+            Facade().retrieve_session(self.session_id)
+
+        self.assertEqual(len(self.idempotency_keys), 1)
+
+    def test_retries_reuse_the_idempotency_key(self):
+        with self.fail_requests(2, status=500):
+            Facade().expire_session(self.session_id)
+
+        self.assertEqual(self.fake_stripe.sessions[self.session_id]["status"], "expired")
+        self.assertEqual(self.idempotency_keys, ["oscar-stripe-sca:expire:{0}".format(self.session_id)] * 3)
+
+    def test_lock_timeouts_are_retried(self):
+        with self.fail_requests(1, status=409, code="lock_timeout", error_type="invalid_request_error"):
+            Facade().expire_session(self.session_id)
+
+        self.assertEqual(len(self.idempotency_keys), 2)
+
+    def test_other_conflicts_are_not_retried(self):
+        with self.fail_requests(1, status=409, code="idempotency_key_in_use", error_type="invalid_request_error"), \
+                self.assertRaises(stripe.error.StripeError):
+            Facade().expire_session(self.session_id)
+
+        self.assertEqual(len(self.idempotency_keys), 1)
+
+    def test_card_errors_are_not_retried(self):
+        with self.fail_requests(1, status=402, code="card_declined", error_type="card_error"), \
+                self.assertRaises(stripe.error.CardError):
+            Facade().expire_session(self.session_id)
+
+        self.assertEqual(len(self.idempotency_keys), 1)
+
+    def test_writes_without_an_idempotency_key_are_not_retried(self):
+        with self.fail_requests(1), self.assertRaises(stripe.error.APIConnectionError):
+            Facade().create_product("Product", {})
+
+        self.assertEqual(len(self.idempotency_keys), 1)
+
+    def test_no_retry_is_started_past_the_deadline(self):
+        # Each failure takes 0.3s, so the second leaves less than MIN_ATTEMPT_TIMEOUT of the budget
+        facade = Facade(policy=CallPolicy(timeouts={"checkout.session.retrieve": MIN_ATTEMPT_TIMEOUT + 0.5}))
+
+        with self.fail_requests(2, delay=0.3), self.assertRaises(stripe.error.APIConnectionError):
+            facade.retrieve_session(self.session_id)
+
+        self.assertEqual(len(self.idempotency_keys), 2)
+
+    def test_run_async_retries(self):
+        policy = CallPolicy()
+        errors = [stripe.error.APIConnectionError("Connection reset")] * 2
+
+        async def func():
+            if errors:
+                raise errors.pop()
+            return "response"
+
+        self.assertEqual(asyncio.run(policy.run_async("payment_intent.retrieve", func)), "response")
+        self.assertEqual(errors, [])
+
+
+@override_settings(STRIPE_MAX_RETRIES=0)
+class CircuitBreakerTests(StripeSCATestCase):
+    def make_breaker(self, name="stripe"):
+        return CircuitBreaker(name, failure_threshold=2, window=60, recovery_timeout=30, slow_call=5)
+
+    def record_failures(self, circuit_breaker, times=1):
+        for __ in range(times):
+            circuit_breaker.after_call("payment_intent.retrieve", False, 0.1, stripe.error.APIConnectionError("Reset"))
+
+    def wait_for_recovery(self, circuit_breaker):
+        # As if recovery_timeout had passed since the circuit opened
+        key = circuit_breaker.get_key("state")
+        cache.set(key, {"opened_at": cache.get(key)["opened_at"] - circuit_breaker.recovery_timeout}, None)
+
+    def test_opens_after_the_failure_threshold(self):
+        circuit_breaker = self.make_breaker()
+
+        self.record_failures(circuit_breaker)
+        self.assertEqual(circuit_breaker.get_state(), breaker.CLOSED)
+        self.record_failures(circuit_breaker)
+
+        self.assertEqual(circuit_breaker.get_state(), breaker.OPEN)
+        with self.assertRaises(breaker.CircuitOpenError):
+            circuit_breaker.before_call("payment_intent.retrieve")
+
+    def test_errors_that_retrying_cant_fix_and_slow_calls(self):
+        circuit_breaker = self.make_breaker()
+
+        for __ in range(3):
+            circuit_breaker.after_call(
+                "payment_intent.capture", False, 0.1, stripe.error.CardError("Declined", None, "card_declined"))
+        self.assertEqual(circuit_breaker.get_state(), breaker.CLOSED)
+        circuit_breaker.after_call("payment_intent.capture", False, 5)
+        circuit_breaker.after_call("payment_intent.capture", False, 5)
+        self.assertEqual(circuit_breaker.get_state(), breaker.OPEN)
+
+    def test_half_open_trial_closes_the_circuit(self):
+        circuit_breaker = self.make_breaker()
+        self.record_failures(circuit_breaker, 2)
+        self.wait_for_recovery(circuit_breaker)
+        self.assertEqual(circuit_breaker.get_state(), breaker.HALF_OPEN)
+
+        trial = circuit_breaker.before_call("payment_intent.retrieve")
+        # Only one trial call at a time
+        with self.assertRaises(breaker.CircuitOpenError):
+            circuit_breaker.before_call("payment_intent.retrieve")
+        circuit_breaker.after_call("payment_intent.retrieve", trial, 0.1)
+
+        self.assertTrue(trial)
+        self.assertEqual(circuit_breaker.get_state(), breaker.CLOSED)
+        self.assertFalse(circuit_breaker.before_call("payment_intent.retrieve"))
+        # The failures that opened it are forgotten
+        self.record_failures(circuit_breaker)
+        self.assertEqual(circuit_breaker.get_state(), breaker.CLOSED)
+
+    def test_failed_trial_reopens_the_circuit(self):
+        circuit_breaker = self.make_breaker()
+        self.record_failures(circuit_breaker, 2)
+        self.wait_for_recovery(circuit_breaker)
+
+        trial = circuit_breaker.before_call("payment_intent.retrieve")
+        circuit_breaker.after_call("payment_intent.retrieve", trial, 0.1, stripe.error.APIError("Unavailable"))
+
+        self.assertEqual(circuit_breaker.get_state(), breaker.OPEN)
+        with self.assertRaises(breaker.CircuitOpenError):
+            circuit_breaker.before_call("payment_intent.retrieve")
+
+    def test_state_changes_are_signalled(self):
+        circuit_breaker = self.make_breaker()
+        changes = []
+
+        def receiver(sender, name, old_state, new_state, **kwargs):
+            changes.append((name, old_state, new_state))
+
+        signals.circuit_breaker_state_changed.connect(receiver)
+        self.addCleanup(signals.circuit_breaker_state_changed.disconnect, receiver)
+        self.record_failures(circuit_breaker, 3)
+        self.wait_for_recovery(circuit_breaker)
+        trial = circuit_breaker.before_call("payment_intent.retrieve")
+        circuit_breaker.after_call("payment_intent.retrieve", trial, 0.1)
+
+        self.assertEqual(changes, [
+            ("stripe", breaker.CLOSED, breaker.OPEN),
+            ("stripe", breaker.OPEN, breaker.HALF_OPEN),
+            ("stripe", breaker.HALF_OPEN, breaker.CLOSED),
+        ])
+
+    def test_state_is_shared_through_the_cache(self):
+        # Breakers of the same name, as in two processes sharing a cache
+        circuit_breaker, other = self.make_breaker(), self.make_breaker()
+
+        self.record_failures(circuit_breaker)
+        self.record_failures(other)
+
+        self.assertEqual(circuit_breaker.get_state(), breaker.OPEN)
+        self.assertEqual(other.get_state(), breaker.OPEN)
+        self.wait_for_recovery(circuit_breaker)
+        trial = other.before_call("payment_intent.retrieve")
+        with self.assertRaises(breaker.CircuitOpenError):
+            circuit_breaker.before_call("payment_intent.retrieve")
+        other.after_call("payment_intent.retrieve", trial, 0.1)
+        self.assertEqual(circuit_breaker.get_state(), breaker.CLOSED)
+
+    def test_accounts_have_circuits_of_their_own(self):
+        self.record_failures(self.make_breaker("stripe:eu"), 2)
+
+        self.assertEqual(self.make_breaker("stripe:eu").get_state(), breaker.OPEN)
+        self.assertEqual(self.make_breaker().get_state(), breaker.CLOSED)
+
+    @override_settings(STRIPE_BREAKER_FAILURE_THRESHOLD=2)
+    def test_open_circuit_fails_without_calling_stripe(self):
+        self.start_checkout()
+        facade = Facade()
+        with mock.patch.object(self.fake_stripe, "retrieve_session", side_effect=StripeError(500, "Unavailable")):
+            for __ in range(2):
+                with self.assertRaises(stripe.error.APIError):
+                    facade.retrieve_session(self.session_id)
+
+        with self.assertStripeRequests(0), self.assertRaises(breaker.CircuitOpenError):
+            facade.retrieve_session(self.session_id)
+
+
+class SuccessViewTests(StripeSCATestCase):
+    def get_intent(self):
+        return self.fake_stripe.payment_intents[self.fake_stripe.sessions[self.session_id]["payment_intent"]]
+
+    def test_other_customer_cannot_place_the_order(self):
+        client, basket = self.start_checkout()
+        url = self.pay(client, basket)
+        other = start_checkout(UserFactory(), self.country)
+
+        self.assertRedirects(other.get(url), reverse("basket:summary"), fetch_redirect_response=False)
+        with self.assertStripeRequests(0):
+            response = other.post(url)
+
+        self.assertRedirects(response, reverse("basket:summary"), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.filter(basket_id=basket.id).exists())
+        self.assertEqual(self.get_intent()["status"], "requires_capture")
+        self.assertEqual(Basket.objects.get(pk=basket.pk).status, Basket.FROZEN)
+
+        # The customer can still place it
+        self.assertRedirects(client.post(url), reverse("checkout:thank-you"), fetch_redirect_response=False)
+        self.assertEqual(Order.objects.get(basket_id=basket.id).user, self.user)
+
+    def test_guest_basket_belongs_to_the_session_sent_to_stripe(self):
+        from django.contrib.auth.models import AnonymousUser
+        from django.contrib.sessions.backends.cache import SessionStore
+        from django.test import RequestFactory
+        from oscar.apps.checkout.utils import CheckoutSessionData
+        from oscar_stripe_sca.views import StripeSCASuccessResponseView
+
+        basket = make_basket(1)
+
+        def is_basket_owner(submitted_basket_id):
+            request = RequestFactory().get("/")
+            request.user = AnonymousUser()
+            request.session = SessionStore()
+            view = StripeSCASuccessResponseView()
+            view.request = request
+            view.checkout_session = CheckoutSessionData(request)
+            if submitted_basket_id is not None:
+                view.checkout_session.set_submitted_basket(Basket(id=submitted_basket_id))
+            return view.is_basket_owner(basket)
+
+        self.assertTrue(is_basket_owner(basket.id))
+        self.assertFalse(is_basket_owner(None))
+        self.assertFalse(is_basket_owner(basket.id + 1))
+
+
+class FrozenBasketOfferCacheTests(StripeSCATestCase):
+    def setUp(self):
+        super(FrozenBasketOfferCacheTests, self).setUp()
+        # 20% off everything
+        create_offer()
+        self.basket = make_basket(3, owner=self.user)
+        self.basket.freeze()
+        self.offer_cache = FrozenBasketOfferCache()
+
+    def apply_offers(self, basket):
+        Applicator().apply(basket, self.user)
+
+    def store(self):
+        revision = self.offer_cache.get_revision(self.basket.id)
+        basket = reload_basket(self.basket)
+        self.apply_offers(basket)
+        self.offer_cache.store(basket, self.user, revision)
+        return basket
+
+    def restore(self):
+        basket = reload_basket(self.basket)
+        restored = self.offer_cache.restore(basket, self.user, self.offer_cache.get_revision(self.basket.id))
+        return basket if restored else None
+
+    def test_offers_are_restored_after_pickling(self):
+        applied = self.store()
+
+        with mock.patch.object(Applicator, "apply") as apply:
+            restored = self.restore()
+
+        apply.assert_not_called()
+        self.assertIsNotNone(restored)
+        self.assertGreater(applied.total_discount, 0)
+        self.assertEqual(restored.total_discount, applied.total_discount)
+        self.assertEqual(restored.total_incl_tax, applied.total_incl_tax)
+        self.assertEqual(
+            [(line.product_id, line.quantity, line.discount_value) for line in restored.all_lines()],
+            [(line.product_id, line.quantity, line.discount_value) for line in applied.all_lines()])
+        self.assertEqual(
+            [offer.pk for offer in restored.offer_applications.offers.values()],
+            [offer.pk for offer in applied.offer_applications.offers.values()])
+
+    def test_other_customers_are_not_given_the_offers(self):
+        self.store()
+        basket = reload_basket(self.basket)
+
+        self.assertFalse(self.offer_cache.restore(
+            basket, UserFactory(), self.offer_cache.get_revision(self.basket.id)))
+
+    def test_begin_invalidates_the_offers(self):
+        self.store()
+        self.basket.thaw()
+
+        Facade().begin(
+            self.user.email, reload_basket(self.basket),
+            Price("GBP", self.basket.total_excl_tax, incl_tax=self.basket.total_incl_tax), Free())
+
+        self.assertIsNone(self.restore())
+
+    def test_thawing_at_cancel_invalidates_the_offers(self):
+        client, basket = self.start_checkout()
+        self.basket = basket
+        self.store()
+
+        client.get(reverse("checkout:stripe-cancel", args=[basket.id]))
+
+        self.assertIsNone(self.restore())
+
+    def test_snapshot_taken_while_thawed_is_never_restored(self):
+        self.basket.thaw()
+        # Read before the offers are applied, then the basket is frozen again meanwhile
+        revision = self.offer_cache.get_revision(self.basket.id)
+        self.basket.freeze()
+        self.offer_cache.invalidate(self.basket.id)
+        basket = reload_basket(self.basket)
+        self.apply_offers(basket)
+        self.offer_cache.store(basket, self.user, revision)
+
+        self.assertIsNone(self.restore())
+
+
+class ReconcileTests(StripeSCATestCase):
+    def reconcile(self):
+        stdout = io.StringIO()
+        call_command("stripe_reconcile", stdout=stdout, stderr=io.StringIO())
+        return [line.split("\t")[:2] for line in stdout.getvalue().splitlines() if "\t" in line]
+
+    def get_intent_id(self):
+        return self.fake_stripe.sessions[self.session_id]["payment_intent"]
+
+    def test_placed_order_is_reconciled(self):
+        client, basket = self.start_checkout()
+        self.assertRedirects(client.post(self.pay(client, basket)), reverse("checkout:thank-you"),
+                             fetch_redirect_response=False)
+
+        self.assertEqual(self.reconcile(), [])
+
+    def test_authorisation_awaiting_its_order_is_not_reported(self):
+        self.start_checkout()
+        self.fake_stripe.complete_session(self.session_id)
+        self.send_webhooks("checkout.session.completed")
+
+        self.assertEqual(self.reconcile(), [])
+
+    def test_authorisation_given_up_on_is_reported(self):
+        self.start_checkout()
+        self.fake_stripe.complete_session(self.session_id)
+        StripeCheckoutAttempt.objects.filter(session_id=self.session_id).update(status=StripeCheckoutAttempt.EXPIRED)
+
+        self.assertEqual(self.reconcile(), [["missing-order", self.get_intent_id()]])
+
+    def test_payment_without_an_attempt_is_reported(self):
+        intent = self.fake_stripe.create_payment_intent(1099, "gbp", status="requires_capture")
+
+        self.assertEqual(self.reconcile(), [["missing-order", intent["id"]]])
+
+    def test_page_is_matched_with_two_queries(self):
+        for __ in range(3):
+            client, basket = self.start_checkout(lines=1)
+            client.post(self.pay(client, basket))
+        [intents] = Facade().iter_payment_intent_pages({"gte": 0})
+
+        with self.assertNumQueries(2):
+            statuses, sources = ReconcileCommand().load_page(intents)
+
+        self.assertEqual(len(statuses), 3)
+        self.assertEqual(sorted(sources), sorted(intent.id for intent in intents))
+
+
+class CatalogSyncTests(StripeSCATestCase):
+    def setUp(self):
+        super(CatalogSyncTests, self).setUp()
+        self.stockrecord = make_basket(1, variants=False).all_lines()[0].stockrecord
+
+    def reprice(self):
+        self.stockrecord.price += D('1.00')
+        self.stockrecord.save()
+
+    def test_creates_product_and_price(self):
+        counts = CatalogSync().sync_batch([self.stockrecord])
+
+        self.assertEqual(counts, {'stockrecords': 1, 'created': 1, 'updated': 0, 'failed': 0})
+        price = StripePrice.objects.get(stockrecord=self.stockrecord)
+        self.assertEqual((price.unit_amount, price.currency), (int(self.stockrecord.price * 100), "GBP"))
+        self.assertEqual(self.fake_stripe.prices[price.price_id]["unit_amount"], price.unit_amount)
+
+    def test_reprice_replaces_the_price(self):
+        CatalogSync().sync_batch([self.stockrecord])
+        old = StripePrice.objects.get(stockrecord=self.stockrecord)
+        self.reprice()
+
+        counts = CatalogSync().sync_batch([self.stockrecord])
+
+        self.assertEqual(counts['updated'], 1)
+        price = StripePrice.objects.get(stockrecord=self.stockrecord)
+        self.assertNotEqual(price.price_id, old.price_id)
+        self.assertEqual(price.unit_amount, old.unit_amount + 100)
+        self.assertFalse(self.fake_stripe.prices[old.price_id]["active"])
+
+    def test_failed_reprice_keeps_the_old_price(self):
+        CatalogSync().sync_batch([self.stockrecord])
+        old = StripePrice.objects.get(stockrecord=self.stockrecord)
+        self.reprice()
+
+        error = stripe.error.APIConnectionError("Network error")
+        with mock.patch.object(Facade, "create_price", side_effect=error):
+            counts = CatalogSync().sync_batch([self.stockrecord])
+
+        self.assertEqual(counts, {'stockrecords': 1, 'created': 0, 'updated': 0, 'failed': 1})
+        price = StripePrice.objects.get(stockrecord=self.stockrecord)
+        self.assertEqual((price.price_id, price.unit_amount), (old.price_id, old.unit_amount))
+        self.assertTrue(self.fake_stripe.prices[old.price_id]["active"])
+
+    def test_failed_reprice_does_not_advance_the_checkpoint(self):
+        call_command("stripe_sync_catalog", stdout=mock.Mock())
+        position = StripeCheckpoint.load("catalog_sync:default").position
+        self.reprice()
+
+        with mock.patch.object(Facade, "create_price", side_effect=stripe.error.APIConnectionError("Network error")):
+            call_command("stripe_sync_catalog", stdout=mock.Mock())
+        self.assertEqual(StripeCheckpoint.load("catalog_sync:default").position, position)
+
+        call_command("stripe_sync_catalog", stdout=mock.Mock())
+        self.assertEqual(
+            StripePrice.objects.get(stockrecord=self.stockrecord).unit_amount, int(self.stockrecord.price * 100))
+
+
+class AdaptiveLineItemTests(SimpleTestCase):
+    """
+    LineItemBuilder in adaptive mode: whatever the basket, the lines fit within the limits and add up to the
+    total to the minor unit.
+    """
+    def get_items(self, count, price=D('9.99'), currency="GBP", title="Product {0}"):
+        return [
+            PaymentItem(1 + i % 3, title.format(i), price + i, currency) for i in range(count)
+        ]
+
+    def get_total(self, items, currency="GBP", adjustment=D('0.00')):
+        total = sum(item.price_incl_tax * item.quantity for item in items) + adjustment
+        return Price(currency, total, incl_tax=total)
+
+    def build(self, items, total, **kwargs):
+        builder = LineItemBuilder(use_prices_api=True, compress=COMPRESS_ADAPTIVE, **kwargs)
+        return builder, builder.build(items, total)
+
+    def get_charged(self, line_items):
+        return sum(line_item["price_data"]["unit_amount"] * line_item["quantity"] for line_item in line_items)
+
+    def assertFits(self, builder, line_items, expected):
+        self.assertEqual(self.get_charged(line_items), expected)
+        self.assertLessEqual(len(line_items), builder.max_items)
+        self.assertLessEqual(sum(encoded_size(line_item) for line_item in line_items), builder.max_size)
+
+    def test_one_line(self):
+        items = self.get_items(1)
+        builder, line_items = self.build(items, self.get_total(items))
+
+        self.assertEqual(line_items, [{
+            "price_data": {"product_data": {"name": "Product 0"}, "currency": "GBP", "unit_amount": 999},
+            "quantity": 1,
+        }])
+
+    def test_lines_up_to_the_limit_are_itemized(self):
+        items = self.get_items(100)
+        total = self.get_total(items)
+        # Large enough for the number of lines to be the limit
+        builder, line_items = self.build(items, total, max_size=100000)
+
+        self.assertEqual(line_items, LineItemBuilder(use_prices_api=True).build(items, total))
+        self.assertFits(builder, line_items, int(total.incl_tax * 100))
+
+    def test_lines_over_the_limit_are_summarized(self):
+        items = self.get_items(101)
+        total = self.get_total(items)
+        builder, line_items = self.build(items, total, max_size=100000)
+
+        self.assertEqual(len(line_items), 100)
+        self.assertEqual(line_items[:99], LineItemBuilder(use_prices_api=True).build(items, total)[:99])
+        summary = line_items[-1]
+        self.assertEqual(summary["quantity"], 1)
+        self.assertEqual(summary["price_data"]["product_data"]["name"], "1xProduct 99, 2xProduct 100")
+        self.assertEqual(summary["price_data"]["unit_amount"], 10899 + 2 * 10999)
+        self.assertFits(builder, line_items, int(total.incl_tax * 100))
+
+    def test_large_basket(self):
+        items = self.get_items(5000)
+        total = self.get_total(items)
+        builder, line_items = self.build(items, total)
+
+        # As many lines as fit in the default size budget
+        self.assertEqual(len(line_items), 88)
+        self.assertLessEqual(len(line_items[-1]["price_data"]["product_data"]["name"]), SUMMARY_NAME_LENGTH)
+        self.assertFits(builder, line_items, int(total.incl_tax * 100))
+
+    def test_rounding_remainder_is_charged_by_the_summary(self):
+        # Each unit price rounds up to 34p, so the itemized lines would charge more than the total
+        items = [PaymentItem(3, "Product {0}".format(i), D('0.335'), "GBP") for i in range(10)]
+        total = Price("GBP", D('10.00'), incl_tax=D('10.00'))
+        builder, line_items = self.build(items, total)
+
+        self.assertFits(builder, line_items, 1000)
+        self.assertEqual(len(line_items), 10)
+        self.assertEqual([line_item["price_data"]["unit_amount"] for line_item in line_items[:9]], [34] * 9)
+        self.assertEqual((line_items[-1]["price_data"]["unit_amount"], line_items[-1]["quantity"]), (1000 - 918, 1))
+
+    def test_basket_discount_is_charged_by_the_summary(self):
+        items = self.get_items(20)
+        total = self.get_total(items, adjustment=D('-5.00'))
+        builder, line_items = self.build(items, total)
+
+        self.assertFits(builder, line_items, int(total.incl_tax * 100))
+
+    def test_zero_decimal_currency(self):
+        items = self.get_items(150, price=D('1200'), currency="JPY")
+        total = self.get_total(items, currency="JPY")
+        builder, line_items = self.build(items, total)
+
+        self.assertFits(builder, line_items, int(total.incl_tax))
+
+    def test_payload_size_budget(self):
+        items = self.get_items(50, title="\u00c9l\u00e9ment {0} " + "x" * 200)
+        total = self.get_total(items)
+        builder, line_items = self.build(items, total, max_size=5000)
+
+        self.assertLess(len(line_items), 50)
+        self.assertFits(builder, line_items, int(total.incl_tax * 100))
+
+    def test_size_budget_too_small_for_any_line(self):
+        items = self.get_items(5, title="x" * 500)
+        total = self.get_total(items)
+        builder, line_items = self.build(items, total, max_size=100)
+
+        self.assertEqual(len(line_items), 1)
+        self.assertEqual(self.get_charged(line_items), int(total.incl_tax * 100))
+
+    def test_mixed_currencies_fall_back_to_one_line(self):
+        items = self.get_items(3) + self.get_items(2, currency="EUR")
+        total = Price("GBP", D('100.00'), incl_tax=D('100.00'))
+        builder, line_items = self.build(items, total)
+
+        self.assertEqual(len(line_items), 1)
+        self.assertEqual(line_items[0]["price_data"]["currency"], "GBP")
+        self.assertEqual(line_items[0]["price_data"]["unit_amount"], 10000)
+        self.assertEqual(line_items[0]["quantity"], 1)
+
+
+class MinorUnitTests(SimpleTestCase):
+    def test_two_decimal_currencies(self):
+        self.assertEqual(to_minor_units(D('10.99'), "GBP"), 1099)
+        self.assertEqual(to_minor_units(D('0.01'), "usd"), 1)
+        self.assertEqual(to_minor_units(D('0'), "EUR"), 0)
+
+    def test_zero_decimal_currencies(self):
+        self.assertEqual(to_minor_units(D('1000'), "JPY"), 1000)
+        self.assertEqual(to_minor_units(D('1000.49'), "jpy"), 1000)
+        self.assertEqual(to_minor_units(D('1000.50'), "KRW"), 1001)
+
+    def test_three_decimal_currencies_are_multiples_of_ten(self):
+        self.assertEqual(to_minor_units(D('1.234'), "KWD"), 1230)
+        self.assertEqual(to_minor_units(D('1.235'), "BHD"), 1240)
+        self.assertEqual(to_minor_units(D('0.995'), "JOD"), 1000)
+
+    def test_rounds_half_up(self):
+        self.assertEqual(to_minor_units(D('0.005'), "GBP"), 1)
+        self.assertEqual(to_minor_units(D('0.0049'), "GBP"), 0)
+        self.assertEqual(to_minor_units(D('2.675'), "USD"), 268)
+
+    def test_floats_are_converted_by_their_shortest_repr(self):
+        # 2.675 is 2.67499999... as a binary float
+        self.assertEqual(to_minor_units(2.675, "USD"), 268)
+        self.assertEqual(to_minor_units(19.99, "GBP"), 1999)
+
+    def test_batches_match_single_conversions(self):
+        amounts = [D('0.005'), D('1.234'), 2.675, D('10')]
+        for currency in ("GBP", "JPY", "KWD"):
+            self.assertEqual(
+                to_minor_units_batch(amounts, currency), [to_minor_units(amount, currency) for amount in amounts])
+
+    def test_validate_total(self):
+        self.assertEqual(validate_total([1099, 500], [2, 1], D('26.98'), "GBP"), 2698)
+        with self.assertRaises(AmountMismatchError):
+            validate_total([333, 333, 333], [1, 1, 1], D('10.00'), "GBP")
+
+
+class OrderPlacementLockTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.lock = OrderPlacementLock(ttl=30)
+
+    def test_acquire(self):
+        self.assertIsNotNone(self.lock.acquire(1))
+
+    def test_second_caller_is_refused(self):
+        self.lock.acquire(1)
+        self.assertIsNone(self.lock.acquire(1))
+        # Other baskets aren't affected
+        self.assertIsNotNone(self.lock.acquire(2))
+
+    def test_release(self):
+        token = self.lock.acquire(1)
+        self.lock.release(1, token, {'order_id': 5})
+        self.assertIsNotNone(self.lock.acquire(1))
+        self.assertEqual(self.lock.get_result(1), {'order_id': 5})
+
+    def test_release_leaves_a_lock_taken_by_another_request(self):
+        token = self.lock.acquire(1)
+        with mock.patch("time.time", return_value=time.time() + 31):
+            other = self.lock.acquire(1)
+        self.assertIsNotNone(other)
+        self.lock.release(1, token)
+        self.assertIsNone(self.lock.acquire(1))
+
+    def test_expires_after_ttl(self):
+        self.lock.acquire(1)
+        with mock.patch("time.time", return_value=time.time() + 29):
+            self.assertIsNone(self.lock.acquire(1))
+        with mock.patch("time.time", return_value=time.time() + 31):
+            self.assertIsNotNone(self.lock.acquire(1))
+
+    def test_wait_returns_the_result(self):
+        token = self.lock.acquire(1)
+        timer = threading.Timer(0.1, self.lock.release, [1, token, {'order_id': 5}])
+        timer.start()
+        self.assertEqual(self.lock.wait(1, timeout=5), {'order_id': 5})
+        timer.join()
+
+    def test_wait_gives_up(self):
+        self.lock.acquire(1)
+        started = time.monotonic()
+        self.assertIsNone(self.lock.wait(1, timeout=0.2))
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+
+    def test_disabled(self):
+        self.assertFalse(OrderPlacementLock(ttl=0).enabled)
+
+
+# SQLite doesn't wait for a table another thread is writing to, so saving the sessions of the concurrent
+# requests could fail with a 400
+@override_settings(SESSION_ENGINE="django.contrib.sessions.backends.cache")
+class DuplicateSubmissionTests(StripeStubMixin, TransactionTestCase):
+    """
+    Placing the order for one basket from several requests at once, as a double click or a retrying mobile
+    browser does.  The requests run in threads, so the data has to be committed for them to see it.
+    """
+    submissions = 10
+
+    def submit(self, client, url):
+        """
+        Post the place order form from ``submissions`` threads at once, and return the responses.
+        """
+        barrier = threading.Barrier(self.submissions)
+        responses = []
+
+        def post():
+            duplicate = Client()
+            duplicate.cookies = client.cookies
+            barrier.wait()
+            try:
+                responses.append(duplicate.post(url))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=post) for __ in range(self.submissions)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    def test_places_one_order(self):
+        client, basket = self.start_checkout()
+        url = self.pay(client, basket)
+
+        with self.assertStripeRequests(1):
+            responses = self.submit(client, url)
+
+        self.assertEqual(Order.objects.filter(basket_id=basket.id).count(), 1)
+        intent = self.fake_stripe.payment_intents[self.fake_stripe.sessions[self.session_id]["payment_intent"]]
+        self.assertEqual(intent["status"], "succeeded")
+        self.assertEqual(
+            [(response.status_code, response["Location"]) for response in responses],
+            [(302, reverse("checkout:thank-you"))] * self.submissions)
+
+    def test_repost_is_sent_to_the_order(self):
+        client, basket = self.start_checkout()
+        url = self.pay(client, basket)
+        client.post(url)
+        order = Order.objects.get(basket_id=basket.id)
+
+        with self.assertStripeRequests(0):
+            response = client.post(url)
+
+        self.assertRedirects(response, reverse("checkout:thank-you"), fetch_redirect_response=False)
+        self.assertEqual(client.session["checkout_order_id"], order.id)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_order_is_not_shared_with_other_customers(self):
+        client, basket = self.start_checkout()
+        url = self.pay(client, basket)
+        client.post(url)
+
+        other = start_checkout(UserFactory(), self.country)
+        response = other.post(url)
+
+        self.assertRedirects(response, reverse("basket:summary"), fetch_redirect_response=False)
+        self.assertNotIn("checkout_order_id", other.session)
+
+
+# Sessions in the database would be saved from two threads at once
+@override_settings(SESSION_ENGINE="django.contrib.sessions.backends.cache")
+class AsyncViewTests(StripeStubMixin, TransactionTestCase):
+    """
+    The async views, served through ASGI.  The order is placed in a worker thread, so the data has to be
+    committed for it to see.
+    """
+    def checkout(self, client):
+        """
+        Go through the payment details page, pay and place the order with ``client``, and return the basket,
+        its payment intent and the Stripe requests made.
+        """
+        from asgiref.sync import async_to_sync
+
+        requests = []
+        handle = self.fake_stripe.handle
+
+        def record(method, path, params, idempotency_key=None):
+            requests.append((method, path, params, idempotency_key))
+            return handle(method, path, params, idempotency_key)
+
+        basket = make_basket(3, owner=self.user)
+        client.cookies = start_checkout(self.user, self.country).cookies
+
+        def call(method, url):
+            if isinstance(client, AsyncClient):
+                async def request():
+                    return await getattr(client, method)(url)
+                return async_to_sync(request)()
+            return getattr(client, method)(url)
+
+        with mock.patch.object(self.fake_stripe, "handle", record):
+            response = call("get", reverse("checkout:stripe-payment-details"))
+            self.assertEqual(response.status_code, 200)
+            session_id = SESSION_ID.search(response.content.decode()).group("id")
+            self.fake_stripe.complete_session(session_id)
+            url = reverse("checkout:stripe-preview", args=[basket.id])
+            self.assertEqual(call("get", url).status_code, 200)
+            self.assertRedirects(call("post", url), reverse("checkout:thank-you"), fetch_redirect_response=False)
+        payment_intent = self.fake_stripe.payment_intents[self.fake_stripe.sessions[session_id]["payment_intent"]]
+        self.assertEqual(payment_intent["status"], "succeeded")
+        return basket, payment_intent["id"], requests
+
+    def normalize(self, basket, payment_intent_id, requests):
+        """
+        Take the basket id, the order number made from it and the payment intent's id out of the requests, as
+        they are all that differs between two checkouts, along with the session's idempotency key, which is
+        made from them.
+        """
+        replacements = [
+            (payment_intent_id, "<payment_intent>"),
+            (str(100000 + basket.id), "<order>"),
+            ("/{0}/".format(basket.id), "/<basket>/"),
+        ]
+
+        def normalize(key, value):
+            if key == "client_reference_id":
+                return "<basket>"
+            if key is None and value.startswith("oscar-stripe-sca:checkout-session:"):
+                return "oscar-stripe-sca:checkout-session:<key>"
+            for old, new in replacements:
+                value = value.replace(old, new)
+            return value
+
+        return [
+            (method, normalize(None, path), dict((key, normalize(key, value)) for key, value in params.items()),
+             normalize(None, idempotency_key or ""))
+            for method, path, params, idempotency_key in requests
+        ]
+
+    def test_async_views_send_the_same_requests(self):
+        with override_settings(ROOT_URLCONF="benchmarks.urls"):
+            sync_requests = self.normalize(*self.checkout(Client()))
+        with override_settings(ROOT_URLCONF="oscar_stripe_sca.tests"):
+            async_requests = self.normalize(*self.checkout(AsyncClient()))
+
+        self.assertEqual([request[:2] for request in sync_requests], [
+            ("POST", "/v1/checkout/sessions"),
+            ("POST", "/v1/payment_intents/<payment_intent>/capture"),
+        ])
+        self.assertEqual(async_requests, sync_requests)
+
+    def test_order_is_placed_off_the_shared_thread(self):
+        # Under async_to_sync, thread sensitive code runs in the thread that called it: this one
+        threads = []
+        place_order_in_worker = AsyncStripeSCASuccessResponseView.place_order_in_worker
+
+        def record_thread(view, *args, **kwargs):
+            threads.append(threading.current_thread())
+            return place_order_in_worker(view, *args, **kwargs)
+
+        with override_settings(ROOT_URLCONF="oscar_stripe_sca.tests"), mock.patch.object(
+                AsyncStripeSCASuccessResponseView, "place_order_in_worker", record_thread):
+            self.checkout(AsyncClient())
+
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
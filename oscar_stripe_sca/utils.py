@@ -0,0 +1,50 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+
+from django.utils.functional import SimpleLazyObject
+
+
+# The Stripe SDK takes about half a second to import.  The modules loaded along with the URLconf use this
+# stand-in for it, which imports it the first time one of its attributes is used.
+stripe = SimpleLazyObject(lambda: import_module("stripe"))
+
+
+class RateLimiter(object):
+    """
+    Spaces out calls from any number of threads to at most ``rate`` per second.  A rate of 0 disables it.
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def run_concurrently(func, items, workers, rate=0):
+    """
+    Call ``func(item)`` for every item on a bounded thread pool, at most ``rate`` calls a second, and return
+    a list of ``(item, result, exception)`` in the order the items were given.  Workers should only talk to
+    Stripe; leave database writes to the calling thread.
+    """
+    limiter = RateLimiter(rate)
+
+    def call(item):
+        limiter.wait()
+        try:
+            return item, func(item), None
+        except Exception as e:
+            return item, None, e
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(call, items))
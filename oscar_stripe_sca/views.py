@@ -1,53 +1,167 @@
+import functools
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.db import connections
 from django.core.exceptions import PermissionDenied
 from django.contrib import messages
-from django.http import HttpResponseRedirect
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseRedirect
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
-from django.views.generic import RedirectView
+from django.utils.crypto import constant_time_compare
+from django.views.generic import RedirectView, View
+from oscar.apps.checkout import exceptions
+from oscar.apps.checkout.utils import CheckoutSessionData
 from oscar.apps.checkout.views import PaymentDetailsView as CorePaymentDetailsView
+from oscar.apps.checkout.views import ShippingMethodView as CoreShippingMethodView
+from oscar.apps.payment.exceptions import UnableToTakePayment
 from oscar.core.exceptions import ModuleNotFoundError
 from oscar.core.loading import get_class, get_model
 from oscar_stripe_sca.facade import logger
 from django.utils.translation import gettext_lazy as _
 from django.contrib import messages
-from oscar_stripe_sca.facade import Facade
-from . import PAYMENT_METHOD_STRIPE, PAYMENT_EVENT_PURCHASE
+from oscar_stripe_sca import breaker, capture
+from oscar_stripe_sca.accounts import UnknownAccountError
+from oscar_stripe_sca.facade import AsyncFacade, Facade
+from oscar_stripe_sca.instrumentation import HistogramSink, get_sinks, render_prometheus
+from oscar_stripe_sca.models import StripeCheckoutAttempt
+from oscar_stripe_sca.money import to_minor_units
+from oscar_stripe_sca.offer_cache import FrozenBasketOfferCache
+from oscar_stripe_sca.order_lock import OrderPlacementLock
+from oscar_stripe_sca.session_cache import CheckoutSessionCache
+from oscar_stripe_sca.utils import stripe
+from oscar_stripe_sca.webhooks import WebhookHandler
+from . import (
+    CHECKOUT_MODE_REDIRECT, PAYMENT_EVENT_AUTHORISE, PAYMENT_EVENT_PURCHASE, PAYMENT_METHOD_STRIPE, speculative)
 
 SourceType = get_model('payment', 'SourceType')
 Source = get_model('payment', 'Source')
 Line = get_model('basket', 'Line')
 Basket = get_model('basket', 'Basket')
 Selector = get_class('partner.strategy', 'Selector')
-try:
-    Applicator = get_class('offer.applicator', 'Applicator')
-except ModuleNotFoundError:
-    # fallback for django-oscar<=1.1
-    Applicator = get_class('offer.utils', 'Applicator')
+
+
+@functools.lru_cache(maxsize=None)
+def get_applicator_class():
+    # Only needed to place an order, so not loaded along with the URLconf
+    try:
+        return get_class('offer.applicator', 'Applicator')
+    except ModuleNotFoundError:
+        # fallback for django-oscar<=1.1
+        return get_class('offer.utils', 'Applicator')
+
+
+class SpeculativeCheckoutSessionMixin(object):
+    """
+    For checkout views that come before the payment details page: ``prepare_stripe_session`` starts creating
+    the basket's Checkout Session in the background, so that the payment details page only has to look it up.
+    Does nothing unless STRIPE_SPECULATIVE_SESSIONS is set.
+    """
+    def get_customer_email(self, basket):
+        try:
+            return basket.owner.email
+        except AttributeError:
+            return self.checkout_session.get_guest_email()
+
+    def prepare_stripe_session(self):
+        if not speculative.is_enabled():
+            return
+        submission = self.build_submission()
+        if submission["order_total"] is None:
+            return
+        try:
+            Facade.for_request(self.request, submission["basket"]).prepare(
+                self.get_customer_email(submission["basket"]),
+                submission["basket"],
+                submission["order_total"],
+                submission["shipping_method"])
+        except Exception:
+            # Only an optimisation; the payment details page creates the session if this didn't
+            logger.warning("Unable to prepare a Stripe session for basket #%s", self.request.basket.id, exc_info=True)
+
+
+class StripeSCAShippingMethodView(SpeculativeCheckoutSessionMixin, CoreShippingMethodView):
+    """
+    Oscar's shipping method view, which prepares the Checkout Session once the shipping method is known.
+    """
+    def get_success_response(self):
+        self.prepare_stripe_session()
+        return super(StripeSCAShippingMethodView, self).get_success_response()
 
 
 class StripeSCAPaymentDetailsView(CorePaymentDetailsView):
     template_name = "oscar_stripe_sca/stripe_payment_details.html"
 
-    def get_context_data(self, **kwargs):
-        ctx = super(StripeSCAPaymentDetailsView, self).get_context_data(**kwargs)
-        customer_email = None
+    def get_customer_email(self, ctx):
         try:
-            customer_email = ctx["basket"].owner.email
+            return ctx["basket"].owner.email
         except AttributeError:
             checkout_data = self.request.session[self.checkout_session.SESSION_KEY]
-            customer_email = checkout_data["guest"]["email"]
-        stripe_session = Facade().begin(
-            customer_email,
-            ctx["basket"],
-            ctx["order_total"],
-            ctx["shipping_method"])
-        self.request.session["stripe_session_id"] = stripe_session.id
-        self.request.session["stripe_payment_intent_id"] = stripe_session.payment_intent
-        ctx['stripe_publishable_key'] = settings.STRIPE_PUBLISHABLE_KEY
+            return checkout_data["guest"]["email"]
+
+    def get(self, request, *args, **kwargs):
+        if Facade.get_checkout_mode() == CHECKOUT_MODE_REDIRECT:
+            # Only the submission is needed to create the session, not the rest of the page's context
+            submission = self.build_submission()
+            try:
+                stripe_session = self.get_facade(submission["basket"]).begin(
+                    self.get_customer_email(submission),
+                    submission["basket"],
+                    submission["order_total"],
+                    submission["shipping_method"])
+            except breaker.CircuitOpenError:
+                # The page explains the error
+                stripe_session = None
+            if stripe_session is not None and stripe_session.get("url"):
+                return self.redirect_to_stripe(stripe_session)
+            # A session without a URL, e.g. an embedded one with a client secret, is mounted by the page
+            self.stripe_session = stripe_session
+        return super(StripeSCAPaymentDetailsView, self).get(request, *args, **kwargs)
+
+    def redirect_to_stripe(self, stripe_session):
+        """
+        Send the customer straight to the session's page on Stripe, without rendering the template.
+        """
+        self.add_stripe_session({}, stripe_session)
+        response = HttpResponseRedirect(stripe_session.url)
+        response.status_code = 303
+        return response
+
+    def get_facade(self, basket, facade_class=Facade):
+        """
+        A facade for the Stripe account that takes the payment for this basket.
+        """
+        # The success view only places the order for the basket this customer was sent to Stripe with
+        self.checkout_session.set_submitted_basket(basket)
+        facade = facade_class.for_request(self.request, basket)
+        self.stripe_account = facade.account
+        return facade
+
+    def get_context_data(self, **kwargs):
+        ctx = super(StripeSCAPaymentDetailsView, self).get_context_data(**kwargs)
+        # Already begun by get; beginning again would create a second session when sessions aren't reused
+        stripe_session = getattr(self, "stripe_session", None)
+        if stripe_session is None:
+            try:
+                stripe_session = self.get_facade(ctx["basket"]).begin(
+                    self.get_customer_email(ctx),
+                    ctx["basket"],
+                    ctx["order_total"],
+                    ctx["shipping_method"])
+            except breaker.CircuitOpenError as e:
+                ctx['error'] = Facade.get_friendly_error_message(e)
+                return ctx
+        return self.add_stripe_session(ctx, stripe_session)
+
+    def add_stripe_session(self, ctx, stripe_session):
+        # The session and its payment intent are found again through the basket's StripeCheckoutAttempt
+        ctx['stripe_publishable_key'] = self.stripe_account.publishable_key
         ctx['stripe_session_id'] = stripe_session.id
+        # Only set in embedded mode, where the template mounts the session instead of redirecting to it
+        ctx['stripe_client_secret'] = stripe_session.get("client_secret")
+        ctx['stripe_cancel_url'] = settings.STRIPE_PAYMENT_CANCEL_URL.format(self.request.basket.id)
         return ctx
 
 
@@ -74,24 +188,96 @@ class StripeSCASuccessResponseView(CorePaymentDetailsView):
             ).to_integral_value()
         return ctx
 
+    def get_checkout_attempt(self):
+        attempt = StripeCheckoutAttempt.get_payable(self.kwargs['basket_id'])
+        if attempt is None:
+            raise UnableToTakePayment(_("No Stripe payment was found for your basket"))
+        return attempt
+
+    def get_payment_intent_id(self, attempt):
+        pi = attempt.payment_intent_id
+        if not pi:
+            # Sessions created with API versions from 2022-08-01, such as embedded ones, only get a
+            # payment intent once they have been paid.  The webhook fills it in if it arrives first.
+            pi = self.retrieve_session(attempt.session_id).payment_intent
+        if not pi:
+            raise UnableToTakePayment(_("Your Stripe payment hasn't been completed"))
+        return pi
+
+    def get_facade(self, facade_class=Facade):
+        # The account the session was created with
+        return facade_class.for_account(self.checkout_attempt.account)
+
+    def retrieve_session(self, session_id):
+        return self.get_facade().retrieve_session(session_id)
+
+    def retrieve_payment_intent(self, pi):
+        return self.get_facade().retrieve_payment_intent(pi)
+
+    def check_authorised(self, attempt, pi, order_total):
+        """
+        Make sure the payment has been authorised for the order total before the order is placed without
+        capturing it.  The webhook records a paid session as complete; until it has, Stripe is asked.
+        """
+        if attempt.status == StripeCheckoutAttempt.COMPLETE:
+            authorised = (
+                attempt.currency.upper() == order_total.currency.upper() and attempt.amount >= order_total.incl_tax)
+        else:
+            try:
+                intent = self.retrieve_payment_intent(pi)
+            except breaker.CircuitOpenError as e:
+                raise UnableToTakePayment(Facade.get_friendly_error_message(e))
+            authorised = (
+                intent.status == "requires_capture"
+                and intent.currency.upper() == order_total.currency.upper()
+                and intent.amount_capturable >= to_minor_units(order_total.incl_tax, order_total.currency))
+        if not authorised:
+            raise UnableToTakePayment(_("Your Stripe payment hasn't been authorised"))
+
     def handle_payment(self, order_number, order_total, **kwargs):
-        pi = self.request.session["stripe_payment_intent_id"]
-        intent = Facade().retrieve_payment_intent(pi)
-        intent.capture()
+        self.checkout_attempt = attempt = self.get_checkout_attempt()
+        pi = self.get_payment_intent_id(attempt)
+        attempt.payment_intent_id = pi
+        deferred = capture.is_deferred()
+        if deferred:
+            # Only authorised for now; the capture is queued once the order has been placed
+            self.check_authorised(attempt, pi, order_total)
+            attempt.save(update_fields=['payment_intent_id', 'date_updated'])
+        else:
+            try:
+                self.capture_payment_intent(pi, order_number)
+            except breaker.CircuitOpenError as e:
+                raise UnableToTakePayment(Facade.get_friendly_error_message(e))
+            attempt.status = StripeCheckoutAttempt.CAPTURED
+            attempt.save(update_fields=['payment_intent_id', 'status', 'date_updated'])
 
         source_type, __ = SourceType.objects.get_or_create(name=PAYMENT_METHOD_STRIPE)
         source = Source(
             source_type=source_type,
             currency=order_total.currency,
             amount_allocated=order_total.incl_tax,
-            amount_debited=order_total.incl_tax,
+            amount_debited=0 if deferred else order_total.incl_tax,
             reference=pi)
         self.add_payment_source(source)
 
-        self.add_payment_event(PAYMENT_EVENT_PURCHASE, order_total.incl_tax, reference=pi)
+        if deferred:
+            self.add_payment_event(PAYMENT_EVENT_AUTHORISE, order_total.incl_tax, reference=pi)
+        else:
+            self.add_payment_event(PAYMENT_EVENT_PURCHASE, order_total.incl_tax, reference=pi)
+
+        # The session has been paid, so it mustn't be offered again for this basket
+        CheckoutSessionCache().delete(self.kwargs['basket_id'])
+
+    def handle_successful_order(self, order):
+        if self.checkout_attempt.status == StripeCheckoutAttempt.CAPTURED:
+            StripeCheckoutAttempt.objects.filter(pk=self.checkout_attempt.pk).update(order=order)
+        else:
+            capture.defer(self.checkout_attempt, order)
+        self.placed_order = order
+        return super(StripeSCASuccessResponseView, self).handle_successful_order(order)
 
-        del self.request.session["stripe_session_id"]
-        del self.request.session["stripe_payment_intent_id"]
+    def capture_payment_intent(self, pi, order_number):
+        return self.get_facade().capture_payment_intent(pi, order_number)
 
     def payment_description(self, order_number, total, **kwargs):
         return "Stripe payment for order {0} by {1}".format(order_number, self.request.user.get_full_name())
@@ -108,16 +294,42 @@ class StripeSCASuccessResponseView(CorePaymentDetailsView):
             basket = Basket.objects.get(id=basket_id, status=Basket.FROZEN)
         except Basket.DoesNotExist:
             return None
+        if not self.is_basket_owner(basket):
+            logger.warning("Refused access to frozen basket #%s by another customer", basket_id)
+            return None
 
         # Assign strategy to basket instance
         if Selector:
             basket.strategy = Selector().strategy(self.request)
 
         # Re-apply any offers
-        Applicator().apply(basket, self.request.user, request=self.request)
+        self.apply_offers(basket)
 
         return basket
 
+    def is_basket_owner(self, basket):
+        """
+        Whether the basket is this customer's: its owner, or for a guest, the session that was sent to Stripe
+        with it.  Otherwise anyone could place the order, and take the payment, for someone else's basket.
+        """
+        if basket.owner_id is not None:
+            return basket.owner_id == self.request.user.pk
+        return self.checkout_session.get_submitted_basket_id() == basket.id
+
+    def apply_offers(self, basket):
+        """
+        A frozen basket can't change, so the offers applied on the preview page are reused to place the order.
+        """
+        offer_cache = FrozenBasketOfferCache()
+        revision = offer_cache.get_revision(basket.id)
+        if not offer_cache.restore(basket, self.request.user, revision):
+            get_applicator_class()().apply(basket, self.request.user, request=self.request)
+            offer_cache.store(basket, self.request.user, revision)
+
+    def restore_frozen_basket(self):
+        super(StripeSCASuccessResponseView, self).restore_frozen_basket()
+        FrozenBasketOfferCache().invalidate(self.kwargs['basket_id'])
+
     def get(self, request, *args, **kwargs):
         kwargs['basket'] = self.load_frozen_basket(kwargs['basket_id'])
         if not kwargs['basket']:
@@ -132,10 +344,45 @@ class StripeSCASuccessResponseView(CorePaymentDetailsView):
 
     def post(self, request, *args, **kwargs):
         """
-        Place an order.
+        Place an order.  Submissions for a basket whose order is already being placed wait for it, and are
+        given its outcome rather than placing the order again.
         """
+        lock = OrderPlacementLock()
+        if not lock.enabled:
+            return self.place_basket_order(kwargs['basket_id'])
+
+        basket_id = kwargs['basket_id']
+        owner = self.get_lock_owner()
+        token = lock.acquire(basket_id)
+        if token is None:
+            result = lock.wait(basket_id, getattr(settings, "STRIPE_ORDER_LOCK_WAIT", 30))
+            if result is not None and result['owner'] == owner:
+                return self.get_duplicate_response(result)
+            # The other request failed, or gave up on the lock: try again
+            token = lock.acquire(basket_id)
+            if token is None:
+                messages.warning(self.request, _("Your order is still being placed, please wait a moment"))
+                return HttpResponseRedirect(reverse('checkout:stripe-preview', kwargs={'basket_id': basket_id}))
+        else:
+            # Posted again after the order was placed
+            result = lock.get_result(basket_id)
+            if result is not None and result['owner'] == owner:
+                lock.release(basket_id, token)
+                return self.get_duplicate_response(result)
+
+        self.placed_order = None
+        result = None
+        try:
+            response = self.place_basket_order(basket_id)
+            if self.placed_order is not None:
+                result = {'owner': owner, 'order_id': self.placed_order.id, 'url': response['Location']}
+            return response
+        finally:
+            lock.release(basket_id, token, result)
+
+    def place_basket_order(self, basket_id):
         # Reload frozen basket which is specified in the URL
-        basket = self.load_frozen_basket(kwargs['basket_id'])
+        basket = self.load_frozen_basket(basket_id)
         if not basket:
             messages.error(self.request, _("No basket was found that corresponds to your "
                   "Stripe transaction"))
@@ -144,6 +391,23 @@ class StripeSCASuccessResponseView(CorePaymentDetailsView):
         submission = self.build_submission(basket=basket)
         return self.submit(**submission)
 
+    def get_lock_owner(self):
+        # Only the customer who placed an order is sent on to it by a duplicate submission
+        if self.request.user.is_authenticated:
+            return "user:{0}".format(self.request.user.pk)
+        return "session:{0}".format(self.request.session.session_key)
+
+    def get_duplicate_response(self, result):
+        """
+        Send a duplicate submission on to the thank you page of the order placed by the first one.
+        """
+        logger.info("Duplicate submission for basket #%s sent on to order #%s", self.kwargs['basket_id'],
+                    result['order_id'])
+        # This request's copy of the session still has the checkout data the first request flushed
+        self.checkout_session.flush()
+        self.request.session["checkout_order_id"] = result['order_id']
+        return HttpResponseRedirect(result['url'])
+
 
 class StripeSCACancelResponseView(RedirectView):
     permanent = False
@@ -152,6 +416,7 @@ class StripeSCACancelResponseView(RedirectView):
         basket = get_object_or_404(Basket, id=kwargs['basket_id'],
                                    status=Basket.FROZEN)
         basket.thaw()
+        FrozenBasketOfferCache().invalidate(basket.id)
         logger.info("Payment cancelled (token %s) - basket #%s thawed",
                     request.GET.get('token', '<no token>'), basket.id)
         return super(StripeSCACancelResponseView, self).get(request, *args, **kwargs)
@@ -159,3 +424,150 @@ class StripeSCACancelResponseView(RedirectView):
     def get_redirect_url(self, **kwargs):
         messages.error(self.request, _("Stripe transaction cancelled"))
         return reverse('basket:summary')
+
+
+class StripeSCAWebhookView(View):
+    """
+    Receives Stripe's webhook events, so that payments are followed up even if the customer never makes it
+    back to the site.  Point a webhook endpoint in the Stripe dashboard at this view and set
+    STRIPE_WEBHOOK_SECRET to its signing secret.  The other accounts in STRIPE_ACCOUNTS each have an endpoint of
+    their own, named after the account, checked against the account's WEBHOOK_SECRET.
+    """
+    handler_class = WebhookHandler
+    http_method_names = ['post']
+
+    @method_decorator(csrf_exempt)
+    def dispatch(self, request, *args, **kwargs):
+        return super(StripeSCAWebhookView, self).dispatch(request, *args, **kwargs)
+
+    def post(self, request, *args, **kwargs):
+        try:
+            # Each account's webhook endpoint is at its own URL, and signs with its own secret
+            handler = self.handler_class(facade=Facade.for_account(kwargs.get('account')))
+        except UnknownAccountError:
+            raise Http404
+        if not handler.facade.account.webhook_secret:
+            raise Http404
+        try:
+            # Checks the signature locally; nothing is fetched from Stripe
+            event = stripe.Webhook.construct_event(
+                request.body,
+                request.META.get('HTTP_STRIPE_SIGNATURE', ''),
+                handler.facade.account.webhook_secret,
+                api_key=handler.facade.client.api_key)
+        except (ValueError, stripe.error.SignatureVerificationError):
+            logger.warning("Rejected a Stripe webhook with an invalid payload or signature")
+            return HttpResponseBadRequest()
+        handler.process(event)
+        return HttpResponse()
+
+
+class StripeSCAMetricsView(View):
+    """
+    Exports the Stripe call histograms in the Prometheus text format.  Scrapers authenticate with the
+    STRIPE_METRICS_TOKEN setting as a bearer token; without it the view is disabled.
+    """
+    http_method_names = ['get']
+
+    def get(self, request, *args, **kwargs):
+        token = getattr(settings, "STRIPE_METRICS_TOKEN", None)
+        sinks = [sink for sink in get_sinks() if isinstance(sink, HistogramSink)]
+        if not token or not sinks:
+            raise Http404
+        if not constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), "Bearer {0}".format(token)):
+            raise PermissionDenied
+        return HttpResponse(
+            render_prometheus(sinks[0].collect(), sinks[0].buckets), content_type="text/plain; version=0.0.4")
+
+
+class AsyncCheckoutSessionMixin(object):
+    """
+    Lets a checkout view's handlers be coroutines.  Oscar's skip and pre-conditions query the database, so
+    they run through sync_to_async before the handler is awaited.
+    """
+    def get_condition_response(self, request):
+        self.checkout_session = CheckoutSessionData(request)
+        try:
+            self.check_skip_conditions(request)
+        except exceptions.PassedSkipCondition as e:
+            return HttpResponseRedirect(e.url)
+        try:
+            self.check_pre_conditions(request)
+        except exceptions.FailedPreCondition as e:
+            for message in e.messages:
+                messages.warning(request, message)
+            return HttpResponseRedirect(e.url)
+        return None
+
+    async def dispatch(self, request, *args, **kwargs):
+        response = await sync_to_async(self.get_condition_response)(request)
+        if response is not None:
+            return response
+        # The conditions have been checked above, so skip CheckoutSessionMixin.dispatch
+        return await View.dispatch(self, request, *args, **kwargs)
+
+
+class AsyncStripeSCAPaymentDetailsView(AsyncCheckoutSessionMixin, StripeSCAPaymentDetailsView):
+    """
+    StripeSCAPaymentDetailsView for ASGI deployments: the Checkout Session is created with AsyncFacade, so
+    the worker isn't tied up while Stripe responds.
+    """
+    async def get(self, request, *args, **kwargs):
+        if Facade.get_checkout_mode() == CHECKOUT_MODE_REDIRECT:
+            submission = await sync_to_async(self.build_submission)()
+            customer_email = await sync_to_async(self.get_customer_email)(submission)
+            facade = await sync_to_async(self.get_facade)(submission["basket"], AsyncFacade)
+            try:
+                stripe_session = await facade.begin(
+                    customer_email,
+                    submission["basket"],
+                    submission["order_total"],
+                    submission["shipping_method"])
+            except breaker.CircuitOpenError:
+                stripe_session = None
+            if stripe_session is not None and stripe_session.get("url"):
+                return await sync_to_async(self.redirect_to_stripe)(stripe_session)
+            self.stripe_session = stripe_session
+        ctx = await sync_to_async(super(StripeSCAPaymentDetailsView, self).get_context_data)(**kwargs)
+        stripe_session = getattr(self, "stripe_session", None)
+        if stripe_session is None:
+            customer_email = await sync_to_async(self.get_customer_email)(ctx)
+            facade = await sync_to_async(self.get_facade)(ctx["basket"], AsyncFacade)
+            try:
+                stripe_session = await facade.begin(
+                    customer_email,
+                    ctx["basket"],
+                    ctx["order_total"],
+                    ctx["shipping_method"])
+            except breaker.CircuitOpenError as e:
+                ctx['error'] = Facade.get_friendly_error_message(e)
+                return self.render_to_response(ctx)
+        ctx = await sync_to_async(self.add_stripe_session)(ctx, stripe_session)
+        return self.render_to_response(ctx)
+
+    async def post(self, request, *args, **kwargs):
+        return await sync_to_async(super(AsyncStripeSCAPaymentDetailsView, self).post)(request, *args, **kwargs)
+
+
+class AsyncStripeSCASuccessResponseView(AsyncCheckoutSessionMixin, StripeSCASuccessResponseView):
+    """
+    StripeSCASuccessResponseView for ASGI deployments.  Oscar places orders synchronously, with the Stripe
+    capture in the middle, so the order is placed in a worker thread of its own rather than in the thread
+    all synchronous code shares: a slow Stripe response only holds up the customer waiting on it.
+    """
+    @method_decorator(csrf_exempt)
+    async def dispatch(self, request, *args, **kwargs):
+        return await super(AsyncStripeSCASuccessResponseView, self).dispatch(request, *args, **kwargs)
+
+    async def get(self, request, *args, **kwargs):
+        return await sync_to_async(super(AsyncStripeSCASuccessResponseView, self).get)(request, *args, **kwargs)
+
+    async def post(self, request, *args, **kwargs):
+        return await sync_to_async(self.place_order_in_worker, thread_sensitive=False)(request, *args, **kwargs)
+
+    def place_order_in_worker(self, request, *args, **kwargs):
+        try:
+            return super(AsyncStripeSCASuccessResponseView, self).post(request, *args, **kwargs)
+        finally:
+            # The connections opened by this worker thread
+            connections.close_all()
@@ -0,0 +1,114 @@
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+
+from oscar_stripe_sca import signals
+from oscar_stripe_sca.facade import Facade
+from oscar_stripe_sca.models import StripeCheckoutAttempt, StripeEvent
+from oscar_stripe_sca.session_cache import CheckoutSessionCache
+
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookHandler(object):
+    """
+    Acts on the Stripe events this package cares about.  Each event type is handled by the method named
+    after it, e.g. ``handle_checkout_session_completed``; subclass and add methods to handle more.
+    """
+    def __init__(self, facade=None):
+        self.facade = facade or Facade()
+
+    def process(self, event):
+        """
+        Handle an event once, however many times and however concurrently Stripe delivers it.  The row lock
+        makes concurrent deliveries wait for the first, which then find the event processed.  If handling
+        fails the event stays unprocessed, so Stripe's retry will try again.  Handlers leave their Stripe
+        requests until the event has been committed (see ``capture``), so the lock isn't held while Stripe
+        responds.
+        """
+        with transaction.atomic():
+            StripeEvent.objects.get_or_create(event_id=event.id, defaults={'type': event.type})
+            record = StripeEvent.objects.select_for_update().get(event_id=event.id)
+            if record.date_processed is not None:
+                logger.info("Stripe event %s has already been processed", event.id)
+                return False
+            self.handle(event)
+            record.date_processed = timezone.now()
+            record.save(update_fields=['date_processed'])
+        return True
+
+    def handle(self, event):
+        method = getattr(self, "handle_{0}".format(event.type.replace(".", "_")), None)
+        if method is not None:
+            method(event.data.object)
+        elif event.type.startswith("payment_intent."):
+            self.handle_payment_intent(event.type, event.data.object)
+
+    def handle_checkout_session_completed(self, session):
+        basket_id = session.get("client_reference_id")
+        logger.info("Stripe session %s completed for basket #%s", session.id, basket_id)
+        fields = {'status': StripeCheckoutAttempt.COMPLETE}
+        if session.get("payment_intent"):
+            fields['payment_intent_id'] = session["payment_intent"]
+        StripeCheckoutAttempt.update_session(session.id, statuses=[StripeCheckoutAttempt.OPEN], **fields)
+        if basket_id:
+            # The session has been paid, so it mustn't be offered again for this basket
+            CheckoutSessionCache(facade=self.facade).delete(basket_id)
+        signals.checkout_session_completed.send(sender=self.__class__, session=session, basket_id=basket_id)
+
+    def get_uncaptured_sources(self, intent):
+        """
+        The uncaptured payment sources for the intent.  They are found through the basket of its checkout
+        attempt and the orders placed from it, which are indexed, rather than by the unindexed payment source
+        reference, which is only searched for payments made before attempts were recorded.
+        """
+        sources = self.facade.get_uncaptured_sources().select_related('order').filter(reference=intent.id)
+        attempt = StripeCheckoutAttempt.objects.filter(payment_intent_id=intent.id).exclude(basket=None).first()
+        if attempt is None:
+            return sources
+        return sources.filter(order__basket_id=attempt.basket_id)
+
+    def handle_payment_intent(self, event_type, intent):
+        signals.payment_intent_updated.send(sender=self.__class__, event_type=event_type, payment_intent=intent)
+
+    def handle_payment_intent_amount_capturable_updated(self, intent):
+        """
+        The payment has been authorised.  If the order has already been placed without capturing it, capture
+        it now; otherwise the customer is still on their way back and placing the order will capture it.
+        """
+        self.handle_payment_intent("payment_intent.amount_capturable_updated", intent)
+        if intent.status != "requires_capture":
+            return
+        source = self.get_uncaptured_sources(intent).first()
+        if source is not None:
+            order_number = source.order.number
+            transaction.on_commit(lambda: self.capture(order_number))
+
+    def capture(self, order_number):
+        """
+        Capture an order's payment, once the event asking for it has been recorded.  If the capture fails it
+        isn't tried again for this event: deferred captures stay queued for ``stripe_process_captures``, and
+        ``stripe_capture_authorizations`` picks up any other uncaptured payment.
+        """
+        try:
+            self.facade.capture(order_number)
+        except Exception:
+            logger.exception("Unable to capture the payment for order %s", order_number)
+
+    def handle_payment_intent_succeeded(self, intent):
+        self.handle_payment_intent("payment_intent.succeeded", intent)
+        # Record captures made elsewhere, e.g. from the Stripe dashboard
+        for source in self.get_uncaptured_sources(intent):
+            self.facade.mark_captured(source.order, source)
+
+    def handle_payment_intent_payment_failed(self, intent):
+        logger.warning("Payment failed for Stripe payment intent %s", intent.id)
+        self.handle_payment_intent("payment_intent.payment_failed", intent)
+
+    def handle_payment_intent_canceled(self, intent):
+        logger.warning("Stripe payment intent %s was cancelled", intent.id)
+        StripeCheckoutAttempt.update_payment_intent(
+            intent.id, statuses=StripeCheckoutAttempt.PAYABLE_STATUSES, status=StripeCheckoutAttempt.CANCELLED)
+        self.handle_payment_intent("payment_intent.canceled", intent)
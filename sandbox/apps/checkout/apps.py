@@ -8,9 +8,12 @@ class StripeSCASandboxCheckoutConfig(CheckoutConfig):
     def ready(self):
         super().ready()
         from oscar_stripe_sca import views as stripe_sca_views
+        self.shipping_method_view = stripe_sca_views.StripeSCAShippingMethodView
         self.payment_details_view = stripe_sca_views.StripeSCAPaymentDetailsView
         self.stripe_success_view = stripe_sca_views.StripeSCASuccessResponseView
         self.stripe_cancel_view = stripe_sca_views.StripeSCACancelResponseView
+        self.stripe_webhook_view = stripe_sca_views.StripeSCAWebhookView
+        self.stripe_metrics_view = stripe_sca_views.StripeSCAMetricsView
 
     def get_urls(self):
         urls = super().get_urls()
@@ -19,5 +22,11 @@ class StripeSCASandboxCheckoutConfig(CheckoutConfig):
                 self.stripe_success_view.as_view(preview=True), name='stripe-preview'),
             re_path(r'stripe-payment-cancel/(?P<basket_id>\d+)/$',
                 self.stripe_cancel_view.as_view(), name='stripe-cancel'),
+            re_path(r'stripe-webhook/$',
+                self.stripe_webhook_view.as_view(), name='stripe-webhook'),
+            re_path(r'stripe-webhook/(?P<account>[^/]+)/$',
+                self.stripe_webhook_view.as_view(), name='stripe-account-webhook'),
+            re_path(r'stripe-metrics/$',
+                self.stripe_metrics_view.as_view(), name='stripe-metrics'),
         ]
         return urls
\ No newline at end of file